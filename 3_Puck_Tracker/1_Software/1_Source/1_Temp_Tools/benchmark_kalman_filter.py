@@ -0,0 +1,63 @@
+# Benchmark of the puck Kalman filter against finite difference velocity
+# Simulates a bouncing puck with noisy fixes and dropouts, reports velocity error and time per update
+import numpy as np
+import sys
+import time
+
+# add puck tracker module path
+sys.path.insert(0, '../')
+from puck_kalman_filter import PuckKalmanFilter
+
+camera_fps = 224
+number_of_frames = 20000
+table_size_mm = (1692.3, 774.7)
+measurement_noise_mm = 2.0
+dropout_probability = 0.05
+
+def simulate():
+    """Get true positions, true velocities and noisy fixes (None for dropouts) of a bouncing puck"""
+    random = np.random.RandomState(0)
+    position = np.array([200.0, 200.0])
+    velocity = np.array([1500.0, 900.0])
+    dt = 1.0 / camera_fps
+    positions, velocities, fixes = [], [], []
+    for i in range(number_of_frames):
+        position += velocity*dt
+        for axis in range(2):
+            if not (0 < position[axis] < table_size_mm[axis]):
+                velocity[axis] = -velocity[axis]
+        positions.append(position.copy())
+        velocities.append(velocity.copy())
+        if random.rand() < dropout_probability:
+            fixes.append(None)
+        else:
+            fixes.append(tuple(position + random.randn(2)*measurement_noise_mm))
+    return np.array(positions), np.array(velocities), fixes
+
+if __name__ == '__main__':
+    (positions, velocities, fixes) = simulate()
+    timestamps = np.arange(number_of_frames, dtype=np.float64) / camera_fps
+
+    for constant_acceleration in (False, True):
+        puck_filter = PuckKalmanFilter(constant_acceleration=constant_acceleration, measurement_noise_mm=measurement_noise_mm)
+        estimates = np.zeros((number_of_frames, 2))
+        start_time = time.time()
+        for i in range(number_of_frames):
+            puck_filter.update(timestamps[i], fixes[i])
+            estimates[i] = puck_filter.velocity
+        update_us = (time.time() - start_time) * 1e6 / number_of_frames
+        error = np.sqrt(np.mean((estimates[10:] - velocities[10:])**2))
+        model = "constant acceleration" if constant_acceleration else "constant velocity"
+        print "Kalman filter (%s): %.1f us/update, velocity RMS error %.0f mmps" % (model, update_us, error)
+
+    # the old way, difference consecutive fixes and skip over missing ones
+    estimates = np.zeros((number_of_frames, 2))
+    last_fix = None
+    for i in range(number_of_frames):
+        if fixes[i] is not None and last_fix is not None:
+            estimates[i] = (np.array(fixes[i]) - np.array(last_fix)) * camera_fps
+        elif i > 0:
+            estimates[i] = estimates[i - 1]
+        last_fix = fixes[i]
+    error = np.sqrt(np.mean((estimates[10:] - velocities[10:])**2))
+    print "Finite difference: velocity RMS error %.0f mmps" % error
@@ -0,0 +1,169 @@
+# Benchmark of the multi object detector against the first puck sized contour search it replaced
+# Checks the vectorized contour statistics against OpenCV, then tracks a synthetic puck on a table with a robot
+# paddle, a human paddle partly hidden by the hand holding it and a puck sized patch of glare of the puck colour, and
+# reports how often each detector took something else for the puck, the human paddle
+# position error and frames per second
+import numpy as np
+import cv2
+import sys
+import time
+
+# add puck tracker module path
+sys.path.insert(0, '../')
+import puck_tracker as pt
+from blob_detector import get_contour_stats
+
+number_of_frames = 2000
+frame_width = 615
+frame_height = 454
+puck_radius_px = 16
+paddle_radius_px = 24
+puck_color_bgr = (0, 200, 0)
+background_bgr = (230, 230, 230)
+glare_center = (420, 150)
+glare_axes = (22, 10)
+wrong_object_distance_px = 8    # a fix further than this from the puck is something else
+
+def check_contour_stats():
+    """Compare get_contour_stats() with cv2.moments and cv2.contourArea on random blobs, returns the largest differences"""
+    random = np.random.RandomState(0)
+    largest_centroid_difference = 0.0
+    largest_area_difference = 0.0
+    for i in range(200):
+        mask = np.zeros((frame_height, frame_width), dtype=np.uint8)
+        for j in range(random.randint(1, 10)):
+            center = (random.randint(0, frame_width), random.randint(0, frame_height))
+            axes = (random.randint(1, 40), random.randint(1, 40))
+            cv2.ellipse(mask, center, axes, random.randint(0, 180), 0, 360, 255, -1)
+        contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        blobs = get_contour_stats(contours)
+        expected = []
+        for contour in contours:
+            M = cv2.moments(contour)
+            if M["m00"] != 0:
+                expected.append((M["m10"] / M["m00"], M["m01"] / M["m00"], cv2.contourArea(contour)))
+        expected = np.array(expected).reshape(-1, 3)
+        if len(expected) != len(blobs.x):
+            return (np.inf, np.inf)
+        if len(expected) > 0:
+            largest_centroid_difference = max(largest_centroid_difference, np.abs(expected[:, 0] - blobs.x).max(),
+                                              np.abs(expected[:, 1] - blobs.y).max())
+            largest_area_difference = max(largest_area_difference, np.abs(expected[:, 2] - blobs.area).max())
+    return (largest_centroid_difference, largest_area_difference)
+
+def make_frames():
+    """Create frames of the puck bouncing around the table with the paddles and glare, and where the puck and
+    human paddle really are in each"""
+    frames = []
+    puck_positions = []
+    human_paddle_positions = []
+    x, y = 100.0, 100.0
+    dx, dy = 4.0, 3.0
+    background = np.full((frame_height, frame_width, 3), background_bgr, dtype=np.uint8)
+    cv2.ellipse(background, glare_center, glare_axes, 30, 0, 360, puck_color_bgr, -1)
+    for i in range(number_of_frames):
+        frame = background.copy()
+        cv2.circle(frame, (int(x), int(y)), puck_radius_px, puck_color_bgr, -1)
+
+        # robot paddle sliding across its end of the table
+        robot_y = frame_height/2 + 150*np.sin(i / 40.0)
+        cv2.circle(frame, (60, int(robot_y)), paddle_radius_px, puck_color_bgr, -1)
+
+        # human paddle following the puck across its end, with the hand holding it over one edge
+        human_x = frame_width - 80 + 30*np.sin(i / 25.0)
+        human_y = frame_height/2 + 0.6*(y - frame_height/2)
+        cv2.circle(frame, (int(human_x), int(human_y)), paddle_radius_px, puck_color_bgr, -1)
+        cv2.rectangle(frame, (int(human_x) - paddle_radius_px - 1, int(human_y) - paddle_radius_px - 1),
+                      (int(human_x) + paddle_radius_px + 1, int(human_y) - paddle_radius_px + 8), background_bgr, -1)
+
+        frames.append(frame)
+        puck_positions.append((int(x), int(y)))
+        human_paddle_positions.append((human_x, human_y))
+        if not (puck_radius_px < x + dx < frame_width - puck_radius_px):
+            dx = -dx
+        if not (puck_radius_px < y + dy < frame_height - puck_radius_px):
+            dy = -dy
+        x += dx
+        y += dy
+    return frames, np.array(puck_positions, dtype=np.float64), np.array(human_paddle_positions)
+
+def old_find_puck_contour(frame):
+    """The puck search before blob_detector.py: the first contour of puck size, returns its centroid or None"""
+    puck_mask = pt.get_colour_mask(frame, pt.puck_lower_hsv, pt.puck_upper_hsv)
+    contour_list = cv2.findContours(puck_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    for contour in contour_list:
+        contour_area = cv2.contourArea(contour)
+        if pt.puck_minimum_area < contour_area < pt.puck_maximum_area:
+            ((x, y), radius) = cv2.minEnclosingCircle(contour)
+            if pt.puck_minimum_radius < radius < pt.puck_maximum_radius:
+                M = cv2.moments(contour)
+                if M["m00"] != 0:
+                    return (M["m10"] / M["m00"], M["m01"] / M["m00"])
+    return None
+
+def old_get_puck_position(frame, timestamp):
+    """The region of interest then full frame search before blob_detector.py, sets pt.puck_position_mm_x/y"""
+    puck = None
+    if pt.puck_filter.valid:
+        (x0, y0, x1, y1) = pt.get_puck_search_window(frame.shape, timestamp)
+        if (x1 - x0) > 2*pt.puck_minimum_radius and (y1 - y0) > 2*pt.puck_minimum_radius:
+            puck = old_find_puck_contour(frame[y0:y1, x0:x1])
+            if puck is not None:
+                puck = (puck[0] + x0, puck[1] + y0)
+    if puck is None:
+        puck = old_find_puck_contour(frame)
+    pt.puck_lost = puck is None
+    (pt.puck_position_mm_x, pt.puck_position_mm_y) = puck if puck is not None else (0, 0)
+
+def run(frames, puck_positions, human_paddle_positions, get_position):
+    """Track the puck through every frame, returns frames per second, misses, fixes on the wrong object and the
+    median human paddle error (pixels)"""
+    pt.puck_lost = True
+    pt.puck_filter.reset()
+    pt.human_paddle_track.reset()
+    pt.robot_paddle_track.reset()
+    misses = 0
+    wrong = 0
+    human_paddle_errors = []
+    start_time = time.time()
+    for (i, frame) in enumerate(frames):
+        # pretend the frames came from the camera at full frame rate
+        timestamp = float(i) / pt.camera_fps
+        get_position(frame, timestamp)
+        if pt.puck_lost:
+            misses += 1
+        elif np.hypot(pt.puck_position_mm_x - puck_positions[i][0], pt.puck_position_mm_y - puck_positions[i][1]) > wrong_object_distance_px:
+            wrong += 1
+        pt.get_puck_state(timestamp)
+        if pt.human_paddle_valid:
+            human_paddle_errors.append(np.hypot(pt.human_paddle_position_mm_x - human_paddle_positions[i][0],
+                                                pt.human_paddle_position_mm_y - human_paddle_positions[i][1]))
+    elapsed_time = time.time() - start_time
+    paddle_error = np.median(human_paddle_errors) if human_paddle_errors else np.nan
+    return (len(frames) / elapsed_time, misses, wrong, paddle_error)
+
+if __name__ == '__main__':
+    pt.settings_path = "../../../../6_User_Interface/1_Software/4_Json/"
+    pt.get_puck_tracker_settings()
+    pt.mm_per_pixel_x = 1.0
+    pt.mm_per_pixel_y = 1.0
+    pt.roi_search_enabled = True
+
+    (centroid_difference, area_difference) = check_contour_stats()
+    if centroid_difference > 1e-6 or area_difference > 1e-6:
+        print "Contour statistics differ from OpenCV: centroid %g px, area %g px^2" % (centroid_difference, area_difference)
+        sys.exit(1)
+    print "Contour statistics match cv2.moments and cv2.contourArea"
+
+    (frames, puck_positions, human_paddle_positions) = make_frames()
+    print "Frame size: %ix%i, %i frames" % (frame_width, frame_height, number_of_frames)
+    print "%-30s %8s %8s %8s %16s" % ("detector", "fps", "misses", "wrong", "human paddle err")
+    results = [("first puck sized contour", False, old_get_puck_position),
+               ("multi object, puck only", False, pt.get_puck_position),
+               ("multi object", True, pt.get_puck_position)]
+    for (name, paddle_tracking_enabled, get_position) in results:
+        pt.paddle_tracking_enabled = paddle_tracking_enabled
+        (fps, misses, wrong, paddle_error) = run([frame.copy() for frame in frames], puck_positions,
+                                                 human_paddle_positions, get_position)
+        print "%-30s %8.0f %8i %8i %16s" % (name, fps, misses, wrong,
+                                            "-" if np.isnan(paddle_error) else "%.1f px" % paddle_error)
@@ -0,0 +1,66 @@
+# Benchmark of the puck tracker region of interest search versus a full frame search
+# Moves a synthetic puck around a warped-size table image and reports frames per second for each mode
+import numpy as np
+import cv2
+import sys
+import time
+
+# add puck tracker module path
+sys.path.insert(0, '../')
+import puck_tracker as pt
+
+number_of_frames = 2000
+frame_width = 615
+frame_height = 454
+puck_radius_px = 16
+puck_color_bgr = (0, 200, 0)
+
+def make_frames():
+    """Create frames of a puck bouncing around an empty table"""
+    frames = []
+    x, y = 100.0, 100.0
+    dx, dy = 4.0, 3.0
+    background = np.full((frame_height, frame_width, 3), 230, dtype=np.uint8)
+    for i in range(number_of_frames):
+        frame = background.copy()
+        cv2.circle(frame, (int(x), int(y)), puck_radius_px, puck_color_bgr, -1)
+        frames.append(frame)
+        if not (puck_radius_px < x + dx < frame_width - puck_radius_px):
+            dx = -dx
+        if not (puck_radius_px < y + dy < frame_height - puck_radius_px):
+            dy = -dy
+        x += dx
+        y += dy
+    return frames
+
+def run(frames, roi_search_enabled):
+    """Track the puck through every frame, returns frames per second and number of misses"""
+    pt.roi_search_enabled = roi_search_enabled
+    pt.puck_lost = True
+    pt.puck_filter.reset()
+    misses = 0
+    start_time = time.time()
+    for (i, frame) in enumerate(frames):
+        # pretend the frames came from the camera at full frame rate
+        timestamp = float(i) / pt.camera_fps
+        pt.get_puck_position(frame, timestamp)
+        pt.get_puck_state(timestamp)
+        if pt.puck_lost:
+            misses += 1
+    elapsed_time = time.time() - start_time
+    return (len(frames) / elapsed_time, misses)
+
+if __name__ == '__main__':
+    pt.settings_path = "../../../../6_User_Interface/1_Software/4_Json/"
+    pt.get_puck_tracker_settings()
+    pt.mm_per_pixel_x = 1.0
+    pt.mm_per_pixel_y = 1.0
+
+    frames = make_frames()
+    full_fps, full_misses = run([frame.copy() for frame in frames], False)
+    roi_fps, roi_misses = run([frame.copy() for frame in frames], True)
+
+    print "Frame size: %ix%i, %i frames" % (frame_width, frame_height, number_of_frames)
+    print "Full frame search: %.0f fps (%i misses)" % (full_fps, full_misses)
+    print "ROI search:        %.0f fps (%i misses)" % (roi_fps, roi_misses)
+    print "Speedup:           %.1fx" % (roi_fps / full_fps)
@@ -0,0 +1,98 @@
+# Benchmark of the sub-pixel puck centroid refinement
+# Tracks a synthetic puck drawn anti-aliased at sub-pixel positions, with camera noise, sliding slowly across the
+# table in a straight line, with the refinement off and on. Reports the jitter of the raw fixes and of the filtered
+# velocity against the true path, frames per second, and what one refinement costs in the middle of the frame and
+# at its corner (the patch is moved in from the edges, so the cost should be the same)
+import numpy as np
+import cv2
+import sys
+import time
+
+# add puck tracker module path
+sys.path.insert(0, '../')
+import puck_tracker as pt
+
+number_of_frames = 1000
+frame_width = 615
+frame_height = 454
+puck_radius_px = 15.5               # anti-aliased, so the whole disc counts towards its area
+puck_color_bgr = (0, 200, 0)
+background_bgr = (230, 230, 230)
+start_position = (100.3, 80.7)
+velocity_px = (0.41, 0.27)          # pixels per frame, slow enough that the whole pixel steps show
+noise_sigma = 3.0                   # camera noise, grey levels
+warm_up_frames = 50                 # frames given to the filter before its velocity is compared
+number_of_refinements = 20000
+subpixel_shift = 8                  # fractional bits of the centre and radius passed to cv2.circle
+
+def make_frames():
+    """Create frames of the puck moving in a straight line and where it really is in each"""
+    random = np.random.RandomState(0)
+    frames = []
+    positions = []
+    scale = 1 << subpixel_shift
+    for i in range(number_of_frames):
+        x = start_position[0] + velocity_px[0]*i
+        y = start_position[1] + velocity_px[1]*i
+        frame = np.full((frame_height, frame_width, 3), background_bgr, dtype=np.uint8)
+        cv2.circle(frame, (int(round(x*scale)), int(round(y*scale))), int(round(puck_radius_px*scale)),
+                   puck_color_bgr, -1, cv2.LINE_AA, subpixel_shift)
+        noise = random.normal(0, noise_sigma, frame.shape)
+        frames.append(np.clip(frame + noise, 0, 255).astype(np.uint8))
+        positions.append((x, y))
+    return frames, np.array(positions)
+
+def run(frames, positions):
+    """Track the puck through every frame, returns frames per second, the fix jitter (pixels) and the filtered
+    velocity error (pixels/s), both RMS about the true path"""
+    pt.puck_lost = True
+    pt.puck_filter.reset()
+    fix_errors = []
+    velocity_errors = []
+    start_time = time.time()
+    for (i, frame) in enumerate(frames):
+        # pretend the frames came from the camera at full frame rate
+        timestamp = float(i) / pt.camera_fps
+        pt.get_puck_position(frame, timestamp)
+        if not pt.puck_lost:
+            fix_errors.append((pt.puck_position_mm_x - positions[i][0], pt.puck_position_mm_y - positions[i][1]))
+        if pt.get_puck_state(timestamp) and i >= warm_up_frames:
+            velocity_errors.append((pt.puck_velocity_mmps_x - velocity_px[0]*pt.camera_fps,
+                                    pt.puck_velocity_mmps_y - velocity_px[1]*pt.camera_fps))
+    elapsed_time = time.time() - start_time
+
+    # jitter about any constant offset, the refinement isn't meant to move the centroid on average
+    fix_errors = np.array(fix_errors)
+    fix_jitter = np.sqrt(np.sum(np.var(fix_errors, axis=0)))
+    velocity_error = np.sqrt(np.mean(np.sum(np.square(velocity_errors), axis=1)))
+    return (len(frames) / elapsed_time, fix_jitter, velocity_error)
+
+def time_refinement(frame, position):
+    """Time one refinement of the puck centroid at position (x, y), returns microseconds"""
+    start_time = time.time()
+    for i in xrange(number_of_refinements):
+        pt.subpixel_centroid.refine(frame, position, puck_radius_px + 2, pt.puck_lower_hsv, pt.puck_upper_hsv)
+    return 1e6*(time.time() - start_time) / number_of_refinements
+
+if __name__ == '__main__':
+    pt.settings_path = "../../../../6_User_Interface/1_Software/4_Json/"
+    pt.get_puck_tracker_settings()
+    pt.mm_per_pixel_x = 1.0
+    pt.mm_per_pixel_y = 1.0
+    pt.roi_search_enabled = True
+    pt.paddle_tracking_enabled = False
+
+    (frames, positions) = make_frames()
+    print "Frame size: %ix%i, %i frames, puck moving %.2f, %.2f px/frame, noise %.0f grey levels" % (
+        frame_width, frame_height, number_of_frames, velocity_px[0], velocity_px[1], noise_sigma)
+    print "%-22s %8s %16s %20s" % ("centroid", "fps", "fix jitter", "velocity error")
+    results = []
+    for (name, enabled) in [("mask moments", False), ("sub-pixel refinement", True)]:
+        pt.subpixel_refinement_enabled = enabled
+        (fps, fix_jitter, velocity_error) = run([frame.copy() for frame in frames], positions)
+        results.append((fix_jitter, velocity_error))
+        print "%-22s %8.0f %13.3f px %15.1f px/s" % (name, fps, fix_jitter, velocity_error)
+    print "Jitter reduction: fix %.1fx, velocity %.1fx" % (results[0][0] / results[1][0], results[0][1] / results[1][1])
+
+    print "Refinement cost: %.1f us in the middle of the frame, %.1f us in the corner" % (
+        time_refinement(frames[0], (frame_width / 2.0, frame_height / 2.0)), time_refinement(frames[0], (5.0, 5.0)))
@@ -0,0 +1,58 @@
+# Benchmark of the per-frame perspective correction cost in the puck tracker
+# Compares warpPerspective, the cached fixed point remap tables and centroid only transformation
+import numpy as np
+import cv2
+import sys
+import time
+
+# add puck tracker module path
+sys.path.insert(0, '../')
+import puck_tracker as pt
+
+number_of_frames = 1000
+puck_center_px = (100, 240)
+puck_radius_px = 16
+puck_color_bgr = (0, 200, 0)
+
+def time_per_frame(function, frame):
+    """Average time in ms for one call of function(frame)"""
+    start_time = time.time()
+    for i in range(number_of_frames):
+        function(frame)
+    return (time.time() - start_time) * 1000 / number_of_frames
+
+if __name__ == '__main__':
+    pt.settings_path = "../../../../6_User_Interface/1_Software/4_Json/"
+    pt.get_puck_tracker_settings()
+    pt.get_perspective_transform_matrix()
+    pt.roi_search_enabled = False
+
+    # the puck changes size slightly when warped, so open up the area limits for this test
+    pt.puck_minimum_area = 400
+    pt.puck_maximum_area = 1000
+
+    frame = np.full((pt.camera_vertical_resolution, pt.camera_horizontal_resolution, 3), 230, dtype=np.uint8)
+    cv2.circle(frame, puck_center_px, puck_radius_px, puck_color_bgr, -1)
+    frame_size = (pt.max_frame_width, pt.max_frame_height)
+
+    # the cached remap tables must give the same picture as warpPerspective
+    frame_warped = cv2.warpPerspective(frame, pt.perspective_transform_matrix, frame_size)
+    difference = cv2.absdiff(frame_warped, pt.warp_frame(frame))
+    print "Remap vs warpPerspective max pixel difference: %i" % difference.max()
+
+    # and the puck should end up in the same place whether we warp the frame or just the centroid
+    pt.get_puck_position(frame_warped.copy(), 0)
+    warped_position = (pt.puck_position_mm_x, pt.puck_position_mm_y)
+    pt.get_puck_position(frame.copy(), 0, camera_space=True)
+    centroid_position = (pt.puck_position_mm_x, pt.puck_position_mm_y)
+    print "Puck position warped frame: (%.1f, %.1f) mm, centroid only: (%.1f, %.1f) mm" % (warped_position + centroid_position)
+
+    warp_perspective_ms = time_per_frame(lambda f: cv2.warpPerspective(f, pt.perspective_transform_matrix, frame_size, flags=cv2.INTER_LINEAR), frame)
+    remap_ms = time_per_frame(pt.warp_frame, frame)
+    warped_tracking_ms = time_per_frame(lambda f: pt.get_puck_position(pt.warp_frame(f), 0), frame)
+    centroid_tracking_ms = time_per_frame(lambda f: pt.get_puck_position(f, 0, camera_space=True), frame)
+
+    print "warpPerspective:            %.3f ms/frame" % warp_perspective_ms
+    print "Fixed point remap:          %.3f ms/frame" % remap_ms
+    print "Remap + detect:             %.3f ms/frame" % warped_tracking_ms
+    print "Centroid only + detect:     %.3f ms/frame" % centroid_tracking_ms
@@ -0,0 +1,205 @@
+# Blob detection and association for the puck tracker
+# Finds every blob of a colour in one pass, works out the shape of all of them at once with numpy and picks
+# which blob belongs to which tracked object, so a paddle or a patch of glare can't be taken for the puck
+import collections
+import cv2
+import numpy as np
+
+# centroids (x, y), areas (pixels^2), radii (pixels) and circularities (1 for a circle) of a set of blobs, as arrays
+Blobs = collections.namedtuple('Blobs', ['x', 'y', 'area', 'radius', 'circularity'])
+
+def get_empty_blobs():
+    """Get a Blobs with no blobs in it"""
+    empty = np.zeros(0)
+    return Blobs(empty, empty, empty, empty, empty)
+
+def get_contour_stats(contours, offsets=None, pixel_size=None):
+    """Get the centroid, area, radius and circularity of every contour from cv2.findContours in one go
+    The area and centroid are the polygon moments cv2.contourArea and cv2.moments give for each contour, the radius
+    is the distance from the centroid to the furthest point of the contour (the cv2.minEnclosingCircle radius for a
+    round blob, more for an irregular one) and the circularity is 4*pi*area/perimeter^2.
+    offsets is an (n, 2) array added to each contour's centroid, or None.
+    pixel_size is the (x, y) size of a pixel the circularity is measured at, for pixels that aren't square (a
+    round object is stretched into an ellipse in them), or None for square pixels.
+    Contours with no area have no centroid and are left out"""
+    if len(contours) == 0:
+        return get_empty_blobs()
+
+    # every point of every contour in one array, starts[i] is where contour i begins
+    counts = np.array([len(contour) for contour in contours])
+    starts = np.zeros(len(counts), dtype=np.intp)
+    starts[1:] = np.cumsum(counts)[:-1]
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.float64)
+    x = points[:, 0]
+    y = points[:, 1]
+
+    # the point after each one going round its contour, the last point of a contour joins back to its first
+    following = np.arange(1, len(points) + 1)
+    following[starts + counts - 1] = starts
+    x_next = x[following]
+    y_next = y[following]
+
+    # shoelace area and the polygon centroid, both signed by the direction of the contour so the signs cancel
+    cross = x*y_next - x_next*y
+    twice_area = np.add.reduceat(cross, starts)
+    has_area = twice_area != 0
+    twice_area[~has_area] = 1.0
+    centroid_x = np.add.reduceat((x + x_next)*cross, starts) / (3*twice_area)
+    centroid_y = np.add.reduceat((y + y_next)*cross, starts) / (3*twice_area)
+    area = np.abs(twice_area) / 2
+    (size_x, size_y) = pixel_size if pixel_size is not None else (1.0, 1.0)
+    perimeter = np.add.reduceat(np.hypot(size_x*(x_next - x), size_y*(y_next - y)), starts)
+
+    contour_index = np.repeat(np.arange(len(counts)), counts)
+    radius = np.maximum.reduceat(np.hypot(x - centroid_x[contour_index], y - centroid_y[contour_index]), starts)
+    circularity = 4*np.pi*area*size_x*size_y / np.maximum(perimeter, 1e-9)**2
+
+    if offsets is not None:
+        centroid_x += offsets[:, 0]
+        centroid_y += offsets[:, 1]
+
+    return Blobs(centroid_x[has_area], centroid_y[has_area], area[has_area], radius[has_area], circularity[has_area])
+
+def get_colour_mask(frame, lower_hsv, upper_hsv):
+    """Get the median filtered mask of the pixels of a BGR frame within a HSV colour range"""
+    frame_hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(frame_hsv, lower_hsv, upper_hsv)
+    return cv2.medianBlur(mask, 5)
+
+def find_blobs(frame, lower_hsv, upper_hsv, regions=None, pixel_size=None):
+    """Find every blob of a colour in a BGR frame, or in each region (x0, y0, x1, y1) of it, as a Blobs with
+    centroids in frame pixels. Regions must not overlap or a blob in both is found twice, see merge_regions()
+    pixel_size is passed on to get_contour_stats() for the circularity"""
+    if regions is None:
+        regions = [(0, 0, frame.shape[1], frame.shape[0])]
+
+    contour_list = []
+    offsets = []
+    for (x0, y0, x1, y1) in regions:
+        mask = get_colour_mask(frame[y0:y1, x0:x1], lower_hsv, upper_hsv)
+        contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        contour_list.extend(contours)
+        offsets.extend([(x0, y0)] * len(contours))
+
+    return get_contour_stats(contour_list, np.array(offsets, dtype=np.float64).reshape(-1, 2), pixel_size)
+
+def merge_regions(regions):
+    """Join overlapping regions (x0, y0, x1, y1) into their bounding box until none overlap"""
+    regions = list(regions)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                (ax0, ay0, ax1, ay1) = regions[i]
+                (bx0, by0, bx1, by1) = regions[j]
+                if ax0 < bx1 and bx0 < ax1 and ay0 < by1 and by0 < ay1:
+                    regions[i] = (min(ax0, bx0), min(ay0, by0), max(ax1, bx1), max(ay1, by1))
+                    del regions[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return regions
+
+def select_blob(blobs, candidates, predicted=None, gate_distance=1.0, circularity_weight=2.0):
+    """Pick the blob that best fits an object out of the candidates (a boolean mask over blobs), returns its index
+    or None if there are no candidates. Each candidate costs its distance from the object's predicted position
+    (x, y) in gate distances, when there is a prediction, plus circularity_weight times how far from round it is"""
+    indexes = np.flatnonzero(candidates)
+    if len(indexes) == 0:
+        return None
+    cost = circularity_weight * (1 - np.minimum(blobs.circularity[indexes], 1))
+    if predicted is not None:
+        cost += np.hypot(blobs.x[indexes] - predicted[0], blobs.y[indexes] - predicted[1]) / gate_distance
+    return indexes[np.argmin(cost)]
+
+class ObjectTrack(object):
+    """Position and velocity of an object that has no filter of its own (a paddle) from its detections
+
+    The velocity is the change in position between detections, exponentially smoothed. An object that hasn't
+    been seen for max_coast_time is lost and found again from scratch.
+    """
+
+    def __init__(self, max_coast_time=0.1, velocity_smoothing=0.5):
+        self.max_coast_time = max_coast_time            # how long to predict through missed detections (s)
+        self.velocity_smoothing = velocity_smoothing    # share of each new velocity taken (0-1)
+        self.reset()
+
+    def reset(self):
+        """Forget the object"""
+        self.position = (0.0, 0.0)
+        self.velocity = (0.0, 0.0)
+        self.timestamp = None
+        self.valid = False
+
+    def update(self, timestamp, position):
+        """Add a detection at position (x, y) at timestamp (s), or None if the object wasn't found"""
+        if position is None:
+            if self.valid and timestamp - self.timestamp > self.max_coast_time:
+                self.reset()
+            return
+
+        if self.valid and timestamp > self.timestamp:
+            dt = timestamp - self.timestamp
+            alpha = self.velocity_smoothing
+            self.velocity = (self.velocity[0] + alpha*((position[0] - self.position[0])/dt - self.velocity[0]),
+                             self.velocity[1] + alpha*((position[1] - self.position[1])/dt - self.velocity[1]))
+        elif not self.valid:
+            self.velocity = (0.0, 0.0)
+        self.position = (float(position[0]), float(position[1]))
+        self.timestamp = timestamp
+        self.valid = True
+
+    def predicted_position(self, timestamp):
+        """Get where the object should be at timestamp (s)"""
+        dt = timestamp - self.timestamp
+        return (self.position[0] + self.velocity[0]*dt, self.position[1] + self.velocity[1]*dt)
+
+class SubpixelCentroid(object):
+    """Intensity weighted centroid of a blob, to a fraction of a pixel, over a fixed size patch of the frame
+
+    The centroid of a blob in a thresholded mask is quantized by the threshold: each pixel on the edge of the blob is
+    all in or all out. Here each pixel within the colour's hue and value range counts by how far its saturation is
+    over the threshold instead, so an edge pixel the blob only partly covers counts in part. Only pixels within a
+    radius of the blob are counted so a paddle or glare next to it doesn't pull the centroid over.
+
+    The patch is always the same size, moved in from the edges of the frame rather than cut off, and every buffer is
+    allocated once, so refining a centroid costs the same every frame.
+    """
+
+    def __init__(self, half_size):
+        size = 2*half_size + 1
+        self.half_size = half_size
+        self.size = size
+        self.hsv = np.empty((size, size, 3), dtype=np.uint8)
+        self.in_range = np.empty((size, size), dtype=np.uint8)
+        self.near_blob = np.empty((size, size), dtype=np.uint8)
+        self.weights = np.empty((size, size), dtype=np.uint8)
+
+    def refine(self, frame, position, radius, lower_hsv, upper_hsv):
+        """Get the centroid (x, y) in frame pixels of the blob of a colour at position (x, y) with radius (pixels)
+        in a BGR frame, or position as it was if the frame is smaller than the patch or none of the colour is near"""
+        size = self.size
+        (height, width) = frame.shape[:2]
+        if width < size or height < size:
+            return position
+        x0 = min(max(int(position[0]) - self.half_size, 0), width - size)
+        y0 = min(max(int(position[1]) - self.half_size, 0), height - size)
+
+        # pixels of the colour's hue and value within radius of the blob
+        cv2.cvtColor(frame[y0:y0 + size, x0:x0 + size], cv2.COLOR_BGR2HSV, self.hsv)
+        cv2.inRange(self.hsv, (lower_hsv[0], 0, lower_hsv[2]), (upper_hsv[0], 255, upper_hsv[2]), self.in_range)
+        self.near_blob.fill(0)
+        cv2.circle(self.near_blob, (int(round(position[0])) - x0, int(round(position[1])) - y0), int(round(radius)), 255, -1)
+        cv2.bitwise_and(self.in_range, self.near_blob, self.in_range)
+
+        # weighted by saturation over the threshold, the subtraction stops at 0
+        cv2.extractChannel(self.hsv, 1, self.weights)
+        cv2.subtract(self.weights, lower_hsv[1], self.weights)
+        cv2.bitwise_and(self.weights, self.in_range, self.weights)
+
+        M = cv2.moments(self.weights)
+        if M["m00"] == 0:
+            return position
+        return (x0 + M["m10"] / M["m00"], y0 + M["m01"] / M["m00"])
@@ -0,0 +1,97 @@
+# Camera capture thread for the puck tracker
+# Grabs frames continuously so capture overlaps with processing, and always hands out the freshest frame
+import cv2
+import numpy as np
+import threading
+
+driver_timestamp_tolerance = 1.0    # a driver timestamp further than this from get_time() isn't on its clock (s)
+
+def get_frame_timestamp(video_stream, now):
+    """Get the capture time (s) of the last frame read from the camera at now, and whether the driver gave it
+    V4L2 stamps frames on the same monotonic clock as getTickCount, but other drivers give the time into the
+    stream or the wall clock. A timestamp that isn't within driver_timestamp_tolerance of now is taken to be one
+    of those and the frame is timestamped with now instead"""
+    timestamp = video_stream.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+    if timestamp > 0 and abs(now - timestamp) < driver_timestamp_tolerance:
+        return (timestamp, True)
+    return (now, False)
+
+def get_time():
+    """Get the monotonic time (s), comparable between processes"""
+    return cv2.getTickCount() / cv2.getTickFrequency()
+
+class CameraGrabber(threading.Thread):
+    """Reads frames from an open cv2.VideoCapture into a small pool of preallocated buffers
+
+    One buffer holds the newest frame, one is held by the processing loop and the rest are
+    filled by the camera. A frame that is replaced before anyone took it is counted as skipped
+    rather than queued, so the processing loop never works on stale data.
+    """
+
+    def __init__(self, video_stream, frame_shape, pool_size=3):
+        super(CameraGrabber, self).__init__(name="camera_grabber")
+        self.daemon = True
+        self.video_stream = video_stream
+        self.pool = [np.zeros(frame_shape, dtype=np.uint8) for i in range(max(pool_size, 3))]
+        self.timestamps = [0.0] * len(self.pool)
+        self.condition = threading.Condition()
+        self.latest_index = None        # buffer with the newest frame not yet taken
+        self.held_index = None          # buffer the processing loop is working on
+        self.running = True
+        self.camera_ok = True
+        self.frames_grabbed = 0
+        self.frames_skipped = 0
+        self.timestamp_fallbacks = 0    # frames timestamped with get_time() because the driver's timestamp was missing or off
+
+    def run(self):
+        while self.running:
+            with self.condition:
+                index = self.get_free_index()
+
+            # the read releases the GIL, so the camera runs in parallel with frame processing
+            ret, frame = self.video_stream.read(self.pool[index])
+            (timestamp, driver_timestamp) = get_frame_timestamp(self.video_stream, get_time())
+
+            with self.condition:
+                self.camera_ok = ret
+                if ret:
+                    self.pool[index] = frame
+                    self.timestamps[index] = timestamp
+                    self.frames_grabbed += 1
+                    if not driver_timestamp:
+                        self.timestamp_fallbacks += 1
+                    if self.latest_index is not None:
+                        self.frames_skipped += 1
+                    self.latest_index = index
+                self.condition.notify()
+
+    def get_free_index(self):
+        """Get a buffer that is neither the newest frame nor held by the processing loop"""
+        for index in range(len(self.pool)):
+            if index != self.latest_index and index != self.held_index:
+                return index
+
+    def get_frame(self, timeout=1.0):
+        """Wait for the next fresh frame, returns (ret, frame, capture timestamp)
+        The frame stays valid until the next call"""
+        with self.condition:
+            if self.latest_index is None:
+                self.condition.wait(timeout)
+            if self.latest_index is None:
+                return (False, None, 0.0)
+
+            self.held_index = self.latest_index
+            self.latest_index = None
+            return (self.camera_ok, self.pool[self.held_index], self.timestamps[self.held_index])
+
+    def get_stats(self):
+        """Frames grabbed, skipped and timestamped with get_time() instead of by the driver"""
+        with self.condition:
+            return {'frames_grabbed': self.frames_grabbed,
+                    'frames_skipped': self.frames_skipped,
+                    'timestamp_fallbacks': self.timestamp_fallbacks}
+
+    def stop(self):
+        """Stop grabbing and wait for the thread to finish"""
+        self.running = False
+        self.join(1.0)
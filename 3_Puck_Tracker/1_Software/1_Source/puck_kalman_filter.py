@@ -0,0 +1,123 @@
+# Kalman filter state estimator for the puck tracker
+# Estimates puck position and velocity (and optionally acceleration) from noisy position fixes
+import numpy as np
+
+class PuckKalmanFilter(object):
+    """Constant velocity (or constant acceleration) Kalman filter for the puck on the table
+
+    Both axes share the same motion model and measurement noise, so they also share one
+    covariance matrix. The state is stored as an (n x 2) array, one column per axis, which
+    lets a single set of small matrix operations update x and y together.
+    """
+
+    def __init__(self, constant_acceleration=False, process_noise=1e7, measurement_noise_mm=2.0,
+                 initial_velocity_variance=1e6, max_coast_time=0.1):
+        self.constant_acceleration = constant_acceleration
+        self.process_noise = process_noise                      # spectral density of the unmodelled motion
+        self.measurement_noise = measurement_noise_mm ** 2      # variance of a single position fix (mm^2)
+        self.initial_velocity_variance = initial_velocity_variance
+        self.max_coast_time = max_coast_time                    # how long to predict through dropouts (s)
+        self.order = 3 if constant_acceleration else 2
+        self.state = np.zeros((self.order, 2))
+        self.covariance = np.zeros((self.order, self.order))
+        self.transition = np.eye(self.order)
+        self.noise = np.zeros((self.order, self.order))
+        self.reset()
+
+    def reset(self):
+        """Forget the current track, the next fix starts a new one"""
+        self.state.fill(0)
+        self.covariance.fill(0)
+        self.timestamp = None
+        self.last_fix_timestamp = None
+        self.valid = False
+        self.coasting = False
+
+    def set_time_step(self, dt):
+        """Fill in the state transition and process noise matrices for a time step of dt seconds"""
+        F = self.transition
+        Q = self.noise
+        q = self.process_noise
+        F[0, 1] = dt
+        if self.constant_acceleration:
+            # white noise jerk model
+            F[0, 2] = 0.5 * dt**2
+            F[1, 2] = dt
+            Q[0, 0] = q * dt**5 / 20
+            Q[0, 1] = Q[1, 0] = q * dt**4 / 8
+            Q[0, 2] = Q[2, 0] = q * dt**3 / 6
+            Q[1, 1] = q * dt**3 / 3
+            Q[1, 2] = Q[2, 1] = q * dt**2 / 2
+            Q[2, 2] = q * dt
+        else:
+            # white noise acceleration model
+            Q[0, 0] = q * dt**3 / 3
+            Q[0, 1] = Q[1, 0] = q * dt**2 / 2
+            Q[1, 1] = q * dt
+
+    def predict(self, timestamp):
+        """Advance the estimate to timestamp (s) without a measurement"""
+        dt = timestamp - self.timestamp
+        if dt > 0:
+            self.set_time_step(dt)
+            self.state = np.dot(self.transition, self.state)
+            self.covariance = np.dot(np.dot(self.transition, self.covariance), self.transition.T) + self.noise
+            self.timestamp = timestamp
+
+    def update(self, timestamp, position=None):
+        """Add a position fix (x, y) in mm taken at timestamp (s), or None if the puck wasn't found
+        Returns True if the estimate is valid"""
+        if position is None:
+            if self.valid:
+                # coast through short dropouts on the motion model alone
+                self.predict(timestamp)
+                self.coasting = True
+                if (timestamp - self.last_fix_timestamp) > self.max_coast_time:
+                    self.reset()
+            return self.valid
+
+        if not self.valid:
+            # start a new track at the fix, with no idea of the velocity yet
+            self.state[0] = position
+            self.covariance[0, 0] = self.measurement_noise
+            self.covariance[1, 1] = self.initial_velocity_variance
+            if self.constant_acceleration:
+                self.covariance[2, 2] = self.initial_velocity_variance
+            self.timestamp = timestamp
+        else:
+            self.predict(timestamp)
+
+            # only position is measured, so the gain is the first column of the covariance scaled by the innovation variance
+            gain = self.covariance[:, 0] / (self.covariance[0, 0] + self.measurement_noise)
+            innovation = np.asarray(position) - self.state[0]
+            self.state += np.outer(gain, innovation)
+            self.covariance -= np.outer(gain, self.covariance[0])
+
+        self.last_fix_timestamp = timestamp
+        self.valid = True
+        self.coasting = False
+        return self.valid
+
+    def predicted_position(self, timestamp):
+        """Where the puck is expected to be at timestamp (s), without changing the estimate"""
+        dt = timestamp - self.timestamp
+        position = self.state[0] + self.state[1]*dt
+        if self.constant_acceleration:
+            position += 0.5 * self.state[2] * dt**2
+        return (position[0], position[1])
+
+    @property
+    def position(self):
+        return (self.state[0, 0], self.state[0, 1])
+
+    @property
+    def velocity(self):
+        return (self.state[1, 0], self.state[1, 1])
+
+    @property
+    def position_variance(self):
+        return self.covariance[0, 0]
+
+    @property
+    def velocity_variance(self):
+        return self.covariance[1, 1]
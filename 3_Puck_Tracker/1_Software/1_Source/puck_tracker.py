@@ -2,19 +2,21 @@
 import cv2
 import sys
 import numpy as np
-import Queue
 import json
+import os
 import time
+from puck_kalman_filter import PuckKalmanFilter
+from camera_grabber import CameraGrabber, get_time
+from blob_detector import find_blobs, get_colour_mask, merge_regions, select_blob, ObjectTrack, SubpixelCentroid
 
 # define global variables
 settings_path = "../../../6_User_Interface/1_Software/4_Json/"
-last_puck_position_mm_x = 0
-last_puck_position_mm_y = 0
-last_time = 0
 puck_position_mm_x = 0
 puck_position_mm_y = 0
 puck_velocity_mmps_x = 0
 puck_velocity_mmps_y = 0
+puck_position_variance = 0
+puck_velocity_variance = 0
 table_width_mm = 774.7
 table_length_mm = 1692.275
 puck_minimum_area = 500
@@ -24,6 +26,30 @@ puck_maximum_radius = 25
 camera_vertical_resolution = 480
 camera_horizontal_resolution = 640
 camera_fps = 224
+roi_search_enabled = True       # search a window around the predicted puck position before the full frame
+roi_search_window_radii = 3     # half size of the search window, in multiples of the maximum puck radius
+centroid_only_warp = False       # detect the puck in camera space and only transform its centroid onto the table
+puck_lost = True
+puck_filter = PuckKalmanFilter(constant_acceleration=False, process_noise=1e7, measurement_noise_mm=2.0, max_coast_time=0.1)
+puck_minimum_circularity = 0.8  # 4*pi*area/perimeter^2 (in mm) of a puck sized blob is 0.9 for the puck, 0.75 or less for glare or a hand over a paddle
+subpixel_refinement_enabled = False  # refine the puck centroid to a fraction of a pixel from the colour around it, see SubpixelCentroid
+subpixel_centroid = SubpixelCentroid(puck_maximum_radius + 2)
+blob_circularity_weight = 2.0   # cost of a blob being far from round when picking the puck or a paddle, in search window half sizes
+paddle_tracking_enabled = True  # find the paddles as well, so neither is taken for the puck, and publish the human paddle
+paddle_minimum_area = 1200      # the paddles show up in the puck colour mask, about 1.5 times the size of the puck
+paddle_maximum_area = 2600
+paddle_minimum_radius = 20
+paddle_maximum_radius = 35
+paddle_search_window_radii = 2  # half size of a paddle's search window, in multiples of the maximum paddle radius
+paddle_reacquire_period = 20    # frames between full frame searches for a lost paddle while the puck is tracked in a window (about 0.1 s)
+paddle_search_count = 0
+human_paddle_track = ObjectTrack(max_coast_time=0.1)
+robot_paddle_track = ObjectTrack(max_coast_time=0.1)
+human_paddle_position_mm_x = 0
+human_paddle_position_mm_y = 0
+human_paddle_velocity_mmps_x = 0
+human_paddle_velocity_mmps_y = 0
+human_paddle_valid = False
 
 def get_puck_tracker_settings():
     """Get the stored settings for the puck tracker"""
@@ -66,72 +92,198 @@ def get_puck_tracker_settings():
         [settings['puck_tracker']['fiducial']['coordinates']['bl']['x'],
          settings['puck_tracker']['fiducial']['coordinates']['bl']['y']]], dtype = "float32")
 
-def get_puck_position(frame):
-    """Get the location of the puck in x, y coordinates (mm)"""
+def get_predicted_puck_pixels(timestamp):
+    """Get where the puck is predicted to be at timestamp (s) in table (warped frame) pixels"""
+    (predicted_mm_x, predicted_mm_y) = puck_filter.predicted_position(timestamp)
+    return (predicted_mm_x / mm_per_pixel_x, predicted_mm_y / mm_per_pixel_y)
+
+def get_search_window(frame_shape, position, half_size, camera_space=False):
+    """Get the region of the frame (x0, y0, x1, y1) in pixels around a position (x, y) in table pixels"""
+    (x, y) = position
+    if camera_space:
+        (x, y) = transform_point(inverse_perspective_transform_matrix, (x, y))
+
+    half_size = int(half_size)
+    x0 = max(int(x) - half_size, 0)
+    y0 = max(int(y) - half_size, 0)
+    x1 = min(int(x) + half_size, frame_shape[1])
+    y1 = min(int(y) + half_size, frame_shape[0])
+
+    return (x0, y0, x1, y1)
+
+def get_puck_search_window(frame_shape, timestamp, camera_space=False):
+    """Get the region of the frame (x0, y0, x1, y1) in pixels where the puck is predicted to be"""
+    # window size depends only on the size of the puck, not the size of the table
+    return get_search_window(frame_shape, get_predicted_puck_pixels(timestamp), roi_search_window_radii * puck_maximum_radius,
+                             camera_space)
+
+def get_search_windows(frame_shape, timestamp, camera_space=False):
+    """Get the regions of the frame to search for the tracked puck and paddles, overlapping windows merged
+    Returns None if the puck's window is too small to find it in (it is predicted to be off the frame)"""
+    (x0, y0, x1, y1) = get_puck_search_window(frame_shape, timestamp, camera_space)
+    if (x1 - x0) <= 2*puck_minimum_radius or (y1 - y0) <= 2*puck_minimum_radius:
+        return None
+
+    windows = [(x0, y0, x1, y1)]
+    if paddle_tracking_enabled:
+        for track in (human_paddle_track, robot_paddle_track):
+            if track.valid:
+                window = get_search_window(frame_shape, track.predicted_position(timestamp),
+                                           paddle_search_window_radii * paddle_maximum_radius, camera_space)
+                if window[2] > window[0] and window[3] > window[1]:
+                    windows.append(window)
+    return merge_regions(windows)
+
+def find_objects(frame, regions, timestamp, camera_space=False):
+    """Find the puck and paddles in regions of a frame (None for all of it)
+    Returns the blobs in frame pixels, the same blobs in table pixels and the index of the puck, human paddle and
+    robot paddle among them, None for any that wasn't found"""
+    # the warped frame's pixels aren't square (mm_per_pixel_x and _y differ), so a round puck is an ellipse in it and
+    # its circularity is measured in mm instead, the camera's pixels are square enough as they are
+    pixel_size = None if camera_space else (mm_per_pixel_x, mm_per_pixel_y)
+    blobs = find_blobs(frame, puck_lower_hsv, puck_upper_hsv, regions, pixel_size)
+    if camera_space:
+        # onto the table, with the areas and radii scaled by how much the warp stretches the table around each blob,
+        # so the same size limits hold as in the warped frame
+        (table_x, table_y) = transform_point(perspective_transform_matrix, (blobs.x, blobs.y))
+        (area_scale, length_scale) = get_transform_scale(perspective_transform_matrix, (blobs.x, blobs.y))
+        table_blobs = blobs._replace(x=table_x, y=table_y, area=blobs.area*area_scale, radius=blobs.radius*length_scale)
+        (table_height, table_width) = (max_frame_height, max_frame_width)
+    else:
+        table_blobs = blobs
+        (table_height, table_width) = frame.shape[:2]
+
+    # ignore anything found off the table
+    on_table = (0 <= table_blobs.x) & (table_blobs.x < table_width) & (0 <= table_blobs.y) & (table_blobs.y < table_height)
+    area = table_blobs.area
+    radius = table_blobs.radius
+
+    # the puck sized blob that is roundest and nearest where the puck should be
+    puck_candidates = (on_table & (puck_minimum_area < area) & (area < puck_maximum_area) &
+                       (puck_minimum_radius < radius) & (radius < puck_maximum_radius) &
+                       (table_blobs.circularity > puck_minimum_circularity))
+    predicted = get_predicted_puck_pixels(timestamp) if puck_filter.valid else None
+    puck_index = select_blob(table_blobs, puck_candidates, predicted, roi_search_window_radii * puck_maximum_radius,
+                             blob_circularity_weight)
+    if not paddle_tracking_enabled:
+        return (blobs, table_blobs, puck_index, None, None)
+
+    # paddle sized blobs, the robot defends the end of the table at x = 0 and the human the other end
+    paddle_candidates = (on_table & (paddle_minimum_area < area) & (area < paddle_maximum_area) &
+                         (paddle_minimum_radius < radius) & (radius < paddle_maximum_radius))
+    if puck_index is not None:
+        paddle_candidates[puck_index] = False
+    robot_half = table_blobs.x < table_width / 2.0
+    paddle_indexes = []
+    for (track, half) in ((human_paddle_track, ~robot_half), (robot_paddle_track, robot_half)):
+        predicted = track.predicted_position(timestamp) if track.valid else None
+        paddle_indexes.append(select_blob(table_blobs, paddle_candidates & half, predicted,
+                                          roi_search_window_radii * paddle_maximum_radius, blob_circularity_weight))
+
+    return (blobs, table_blobs, puck_index, paddle_indexes[0], paddle_indexes[1])
+
+def get_puck_position(frame, timestamp, camera_space=False):
+    """Get the location of the puck in x, y coordinates (mm) in a frame captured at timestamp (s), and the paddles'
+    Every blob of the puck colour is scored: the puck is the puck sized blob that is roundest and nearest where the
+    puck should be, the paddles are the paddle sized blobs on each half of the table nearest where they were
+    If camera_space is set the frame has not been warped, only the blob centroids are transformed onto the table"""
     global puck_position_mm_x
     global puck_position_mm_y
-
-    # convert the frame to HSV color space
-    frame_hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-
-    # create a mask for the puck color
-    puck_mask = cv2.inRange(frame_hsv, puck_lower_hsv, puck_upper_hsv)
-
-    # apply median blur filter
-    puck_mask_filtered = cv2.medianBlur(puck_mask, 5)
-
-    # find contours in the mask
-    contour_list = cv2.findContours(puck_mask_filtered.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
-    
-    # proceed if a contour is found
-    if len(contour_list) > 0:
-        puck_found = False
-        for contour in contour_list:
-            contour_area = cv2.contourArea(contour)
-            if puck_minimum_area < contour_area < puck_maximum_area:
-                ((x, y), radius) = cv2.minEnclosingCircle(contour)
-                if puck_minimum_radius < radius < puck_maximum_radius:
-                    puck_sized_contour = contour
-                    puck_found = True
-                    break
-
-        if puck_found:      
-            M = cv2.moments(puck_sized_contour)
-            if M["m00"] != 0:
-                puck_center_coords = (M["m10"] / M["m00"], M["m01"] / M["m00"])
-                cv2.circle(frame, (int(puck_center_coords[0]), int(puck_center_coords[1])), int(radius + 2), (0, 255, 255), 2)
-                puck_position_mm_x = puck_center_coords[0]*mm_per_pixel_x
-                puck_position_mm_y = puck_center_coords[1]*mm_per_pixel_y
-        else:
-            puck_position_mm_x = 0
-            puck_position_mm_y = 0
+    global puck_lost
+    global paddle_search_count
+    global human_paddle_position_mm_x
+    global human_paddle_position_mm_y
+    global human_paddle_velocity_mmps_x
+    global human_paddle_velocity_mmps_y
+    global human_paddle_valid
+
+    # search small windows around the predicted puck and paddle positions first, fall back to the full frame if the
+    # puck isn't there, and every so often anyway while a paddle is lost
+    full_search = True
+    paddle_search_count += 1
+    if roi_search_enabled and puck_filter.valid:
+        regions = get_search_windows(frame.shape, timestamp, camera_space)
+        if regions is not None:
+            objects = find_objects(frame, regions, timestamp, camera_space)
+            paddle_lost = paddle_tracking_enabled and not (human_paddle_track.valid and robot_paddle_track.valid)
+            full_search = objects[2] is None or (paddle_lost and paddle_search_count >= paddle_reacquire_period)
+
+    if full_search:
+        objects = find_objects(frame, None, timestamp, camera_space)
+        paddle_search_count = 0
+
+    (blobs, table_blobs, puck_index, human_index, robot_index) = objects
+    if puck_index is not None:
+        (puck_x, puck_y) = (table_blobs.x[puck_index], table_blobs.y[puck_index])
+        if subpixel_refinement_enabled:
+            # before anything is drawn on the frame
+            (puck_x, puck_y) = subpixel_centroid.refine(frame, (blobs.x[puck_index], blobs.y[puck_index]),
+                                                        blobs.radius[puck_index] + 2, puck_lower_hsv, puck_upper_hsv)
+            if camera_space:
+                (puck_x, puck_y) = transform_point(perspective_transform_matrix, (puck_x, puck_y))
+
+    if paddle_tracking_enabled:
+        for (track, index) in ((human_paddle_track, human_index), (robot_paddle_track, robot_index)):
+            track.update(timestamp, (table_blobs.x[index], table_blobs.y[index]) if index is not None else None)
+
+    # circle what was found, yellow for the puck, red for the human paddle and blue for the robot paddle
+    for (index, colour) in ((puck_index, (0, 255, 255)), (human_index, (0, 0, 255)), (robot_index, (255, 0, 0))):
+        if index is not None:
+            cv2.circle(frame, (int(blobs.x[index]), int(blobs.y[index])), int(blobs.radius[index] + 2), colour, 2)
+
+    if puck_index is not None:
+        puck_position_mm_x = puck_x*mm_per_pixel_x
+        puck_position_mm_y = puck_y*mm_per_pixel_y
+        puck_lost = False
+    else:
+        puck_position_mm_x = 0
+        puck_position_mm_y = 0
+        puck_lost = True
+
+    human_paddle_valid = human_paddle_track.valid
+    if human_paddle_valid:
+        human_paddle_position_mm_x = human_paddle_track.position[0]*mm_per_pixel_x
+        human_paddle_position_mm_y = human_paddle_track.position[1]*mm_per_pixel_y
+        human_paddle_velocity_mmps_x = human_paddle_track.velocity[0]*mm_per_pixel_x
+        human_paddle_velocity_mmps_y = human_paddle_track.velocity[1]*mm_per_pixel_y
+    else:
+        human_paddle_position_mm_x = 0
+        human_paddle_position_mm_y = 0
+        human_paddle_velocity_mmps_x = 0
+        human_paddle_velocity_mmps_y = 0
 
     return frame
 
-def get_puck_velocity():
-    """Get the puck velocity in x, y coordinates (mmps)"""
+def get_puck_state(timestamp):
+    """Update the puck state estimate with the latest fix, gives filtered position (mm), velocity (mmps) and variances
+    Returns False if the puck has been lost for too long and there is no estimate"""
+    global puck_position_mm_x
+    global puck_position_mm_y
     global puck_velocity_mmps_x
     global puck_velocity_mmps_y
-    global last_puck_position_mm_x
-    global last_puck_position_mm_y
-    global last_time
-    
-    current_puck_position_mm_x = puck_position_mm_x
-    current_puck_position_mm_y = puck_position_mm_y
-    current_time = time.time()
-    travel_time = current_time - last_time
-    
-    if current_puck_position_mm_x != 0 and last_puck_position_mm_x != 0:
-        distance_traveled_mm_x = current_puck_position_mm_x - last_puck_position_mm_x
-        puck_velocity_mmps_x = distance_traveled_mm_x / travel_time
-    
-    if current_puck_position_mm_y != 0 and last_puck_position_mm_y != 0:
-        distance_traveled_mm_y = current_puck_position_mm_y - last_puck_position_mm_y
-        puck_velocity_mmps_y = distance_traveled_mm_y / travel_time
-    
-    last_puck_position_mm_x = current_puck_position_mm_x
-    last_puck_position_mm_y = current_puck_position_mm_y
-    last_time = current_time
+    global puck_position_variance
+    global puck_velocity_variance
+
+    if puck_lost:
+        fix = None
+    else:
+        fix = (puck_position_mm_x, puck_position_mm_y)
+
+    if puck_filter.update(timestamp, fix):
+        (puck_position_mm_x, puck_position_mm_y) = puck_filter.position
+        (puck_velocity_mmps_x, puck_velocity_mmps_y) = puck_filter.velocity
+        puck_position_variance = puck_filter.position_variance
+        puck_velocity_variance = puck_filter.velocity_variance
+        return True
+    else:
+        # lost the puck for too long, report it as not found
+        puck_position_mm_x = 0
+        puck_position_mm_y = 0
+        puck_velocity_mmps_x = 0
+        puck_velocity_mmps_y = 0
+        puck_position_variance = 0
+        puck_velocity_variance = 0
+        return False
 
 def get_mm_per_pixel_factors():
     """Get the scaling factors for mm per pixel conversion"""
@@ -153,6 +305,9 @@ def get_perspective_transform_matrix():
     global max_frame_width
     global max_frame_height
     global perspective_transform_matrix
+    global inverse_perspective_transform_matrix
+    global warp_map_1
+    global warp_map_2
 
     (tl, tr, br, bl) = fiducial_coordinates
 
@@ -183,6 +338,50 @@ def get_perspective_transform_matrix():
 
     # compute the perspective transform matrix
     perspective_transform_matrix = cv2.getPerspectiveTransform(fiducial_coordinates, destination)
+    inverse_perspective_transform_matrix = np.linalg.inv(perspective_transform_matrix)
+
+    # the matrix only changes on recalibration, so build the remap tables once here instead of
+    # letting warpPerspective solve the homography for every pixel of every frame
+    (grid_x, grid_y) = np.meshgrid(np.arange(max_frame_width, dtype=np.float64),
+                                   np.arange(max_frame_height, dtype=np.float64))
+    h = inverse_perspective_transform_matrix
+    scale = h[2, 0]*grid_x + h[2, 1]*grid_y + h[2, 2]
+    map_x = ((h[0, 0]*grid_x + h[0, 1]*grid_y + h[0, 2]) / scale).astype(np.float32)
+    map_y = ((h[1, 0]*grid_x + h[1, 1]*grid_y + h[1, 2]) / scale).astype(np.float32)
+
+    # convert to fixed point maps, remap is much faster with these
+    (warp_map_1, warp_map_2) = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+def transform_point(matrix, point):
+    """Transform a single (x, y) point, or arrays of x and y, through a homography"""
+    (x, y) = point
+    scale = matrix[2, 0]*x + matrix[2, 1]*y + matrix[2, 2]
+    return ((matrix[0, 0]*x + matrix[0, 1]*y + matrix[0, 2]) / scale,
+            (matrix[1, 0]*x + matrix[1, 1]*y + matrix[1, 2]) / scale)
+
+def get_transform_scale(matrix, point):
+    """Get how much a homography scales areas and lengths around a single (x, y) point, or arrays of x and y
+    Returns the determinant of its Jacobian there and the Jacobian's largest singular value, the most a length is
+    stretched (what becomes of the radius of a small circle)"""
+    (x, y) = point
+    scale = matrix[2, 0]*x + matrix[2, 1]*y + matrix[2, 2]
+    (table_x, table_y) = transform_point(matrix, point)
+    dx_dx = (matrix[0, 0] - matrix[2, 0]*table_x) / scale
+    dx_dy = (matrix[0, 1] - matrix[2, 1]*table_x) / scale
+    dy_dx = (matrix[1, 0] - matrix[2, 0]*table_y) / scale
+    dy_dy = (matrix[1, 1] - matrix[2, 1]*table_y) / scale
+    determinant = dx_dx*dy_dy - dx_dy*dy_dx
+    squares = dx_dx**2 + dx_dy**2 + dy_dx**2 + dy_dy**2
+    largest_singular_value = np.sqrt((squares + np.sqrt(np.maximum(squares**2 - 4*determinant**2, 0))) / 2)
+    return (np.abs(determinant), largest_singular_value)
+
+def warp_frame(frame, frame_warped=None):
+    """Get a top down view of the playing surface using the cached remap tables, optionally into frame_warped"""
+    return cv2.remap(frame, warp_map_1, warp_map_2, cv2.INTER_LINEAR, dst=frame_warped)
+
+def get_warped_frame_shape():
+    """Get the (rows, columns, channels) of a warped frame"""
+    return (max_frame_height, max_frame_width, 3)
 
 def get_fiducials(frame):
     """Locate the fiducials marking the playing surface and save their coordinates"""
@@ -252,6 +451,13 @@ def get_fiducials(frame):
                     
     return ret
 
+def signal_data_ready(data_ready):
+    """Wake up the master controller, if the pipe is full it already has a wake up waiting"""
+    try:
+        os.write(data_ready, b'\x00')
+    except OSError:
+        pass
+
 def enum(list):
     enums = dict(zip(list, range(len(list))))
     return type('Enum', (), enums)
@@ -275,8 +481,13 @@ def get_enums():
     pt_tx_enum = enum(settings['puck_tracker']['enumerations']['pt_tx'])
 
 """----------------------------Puck Tracker Process--------------------------"""
-def pt_process(pt_rx, pt_tx, visualization_data):
-    """All things puck tracker happen here. Communicates directly with master controller"""
+def pt_process(pt_rx, pt_tx, visualization_data, data_ready):
+    """All things puck tracker happen here. Communicates directly with master controller
+    Frames for visualization are written straight into the visualization_data frame ring buffer
+    A byte is written to the data_ready pipe every time a fix is published to wake the master controller
+    Every fix carries its camera capture time, how long each stage took and a sequence number, and goes into pt_tx
+    as a single update so the master controller can tell a new fix from one it has already used and never reads
+    part of one fix with part of the next"""
     # collect enums
     get_enums()
 
@@ -291,23 +502,30 @@ def pt_process(pt_rx, pt_tx, visualization_data):
             pt_tx[pt_tx_enum.state] = pt_state_enum.error
             pt_tx[pt_tx_enum.error] = pt_error_enum.camera
     
+    # capture frames on their own thread so grabbing overlaps with processing
+    grabber = CameraGrabber(video_stream, (camera_vertical_resolution, camera_horizontal_resolution, 3))
+    grabber.start()
+
     pt_state = pt_state_enum.idle
     pt_error = pt_error_enum.none
     calibration_attempts = 0
     fiducials_found = 0
+    fix_sequence = 0
 
     while True:
         # retrieve commands from master controller
-        mc_cmd = int(pt_rx[pt_rx_enum.state_cmd])
-        color_lower = (int(pt_rx[pt_rx_enum.lower_hue]),
-                       int(pt_rx[pt_rx_enum.lower_sat]),
-                       int(pt_rx[pt_rx_enum.lower_val]))
-        color_upper = (int(pt_rx[pt_rx_enum.upper_hue]),
-                       int(pt_rx[pt_rx_enum.upper_sat]),
-                       int(pt_rx[pt_rx_enum.upper_val]))
-
-        # grab the next frame from camera
-        ret, frame = video_stream.read()
+        mc_data = pt_rx.snapshot()
+        mc_cmd = int(mc_data[pt_rx_enum.state_cmd])
+        color_lower = (int(mc_data[pt_rx_enum.lower_hue]),
+                       int(mc_data[pt_rx_enum.lower_sat]),
+                       int(mc_data[pt_rx_enum.lower_val]))
+        color_upper = (int(mc_data[pt_rx_enum.upper_hue]),
+                       int(mc_data[pt_rx_enum.upper_sat]),
+                       int(mc_data[pt_rx_enum.upper_val]))
+
+        # get the freshest frame from the camera, older ones are skipped
+        ret, frame, frame_timestamp = grabber.get_frame()
+        frame_time = get_time()
         if ret == False:
             pt_error = pt_error_enum.camera
 
@@ -319,6 +537,7 @@ def pt_process(pt_rx, pt_tx, visualization_data):
             fiducials_found = 0
         elif mc_cmd == pt_state_cmd_enum.track and pt_state != pt_state_enum.tracking:
             pt_state = pt_state_enum.tracking
+            puck_filter.reset()
             # update settings
             get_puck_tracker_settings()
             get_mm_per_pixel_factors()
@@ -339,12 +558,8 @@ def pt_process(pt_rx, pt_tx, visualization_data):
         # perform puck tracker state tasks
         if pt_state == pt_state_enum.calibrate_fiducials:            
             if fiducials_found:
-                frame_warped = cv2.warpPerspective(frame, perspective_transform_matrix, (max_frame_width, max_frame_height), cv2.INTER_LINEAR)
-                try:
-                    visualization_data.get_nowait()
-                    visualization_data.put(frame_warped)
-                except Queue.Empty:
-                    visualization_data.put(frame_warped)
+                warp_frame(frame, visualization_data.get_write_buffer(get_warped_frame_shape()))
+                visualization_data.commit()
 
                 calibration_attempts = 0
             else:
@@ -361,53 +576,73 @@ def pt_process(pt_rx, pt_tx, visualization_data):
                 calibration_attempts = 0    
 
         elif pt_state == pt_state_enum.tracking:
-            frame_warped = cv2.warpPerspective(frame, perspective_transform_matrix, (max_frame_width, max_frame_height), cv2.INTER_LINEAR)
-            frame = get_puck_position(frame_warped)
-            get_puck_velocity()
+            if centroid_only_warp:
+                warp_end_time = frame_time
+                frame = get_puck_position(frame, frame_timestamp, camera_space=True)
+            else:
+                # warp straight into the next visualization slot, it is published once we're done with it
+                frame_warped = warp_frame(frame, visualization_data.get_write_buffer(get_warped_frame_shape()))
+                warp_end_time = get_time()
+                frame = get_puck_position(frame_warped, frame_timestamp)
+            fix_valid = get_puck_state(frame_timestamp)
+            detect_end_time = get_time()
             # this may seem confusing, but everything in the puck tracker currently has the wrong coordinate system. TODO: Fix on a rainy day
-            pt_tx[pt_tx_enum.puck_position_x] = puck_position_mm_y
-            pt_tx[pt_tx_enum.puck_position_y] = puck_position_mm_x
-            pt_tx[pt_tx_enum.puck_velocity_x] = puck_velocity_mmps_y
-            pt_tx[pt_tx_enum.puck_velocity_y] = puck_velocity_mmps_x
-    
-            try:
-                visualization_data.get_nowait()
-                visualization_data.put(frame)
-            except Queue.Empty:
-                visualization_data.put(frame)
+            publish_time = get_time()
+            fix_sequence += 1
+            # the whole fix goes out as one update, the master controller never reads half of it
+            pt_tx.update({pt_tx_enum.puck_position_x: puck_position_mm_y,
+                          pt_tx_enum.puck_position_y: puck_position_mm_x,
+                          pt_tx_enum.puck_velocity_x: puck_velocity_mmps_y,
+                          pt_tx_enum.puck_velocity_y: puck_velocity_mmps_x,
+                          pt_tx_enum.puck_position_variance: puck_position_variance,
+                          pt_tx_enum.puck_velocity_variance: puck_velocity_variance,
+                          pt_tx_enum.frames_skipped: grabber.frames_skipped,
+                          pt_tx_enum.timestamp_fallbacks: grabber.timestamp_fallbacks,
+                          pt_tx_enum.capture_time: frame_timestamp,
+                          pt_tx_enum.fix_valid: fix_valid,
+                          pt_tx_enum.grab_latency: frame_time - frame_timestamp,
+                          pt_tx_enum.warp_time: warp_end_time - frame_time,
+                          pt_tx_enum.detect_time: detect_end_time - warp_end_time,
+                          pt_tx_enum.publish_time: publish_time,
+                          pt_tx_enum.fix_latency: publish_time - frame_timestamp,
+                          pt_tx_enum.human_paddle_position_x: human_paddle_position_mm_y,
+                          pt_tx_enum.human_paddle_position_y: human_paddle_position_mm_x,
+                          pt_tx_enum.human_paddle_velocity_x: human_paddle_velocity_mmps_y,
+                          pt_tx_enum.human_paddle_velocity_y: human_paddle_velocity_mmps_x,
+                          pt_tx_enum.human_paddle_valid: human_paddle_valid,
+                          pt_tx_enum.sequence: fix_sequence})
+            signal_data_ready(data_ready)
+
+            if centroid_only_warp:
+                # only spend time warping a frame for visualization once the last one has been taken
+                if visualization_data.needs_frame():
+                    warp_frame(frame, visualization_data.get_write_buffer(get_warped_frame_shape()))
+                    visualization_data.commit()
+            else:
+                visualization_data.commit()
 
         elif pt_state == pt_state_enum.find_fiducials:
             frame_hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
             frame_mask = cv2.inRange(frame_hsv, color_lower, color_upper)            
             frame_mask_filtered = cv2.medianBlur(frame_mask, 5)
             frame = cv2.bitwise_and(frame, frame, mask=frame_mask_filtered)
-            
-            try:
-                visualization_data.get_nowait()
-                visualization_data.put(frame)
-            except Queue.Empty:
-                visualization_data.put(frame)
+            visualization_data.write(frame)
 
         elif pt_state == pt_state_enum.find_puck:
-            frame_warped = cv2.warpPerspective(frame, perspective_transform_matrix, (max_frame_width, max_frame_height), cv2.INTER_LINEAR)
+            frame_warped = warp_frame(frame)
             frame_hsv = cv2.cvtColor(frame_warped, cv2.COLOR_BGR2HSV)
             frame_mask = cv2.inRange(frame_hsv, color_lower, color_upper)            
             frame_mask_filtered = cv2.medianBlur(frame_mask, 5)
             frame = cv2.bitwise_and(frame_warped, frame_warped, mask=frame_mask_filtered)
-            
-            try:
-                visualization_data.get_nowait()
-                visualization_data.put(frame)
-            except Queue.Empty:
-                visualization_data.put(frame)
+            visualization_data.write(frame)
 
         elif pt_state == pt_state_enum.quit:
             pt_tx[pt_tx_enum.state] = pt_state_enum.quit
+            grabber.stop()
             video_stream.release() 
             cv2.destroyAllWindows()
             visualization_data.close()
             quit(0)
 
         # update state/error
-        pt_tx[pt_tx_enum.error] = pt_error
-        pt_tx[pt_tx_enum.state] = pt_state
\ No newline at end of file
+        pt_tx.update({pt_tx_enum.error: pt_error, pt_tx_enum.state: pt_state})
\ No newline at end of file
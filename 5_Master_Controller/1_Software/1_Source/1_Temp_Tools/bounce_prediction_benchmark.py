@@ -0,0 +1,96 @@
+# Bounce prediction benchmark
+# Compares the closed form intercept in trajectory.py against the bounce by bounce loop get_paddle_position_mm_x() used to run
+# Checks they agree on random shots, then times the loop, the closed form one shot at a time and the batched closed form
+# Usage: python bounce_prediction_benchmark.py [number of shots]
+import sys
+import time
+import numpy as np
+
+# add master controller module path
+sys.path.insert(0, '../')
+from trajectory import get_intercept_position_x, get_intercept_positions_x
+
+table_width_mm_x = 774.7
+table_length_mm_y = 1692.3
+puck_radius_mm = 31.75
+paddle_radius_mm = 48
+intercept_mm_y = 200 + paddle_radius_mm
+x_min = puck_radius_mm
+x_max = table_width_mm_x - puck_radius_mm
+
+# give up after this many bounces, nearly horizontal shots would otherwise keep the old loop going for ages
+loop_max_bounces = 100000
+
+##
+## loop_intercept_position_x(position_x, position_y, vector_x, vector_y)
+## The old bounce by bounce prediction from get_paddle_position_mm_x(), without the drawing
+## Returns the intercept x and the number of bounces
+##
+def loop_intercept_position_x(position_x, position_y, vector_x, vector_y):
+	slope = vector_y/vector_x
+	intercept_y = position_y - (slope * position_x)
+	paddle_position_x = (intercept_mm_y - intercept_y) / slope
+
+	bounce_count = 0
+	while bounce_count < loop_max_bounces:
+		if x_max >= paddle_position_x >= x_min:
+			break
+		elif paddle_position_x < x_min:
+			bounce_y = (slope * x_min) + intercept_y
+			slope = -slope
+			intercept_y = bounce_y - (slope * x_min)
+		else:
+			bounce_y = (slope * x_max) + intercept_y
+			slope = -slope
+			intercept_y = bounce_y - (slope * x_max)
+		paddle_position_x = (intercept_mm_y - intercept_y) / slope
+		bounce_count += 1
+	return paddle_position_x, bounce_count
+
+## end of function
+
+if __name__ == '__main__':
+	number_of_shots = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+	# shots from the far half of the table towards the robot, at any angle off the table axis up to 85 degrees
+	random = np.random.RandomState(0)
+	positions_x = random.uniform(x_min, x_max, number_of_shots)
+	positions_y = random.uniform(table_length_mm_y/2, table_length_mm_y - puck_radius_mm, number_of_shots)
+	angles = np.radians(random.uniform(-85, 85, number_of_shots))
+	vectors_x = 20*np.sin(angles)
+	vectors_y = -20*np.cos(angles)
+	shots = zip(positions_x, positions_y, vectors_x, vectors_y)
+
+	start_time = time.time()
+	loop_results = [loop_intercept_position_x(*shot) for shot in shots]
+	loop_time = time.time() - start_time
+
+	start_time = time.time()
+	closed_form_results = [get_intercept_position_x(x, y, vx, vy, intercept_mm_y, x_min, x_max) for (x, y, vx, vy) in shots]
+	closed_form_time = time.time() - start_time
+
+	start_time = time.time()
+	batched_results = get_intercept_positions_x(positions_x, positions_y, vectors_x, vectors_y, intercept_mm_y, x_min, x_max)
+	batched_time = time.time() - start_time
+
+	loop_positions_x = np.array([result[0] for result in loop_results])
+	bounces = np.array([result[1] for result in loop_results])
+	print "%i shots, %.1f bounces on average, %i at most" % (number_of_shots, np.mean(bounces), np.max(bounces))
+	print "Largest difference from the loop: closed form %.6f mm, batched %.6f mm" % (np.max(np.abs(loop_positions_x - closed_form_results)),
+		np.max(np.abs(loop_positions_x - batched_results)))
+	print "Loop:        %8.3f us/shot" % (1e6*loop_time/number_of_shots)
+	print "Closed form: %8.3f us/shot" % (1e6*closed_form_time/number_of_shots)
+	print "Batched:     %8.3f us/shot" % (1e6*batched_time/number_of_shots)
+
+	# the worst case for the loop: a shot almost parallel to the goal
+	for angle in (89.0, 89.9, 89.99):
+		vector_x = 20*np.sin(np.radians(angle))
+		vector_y = -20*np.cos(np.radians(angle))
+		start_time = time.time()
+		loop_position_x, bounce_count = loop_intercept_position_x(400.0, 1500.0, vector_x, vector_y)
+		loop_time = time.time() - start_time
+		start_time = time.time()
+		closed_form_position_x = get_intercept_position_x(400.0, 1500.0, vector_x, vector_y, intercept_mm_y, x_min, x_max)
+		closed_form_time = time.time() - start_time
+		print "%.2f degrees, %i bounces: loop %.1f mm in %.1f us, closed form %.1f mm in %.1f us" % (angle, bounce_count,
+			loop_position_x, 1e6*loop_time, closed_form_position_x, 1e6*closed_form_time)
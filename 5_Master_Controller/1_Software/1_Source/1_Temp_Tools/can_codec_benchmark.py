@@ -0,0 +1,99 @@
+# CAN codec check and benchmark
+# Round trips random signal values through the generated encode/decode in can_codec.py, checks the bytes
+# against the hand rolled packing Tx_PC_Cmd() and rx_CAN() used to do, then times both ways
+# Usage: python can_codec_benchmark.py [number of messages]
+import sys
+import time
+import random
+
+# add master controller module path
+sys.path.insert(0, '../')
+from can_codec import mc_cmd_pc, pc_status
+
+##
+## hand_encode_mc_cmd_pc(...) / hand_decode_pc_status(data)
+## What Tx_PC_Cmd() and rx_CAN() did byte by byte, with the motor speed packing fixed (| instead of &)
+##
+def hand_encode_mc_cmd_pc(pos_cmd_x_mm, pos_cmd_y_mm, motor_speed_cmd_x, motor_speed_cmd_y, state_cmd):
+	message = bytearray(8)
+	message[0] = (int(pos_cmd_x_mm) & 0x00FF)
+	message[1] = ((int(pos_cmd_x_mm) & 0xFF00) >> 8)
+	message[2] = (int(pos_cmd_y_mm) & 0x00FF)
+	message[3] = ((int(pos_cmd_y_mm) & 0xFF00) >> 8)
+	message[4] = (motor_speed_cmd_x | (motor_speed_cmd_y << 2))
+	message[5] = state_cmd
+	return message
+
+def hand_decode_pc_status(data):
+	pos_x_mm = data[0] | (data[1] << 8)
+	pos_y_mm = data[2] | (data[3] << 8)
+	motor_speed_x = data[4] & 0x03
+	motor_speed_y = (data[4] & 0x0C) >> 2
+	goal_scored = (data[4] & 0xF0) >> 4
+	state = int(data[5])
+	error = int(data[6])
+	return (pos_x_mm, pos_y_mm, motor_speed_x, motor_speed_y, goal_scored, state, error)
+
+## end of function
+
+##
+## random_values(message)
+## A random value for every signal in a message
+##
+def random_values(message):
+	return [random.randint(0, (1 << length) - 1) for (name, start_bit, length) in message.signals]
+
+## end of function
+
+if __name__ == '__main__':
+	number_of_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	random.seed(0)
+
+	# round trips
+	for message in (mc_cmd_pc, pc_status):
+		for i in range(10000):
+			values = random_values(message)
+			data = message.encode(*values)
+			if len(data) != message.length or list(message.decode(data)) != values:
+				print "%s round trip failed: %s -> %s -> %s" % (message.name, values, list(data), message.decode(data))
+				sys.exit(1)
+		print "%s: 10000 round trips OK" % message.name
+
+	# same bytes as the hand rolled code
+	commands = [random_values(mc_cmd_pc)[:5] for i in range(number_of_messages)]
+	statuses = [pc_status.encode(*random_values(pc_status)[:7]) for i in range(number_of_messages)]
+	for (command, status) in zip(commands[:10000], statuses[:10000]):
+		if mc_cmd_pc.encode(*command) != hand_encode_mc_cmd_pc(*command):
+			print "mc_cmd_pc differs from the hand rolled encoding for %s" % command
+			sys.exit(1)
+		if tuple(pc_status.decode(status))[:7] != hand_decode_pc_status(status):
+			print "pc_status differs from the hand rolled decoding for %s" % list(status)
+			sys.exit(1)
+	print "Codec matches the hand rolled encoding and decoding"
+
+	# throughput
+	start_time = time.time()
+	for command in commands:
+		hand_encode_mc_cmd_pc(*command)
+	hand_encode_time = time.time() - start_time
+
+	start_time = time.time()
+	for command in commands:
+		mc_cmd_pc.encode(*command)
+	encode_time = time.time() - start_time
+
+	start_time = time.time()
+	for status in statuses:
+		hand_decode_pc_status(status)
+	hand_decode_time = time.time() - start_time
+
+	start_time = time.time()
+	for status in statuses:
+		pc_status.decode(status)
+	decode_time = time.time() - start_time
+
+	print "%i messages" % number_of_messages
+	print "Encode mc_cmd_pc: hand rolled %.2f us, codec %.2f us (%.0f messages/s)" % (1e6*hand_encode_time/number_of_messages,
+		1e6*encode_time/number_of_messages, number_of_messages/encode_time)
+	print "Decode pc_status: hand rolled %.2f us, codec %.2f us (%.0f messages/s)" % (1e6*hand_decode_time/number_of_messages,
+		1e6*decode_time/number_of_messages, number_of_messages/decode_time)
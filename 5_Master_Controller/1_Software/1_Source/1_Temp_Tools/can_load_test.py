@@ -0,0 +1,49 @@
+# CAN transport load test
+# Sends master controller command messages from one endpoint to another as fast as asked and reports
+# what arrived, what was dropped, the bus load and the receive rate, gaps, jitter and latency
+# Usage: python can_load_test.py loopback|socketcan [messages per second] [seconds]
+# socketcan uses vcan0, set it up with: sudo modprobe vcan && sudo ip link add dev vcan0 type vcan && sudo ip link set up vcan0
+import sys
+import time
+import select
+
+# add master controller module path
+sys.path.insert(0, '../')
+from can_transport import create_can_transport, VirtualCANBus
+from can_receiver import CANReceiver
+
+if __name__ == '__main__':
+	backend = sys.argv[1] if len(sys.argv) > 1 else 'loopback'
+	rate = float(sys.argv[2]) if len(sys.argv) > 2 else 1000.0
+	duration = float(sys.argv[3]) if len(sys.argv) > 3 else 5.0
+
+	bus = VirtualCANBus()
+	sender = create_can_transport(backend, 'vcan0', bus)
+	receiver = create_can_transport(backend, 'vcan0', bus)
+	if not (sender.open() and receiver.open()):
+		print "Could not open %s: %s %s" % (backend, sender.last_error, receiver.last_error)
+		sys.exit(1)
+	can_receiver = CANReceiver(receiver)
+
+	data = bytearray(8)
+	start_time = time.time()
+	next_send_time = start_time
+	number_sent = 0
+	while time.time() - start_time < duration:
+		now = time.time()
+		while next_send_time <= now:
+			data[0] = number_sent & 0xFF
+			sender.write(0x100, data)
+			number_sent += 1
+			next_send_time += 1.0 / rate
+
+		if select.select([receiver.fileno()], [], [], max(next_send_time - time.time(), 0))[0]:
+			can_receiver.poll()
+
+	can_receiver.poll()
+	print "Backend %s, %.0f messages/s for %.1f s" % (backend, rate, duration)
+	print "Sender: %s" % sender.get_stats()
+	print "Receiver: %s" % receiver.get_stats()
+	print "Receive stage: %s" % can_receiver.get_stats()
+	sender.close()
+	receiver.close()
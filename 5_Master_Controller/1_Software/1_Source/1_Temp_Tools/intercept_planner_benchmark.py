@@ -0,0 +1,83 @@
+# Intercept planner benchmark
+# Fires random shots at the robot's end of the table and plans an intercept for each one
+# Reports how often the paddle can get to the puck in time with the planner and with the fixed attack line,
+# and how long planning takes
+# Usage: python intercept_planner_benchmark.py [number of shots] [motor speed setting 0-2]
+import sys
+import time
+import numpy as np
+
+# add master controller module path
+sys.path.insert(0, '../')
+from intercept_planner import InterceptPlanner, get_move_times
+from trajectory import get_intercept_position_x
+
+table_width_mm_x = 774.7
+table_length_mm_y = 1692.3
+puck_radius_mm = 31.75
+paddle_radius_mm = 48
+attack_line_mm_y = 400
+defense_line_mm_y = 0
+x_min = puck_radius_mm
+x_max = table_width_mm_x - puck_radius_mm
+
+# same estimates as master_controller.py
+axis_max_speed_mmps = [1000, 2000, 3000]
+axis_acceleration_mmps2 = 20000
+command_latency = 0.02
+
+##
+## get_move_time(paddle_x, paddle_y, target_x, target_y, max_speed)
+## Paddle travel time to a point, the same model the planner uses
+##
+def get_move_time(paddle_x, paddle_y, target_x, target_y, max_speed):
+	out = np.empty(2)
+	get_move_times(np.array([abs(target_x - paddle_x), abs(target_y - paddle_y)]), max_speed, axis_acceleration_mmps2, out)
+	return max(out) + command_latency
+
+## end of function
+
+if __name__ == '__main__':
+	number_of_shots = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+	speed_setting = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+	max_speed = axis_max_speed_mmps[speed_setting]
+
+	planner = InterceptPlanner(x_min, x_max, defense_line_mm_y, attack_line_mm_y, paddle_radius_mm,
+		max_speed, max_speed, axis_acceleration_mmps2, axis_acceleration_mmps2, command_latency=command_latency)
+
+	# shots from the human's half at 500 - 5000 mm/s, angled up to 60 degrees off the table axis
+	# the paddle starts anywhere in its own area
+	random = np.random.RandomState(0)
+	puck_x = random.uniform(x_min, x_max, number_of_shots)
+	puck_y = random.uniform(table_length_mm_y/2, table_length_mm_y - puck_radius_mm, number_of_shots)
+	speeds = random.uniform(500, 5000, number_of_shots)
+	angles = np.radians(random.uniform(-60, 60, number_of_shots))
+	velocity_x = speeds*np.sin(angles)
+	velocity_y = -speeds*np.cos(angles)
+	paddle_x = random.uniform(150, table_width_mm_x - 150, number_of_shots)
+	paddle_y = random.uniform(defense_line_mm_y, attack_line_mm_y, number_of_shots)
+
+	planner_hits = 0
+	fixed_line_hits = 0
+	planner_times = np.zeros(number_of_shots)
+	intercept_times = []
+	for i in range(number_of_shots):
+		start_time = time.time()
+		intercept = planner.plan(puck_x[i], puck_y[i], velocity_x[i], velocity_y[i], paddle_x[i], paddle_y[i])
+		planner_times[i] = time.time() - start_time
+		if intercept is not None and intercept.reachable:
+			planner_hits += 1
+			intercept_times.append(intercept.time)
+
+		# fixed line: the paddle has to be on the attack line when the puck crosses it
+		target_x = get_intercept_position_x(puck_x[i], puck_y[i], velocity_x[i], velocity_y[i], attack_line_mm_y + paddle_radius_mm, x_min, x_max)
+		arrival_time = (attack_line_mm_y + paddle_radius_mm - puck_y[i])/velocity_y[i]
+		if get_move_time(paddle_x[i], paddle_y[i], target_x, attack_line_mm_y, max_speed) <= arrival_time:
+			fixed_line_hits += 1
+
+	print "%i shots, motor speed setting %i (%i mm/s, %i mm/s^2)" % (number_of_shots, speed_setting, max_speed, axis_acceleration_mmps2)
+	print "Planner:    %5.1f%% of shots intercepted in time, %.3f s to intercept on average" % (100.0*planner_hits/number_of_shots,
+		np.mean(intercept_times) if intercept_times else 0)
+	print "Fixed line: %5.1f%% of shots intercepted in time" % (100.0*fixed_line_hits/number_of_shots)
+	print "Planning time: mean %.1f us, 99th percentile %.1f us, max %.1f us" % (1e6*np.mean(planner_times),
+		1e6*np.percentile(planner_times, 99), 1e6*np.max(planner_times))
@@ -0,0 +1,135 @@
+# Paddle target filter check and benchmark
+# Checks the filters in filters.py against a straight numpy calculation over the valid samples in the window,
+# then times one add() of each against the averaging get_paddle_position_mm_x() used to do, and measures the lag
+# each one adds on a moving target and how much noise it takes out on a still one
+# Usage: python paddle_filter_benchmark.py [number of samples]
+import sys
+import time
+import numpy as np
+
+# add master controller module path
+sys.path.insert(0, '../')
+from filters import create_filter
+
+filter_configs = [{'filter': 'none'},
+				  {'filter': 'running_mean', 'window': 3},
+				  {'filter': 'running_mean', 'window': 5},
+				  {'filter': 'running_median', 'window': 3},
+				  {'filter': 'running_median', 'window': 5},
+				  {'filter': 'exponential', 'alpha': 0.5},
+				  {'filter': 'exponential', 'alpha': 0.25}]
+
+##
+## get_name(config)
+## Short name of a filter configuration for the results
+##
+def get_name(config):
+	if 'window' in config:
+		return "%s %i" % (config['filter'], config['window'])
+	elif 'alpha' in config:
+		return "%s %.2f" % (config['filter'], config['alpha'])
+	return config['filter']
+
+## end of function
+
+##
+## OldAverage(window)
+## The averaging get_paddle_position_mm_x() did before filters.py, 0 marks an empty slot
+##
+class OldAverage(object):
+	def __init__(self, window):
+		self.array = np.zeros(window)
+		self.index = 0
+
+	def add(self, value):
+		self.array[self.index] = value
+		number_non_zero_values = np.count_nonzero(self.array)
+		if number_non_zero_values != 0:
+			average = (np.sum(self.array)) / number_non_zero_values
+		else:
+			average = 0
+		self.index += 1
+		if self.index >= len(self.array):
+			self.index = 0
+		return average
+
+## end of class
+
+##
+## check(config, values, valid)
+## Compare a window filter's output with numpy over the same valid samples, returns the largest difference
+##
+def check(config, values, valid):
+	window_filter = create_filter(config)
+	reduce = np.mean if config['filter'] == 'running_mean' else np.median
+	window = config['window']
+	largest_difference = 0.0
+	for i in range(len(values)):
+		output = window_filter.add(values[i], valid[i])
+		start = max(i - window + 1, 0)
+		window_values = values[start:i + 1][valid[start:i + 1]]
+		if len(window_values) == 0:
+			if output is not None:
+				return np.inf
+		else:
+			largest_difference = max(largest_difference, abs(output - reduce(window_values)))
+	return largest_difference
+
+## end of function
+
+##
+## run(paddle_filter, values)
+## Output of a filter for every sample
+##
+def run(paddle_filter, values):
+	paddle_filter.reset()
+	return np.array([paddle_filter.add(value) for value in values])
+
+## end of function
+
+if __name__ == '__main__':
+	number_of_samples = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	random = np.random.RandomState(0)
+
+	# against numpy, with 20% of the samples invalid and some legitimate 0 mm samples
+	values = random.uniform(31.75, 743, 20000)
+	values[::97] = 0
+	valid = random.uniform(size=len(values)) > 0.2
+	for config in filter_configs:
+		if 'window' in config:
+			difference = check(config, values, valid)
+			if difference > 1e-6:
+				print "%s differs from numpy by %g mm" % (get_name(config), difference)
+				sys.exit(1)
+	print "Window filters match numpy over the valid samples"
+
+	# cost of one add()
+	values = random.uniform(31.75, 743, number_of_samples)
+	filters = [(get_name(config), create_filter(config)) for config in filter_configs]
+	print "%i samples" % number_of_samples
+	print "%-22s %10s" % ("filter", "us/call")
+	old_average = OldAverage(3)
+	start_time = time.time()
+	for value in values:
+		old_average.add(value)
+	print "%-22s %10.2f" % ("old np average 3", 1e6*(time.time() - start_time)/number_of_samples)
+	for (name, paddle_filter) in filters:
+		start_time = time.time()
+		for value in values:
+			paddle_filter.add(value)
+		print "%-22s %10.2f" % (name, 1e6*(time.time() - start_time)/number_of_samples)
+
+	# lag and noise, a sample every loop (about 8 ms at the puck tracker's 120 fps)
+	# ramp: the target sliding across at a steady speed, the lag is how many samples behind the output settles
+	# step: samples until the output is 90% of the way to a new target
+	# noise: standard deviation of the output around a still target with 10 mm of noise on it
+	ramp = np.arange(200)*2.0
+	step = np.where(np.arange(50) < 10, 200.0, 500.0)
+	still = 400 + random.normal(0, 10, 2000)
+	print "%-22s %12s %12s %12s" % ("filter", "ramp lag", "step 90%", "noise (mm)")
+	for (name, paddle_filter) in filters:
+		ramp_lag = (ramp[-1] - run(paddle_filter, ramp)[-1])/2.0
+		step_output = run(paddle_filter, step)
+		step_samples = int(np.argmax(step_output[10:] >= 200 + 0.9*300))
+		noise = np.std(run(paddle_filter, still)[10:])
+		print "%-22s %12.2f %12i %12.2f" % (name, ramp_lag, step_samples, noise)
@@ -0,0 +1,177 @@
+# Paddle controller command check
+# Runs the master controller's decisions against the paddle controller simulator on a loopback CAN bus, on a
+# simulated clock, and checks the paddle controller ends up where the firmware should once a game has stopped
+# commanding it: ON after a Diagnostics calibrate that follows a stopped game (the firmware turns itself on after
+# homing), and still OFF after clearing an error that happened in the middle of a game. Also checks nothing is sent
+# on the Diagnostics screen and that the keep-alives stop soon after the loop stops posting a command
+# Usage: python pc_command_check.py
+import os
+import sys
+
+# the master controller finds its settings and the other modules from its own directory
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, '.')
+import master_controller as mc
+import mc_replay
+from can_transport import VirtualCANBus, LoopbackTransport
+from can_worker import CANWorker
+from can_tx_scheduler import TxScheduler
+from can_codec import mc_cmd_pc
+import paddle_controller_sim as sim
+
+loop_period = 0.005			# master controller loop (s)
+calibration_time = 20.0		# long enough for the simulator to home both axes (s)
+settle_time = 3.0			# time given to anything stale to go out and act (s)
+
+state_names = {sim.state_off: 'OFF', sim.state_calibration: 'CALIBRATION', sim.state_on: 'ON', sim.state_error: 'ERROR'}
+
+##
+## Bench()
+## The master controller, its CAN worker and the paddle controller simulator on one bus and one clock
+##
+class Bench(object):
+	def __init__(self):
+		self.clock = mc_replay.ReplayClock()
+		bus = VirtualCANBus()
+		device = LoopbackTransport(bus)
+		device.open()
+		pc_transport = LoopbackTransport(bus)
+		pc_transport.open()
+		self.pc = sim.PaddleControllerSim(pc_transport)
+
+		mc_replay.set_up_master_controller(self.clock, device)
+		scheduler = TxScheduler(mc_cmd_pc, mc.can_min_change_mm, mc.can_keep_alive_period, mc.can_tx_bus_budget,
+			command_timeout=mc.can_command_timeout)
+		self.worker = CANWorker(device, scheduler, get_time=self.clock.get_time)
+		mc.can_worker = self.worker
+		mc.pt_tx.update({mc.pt_tx_enum.state: mc.pt_state_enum.tracking})
+		self.set_ui(state=mc.ui_state_enum.running, screen=mc.ui_screen_enum.menu)
+		self.request_count = 0
+
+	##
+	## set_ui(**fields)
+	## Write ui_tx fields by name, as the user interface would
+	##
+	def set_ui(self, **fields):
+		mc.ui_tx.update(dict((getattr(mc.ui_tx_enum, name), value) for (name, value) in fields.iteritems()))
+
+	##
+	## post_request(request)
+	## Make a one shot diagnostic request, as the user interface would
+	##
+	def post_request(self, request):
+		self.request_count += 1
+		self.set_ui(diagnostic_request=request, diagnostic_request_count=self.request_count)
+
+	##
+	## run(duration)
+	## Run the master controller loop and the simulator for duration seconds of simulated time
+	##
+	## Without decisions only the CAN worker runs, as if the loop had stalled
+	##
+	def run(self, duration, decisions=True):
+		end_time = self.pc.sim_time + duration
+		while self.pc.sim_time < end_time:
+			self.pc.advance(loop_period)
+			self.clock.time = self.pc.sim_time
+			if decisions:
+				mc.rx_IPC()
+				self.worker.receive()
+				mc.rx_CAN(self.worker)
+				mc.make_decisions()
+				mc.tx_IPC()
+			self.worker.transmit()
+
+	##
+	## get_commands_sent()
+	## Paddle commands the CAN worker has sent, one shots left out
+	##
+	def get_commands_sent(self):
+		return self.worker.scheduler.change_sends + self.worker.scheduler.keep_alive_sends
+
+	##
+	## play_game(screen)
+	## Start a game on screen until the paddle controller has calibrated and is on
+	##
+	def play_game(self, screen):
+		self.set_ui(screen=screen, game_state=mc.ui_game_state_enum.playing)
+		self.run(calibration_time)
+
+## end of class
+
+##
+## check(name, bench, expected_state)
+## Print whether the paddle controller is in expected_state, returns True if it is
+##
+def check(name, bench, expected_state):
+	passed = bench.pc.state == expected_state
+	print "%-58s %-12s %s" % (name, state_names[bench.pc.state], "ok" if passed else "FAIL, expected %s" % state_names[expected_state])
+	return passed
+
+## end of function
+
+##
+##
+## check_count(name, count, maximum)
+## Print whether count is no more than maximum, returns True if it is
+##
+def check_count(name, count, maximum):
+	passed = count <= maximum
+	print "%-58s %-12i %s" % (name, count, "ok" if passed else "FAIL, expected at most %i" % maximum)
+	return passed
+
+## end of function
+
+##
+## calibrate_after_stopped_game() / clear_error_after_game_error()
+## The two Diagnostics one shots after a game, returns True if the paddle controller ended up where it should
+##
+def calibrate_after_stopped_game():
+	bench = Bench()
+	bench.play_game(mc.ui_screen_enum.manual)
+	passed = check("Manual game playing", bench, sim.state_on)
+	bench.set_ui(game_state=mc.ui_game_state_enum.stopped)
+	bench.run(settle_time)
+	passed &= check("Manual game stopped", bench, sim.state_off)
+
+	bench.set_ui(screen=mc.ui_screen_enum.diagnostic, game_state=mc.ui_game_state_enum.idle)
+	commands_sent = bench.get_commands_sent()
+	bench.run(settle_time)
+	passed &= check_count("Commands sent on the Diagnostics screen", bench.get_commands_sent() - commands_sent, 0)
+	bench.post_request(mc.ui_diagnostic_request_enum.calibrate_paddle_controller)
+	bench.run(calibration_time)
+	return check("Diagnostics calibrate after the stopped game", bench, sim.state_on) and passed
+
+def clear_error_after_game_error():
+	bench = Bench()
+	bench.play_game(mc.ui_screen_enum.manual)
+	passed = check("Manual game playing", bench, sim.state_on)
+	bench.pc.y_axis.overload = True
+	bench.run(settle_time)
+	passed &= check("Y axis overload in the game", bench, sim.state_error)
+
+	bench.set_ui(screen=mc.ui_screen_enum.diagnostic, game_state=mc.ui_game_state_enum.idle)
+	bench.run(settle_time)
+	bench.post_request(mc.ui_diagnostic_request_enum.clear_errors)
+	bench.run(calibration_time)
+	passed &= not (bench.pc.x_axis.enabled or bench.pc.y_axis.enabled)
+	return check("Diagnostics clear error after the game error", bench, sim.state_off) and passed
+
+##
+## keep_alive_stops_with_loop()
+## Stall the loop in the middle of a game, returns True if the keep-alives stopped within the command timeout
+##
+def keep_alive_stops_with_loop():
+	bench = Bench()
+	bench.play_game(mc.ui_screen_enum.manual)
+	commands_sent = bench.get_commands_sent()
+	bench.run(settle_time, decisions=False)
+	return check_count("Keep-alives sent after the loop stalled", bench.get_commands_sent() - commands_sent,
+					   int(mc.can_command_timeout / mc.can_keep_alive_period))
+
+## end of function
+
+if __name__ == '__main__':
+	results = [calibrate_after_stopped_game(), clear_error_after_game_error(), keep_alive_stops_with_loop()]
+	print "All checks passed" if all(results) else "Checks failed"
+	sys.exit(0 if all(results) else 1)
@@ -0,0 +1,168 @@
+# Shared record benchmark
+# Times reading every field of pt_tx from the locked multiprocessing.Array the IPC used to use, one element at a
+# time, against a SharedStruct read the same way and read as one snapshot(). Then runs a writer process that
+# keeps setting every field to the same number and counts how many reads come back with a mix of two updates.
+# Last, goes through the IPC one master controller loop does with a new fix, before (element by element on the
+# Arrays, one lock acquisition each) and after (snapshots in, batched writes out) and reports how many times each
+# goes to shared memory and how long it takes
+# Usage: python shared_struct_benchmark.py [number of reads] [seconds of torn read test]
+import sys
+import json
+import time
+import multiprocessing
+
+# add master controller module path
+sys.path.insert(0, '../')
+from shared_struct import SharedStruct
+
+settings_path = "../../../../6_User_Interface/1_Software/4_Json/settings.json"
+
+# fields the master controller loop reads and writes when a new fix comes in
+pt_tx_reads = ['state', 'error', 'sequence', 'puck_position_x', 'puck_position_y', 'puck_velocity_x', 'puck_velocity_y',
+			   'puck_position_variance', 'puck_velocity_variance', 'fix_valid', 'frames_skipped', 'fix_latency',
+			   'publish_time', 'capture_time', 'grab_latency', 'warp_time', 'detect_time']
+ui_tx_reads = ['state', 'error', 'diagnostic_request', 'game_state', 'screen', 'game_speed_x', 'game_speed_y',
+			   'game_mode', 'paddle_position_x', 'paddle_position_y']
+hsv_fields = ['lower_hue', 'lower_sat', 'lower_val', 'upper_hue', 'upper_sat', 'upper_val']
+ui_rx_writes = ['pt_state', 'pt_error', 'mc_state', 'mc_error', 'pc_state', 'pc_error']
+
+##
+## Enum(names)
+## Field name -> index, like the enum() the processes build from the settings
+##
+class Enum(object):
+	def __init__(self, names):
+		for (index, name) in enumerate(names):
+			setattr(self, name, index)
+
+## end of class
+
+##
+## array_writer(array, stop) / struct_writer(record, stop)
+## Set every field to the next number until stop is set, element by element like the old IPC / as one update
+##
+def array_writer(array, stop):
+	n = 0
+	while not stop.is_set():
+		n += 1
+		for i in range(len(array)):
+			array[i] = n
+
+def struct_writer(record, stop):
+	n = 0
+	fields = range(len(record))
+	while not stop.is_set():
+		n += 1
+		record.update(dict.fromkeys(fields, n))
+
+## end of function
+
+##
+## old_loop(pt_tx, ui_tx, pt_rx, ui_rx, enums)
+## The master controller loop's IPC on the Arrays: rx_IPC(), send_UI_states() and the flight record's UI paddle
+## position, every element its own lock acquisition. Returns how many
+##
+def old_loop(pt_tx, ui_tx, pt_rx, ui_rx, enums):
+	(pt_tx_enum, ui_tx_enum, pt_rx_enum, ui_rx_enum) = enums
+	for name in pt_tx_reads:
+		pt_tx[getattr(pt_tx_enum, name)]
+	for name in ui_tx_reads:
+		ui_tx[getattr(ui_tx_enum, name)]
+	for name in hsv_fields:
+		pt_rx[getattr(pt_rx_enum, name)] = ui_tx[getattr(ui_tx_enum, name)]
+	for name in ui_rx_writes:
+		ui_rx[getattr(ui_rx_enum, name)] = 0
+	return len(pt_tx_reads) + len(ui_tx_reads) + 2*len(hsv_fields) + len(ui_rx_writes)
+
+## end of function
+
+##
+## new_loop(pt_tx, ui_tx, pt_rx, ui_rx, enums)
+## The same loop on SharedStructs: a snapshot of pt_tx and ui_tx, the colour thresholds as one update and the
+## states staged through the loop and published together by tx_IPC()
+##
+def new_loop(pt_tx, ui_tx, pt_rx, ui_rx, enums):
+	(pt_tx_enum, ui_tx_enum, pt_rx_enum, ui_rx_enum) = enums
+	pt_data = pt_tx.snapshot()
+	ui_data = ui_tx.snapshot()
+	pt_rx.update(dict((getattr(pt_rx_enum, name), ui_data[getattr(ui_tx_enum, name)]) for name in hsv_fields))
+	for name in ui_rx_writes:
+		ui_rx[getattr(ui_rx_enum, name)] = 0
+	pt_rx.publish()
+	ui_rx.publish()
+
+## end of function
+
+##
+## count_torn(read, duration)
+## Read for duration seconds while the writer runs, returns (reads, reads that mixed two updates)
+##
+def count_torn(read, duration):
+	reads = 0
+	torn = 0
+	end_time = time.time() + duration
+	while time.time() < end_time:
+		values = read()
+		reads += 1
+		if min(values) != max(values):
+			torn += 1
+	return reads, torn
+
+## end of function
+
+if __name__ == '__main__':
+	number_of_reads = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	duration = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+
+	with open(settings_path, 'r') as fp:
+		settings = json.load(fp)
+	layouts = [settings['puck_tracker']['enumerations']['pt_tx'], settings['user_interface']['enumerations']['ui_tx'],
+			   settings['puck_tracker']['enumerations']['pt_rx'], settings['user_interface']['enumerations']['ui_rx']]
+	field_names = layouts[0]
+	fields = range(len(field_names))
+
+	# cost of reading the whole record
+	array = multiprocessing.Array('d', len(field_names))
+	record = SharedStruct(field_names)
+	readers = [("Array, per element", lambda: [array[i] for i in fields]),
+			   ("SharedStruct, per element", lambda: [record[i] for i in fields]),
+			   ("SharedStruct, snapshot", record.snapshot)]
+	print "%i fields, %i reads" % (len(field_names), number_of_reads)
+	print "%-28s %10s" % ("read", "us/record")
+	for (name, read) in readers:
+		start_time = time.time()
+		for i in xrange(number_of_reads):
+			read()
+		print "%-28s %10.2f" % (name, 1e6*(time.time() - start_time)/number_of_reads)
+
+	# torn reads with a writer running in another process
+	print "%-28s %10s %10s" % ("read while writing", "reads", "torn")
+	for (name, writer, shared, read) in [("Array, per element", array_writer, array, readers[0][1]),
+										 ("SharedStruct, snapshot", struct_writer, record, record.snapshot)]:
+		stop = multiprocessing.Event()
+		process = multiprocessing.Process(target=writer, args=(shared, stop))
+		process.start()
+		time.sleep(0.1)
+		reads, torn = count_torn(read, duration)
+		stop.set()
+		process.join()
+		print "%-28s %10i %10i" % (name, reads, torn)
+	print "SharedStruct reader: %s" % record.get_stats()
+
+	# one master controller loop's IPC, before and after
+	enums = [Enum(names) for names in layouts]
+	arrays = [multiprocessing.Array('d', len(layouts[0]))] + [multiprocessing.Array('f', len(names)) for names in layouts[1:]]
+	records = [SharedStruct(names) for names in layouts]
+	records[2].set_batch_writes(True)
+	records[3].set_batch_writes(True)
+	number_of_loops = number_of_reads // 10
+	print "%-28s %14s %10s" % ("MC loop IPC", "accesses/loop", "us/loop")
+	start_time = time.time()
+	for i in xrange(number_of_loops):
+		acquisitions = old_loop(*(arrays + [enums]))
+	print "%-28s %14i %10.2f" % ("Array, per element", acquisitions, 1e6*(time.time() - start_time)/number_of_loops)
+	start_time = time.time()
+	for i in xrange(number_of_loops):
+		new_loop(*(records + [enums]))
+	accesses = sum(record.get_accesses() for record in records)
+	print "%-28s %14.0f %10.2f" % ("SharedStruct, batched", float(accesses)/number_of_loops, 1e6*(time.time() - start_time)/number_of_loops)
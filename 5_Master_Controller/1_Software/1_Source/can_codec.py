@@ -0,0 +1,138 @@
+# can_codec.py
+# Signal database for the MC <-> PC CAN messages and the packing/unpacking code generated from it
+# Refer to: https://github.com/tabdallah/capstone/blob/master/1_Planning/System_Interface_Design.xlsx
+#
+# Signals are little endian (Intel) with bit 0 the LSB of byte 0. A signal either fills whole bytes
+# (8, 16 or 32 bits starting on a byte boundary) or sits inside a single byte.
+# Each message is compiled once into an encode and a decode function: whole byte signals map straight onto
+# a struct field, signals sharing a byte are shifted and masked in and out of one byte field.
+
+import collections
+import struct
+
+# (message name, message ID, length (bytes), [(signal name, start bit, length (bits)), ...])
+message_definitions = [
+	('mc_cmd_pc', 0x100, 8, [
+		('pos_cmd_x_mm', 0, 16),
+		('pos_cmd_y_mm', 16, 16),
+		('motor_speed_cmd_x', 32, 2),
+		('motor_speed_cmd_y', 34, 2),
+		('state_cmd', 40, 4),
+		('mc_cmd_pc_debug', 56, 8)]),
+	('pc_status', 0x101, 8, [
+		('pos_x_mm', 0, 16),
+		('pos_y_mm', 16, 16),
+		('motor_speed_x', 32, 2),
+		('motor_speed_y', 34, 2),
+		('goal_scored', 36, 4),
+		('state', 40, 4),
+		('error', 48, 4),
+		('pc_status_debug', 56, 8)]),
+]
+
+struct_field_formats = {1: 'B', 2: 'H', 4: 'I'}
+
+##
+## CANMessage(name, message_id, length, signals)
+## One message from the signal database
+## encode(signal values...) takes the signal values by name or in order (missing ones are 0) and returns
+## the message data as a bytearray, whole byte signals can be floats (positions), the others must be integers
+## decode(data) returns the signal values as a namedtuple
+##
+class CANMessage(object):
+	def __init__(self, name, message_id, length, signals):
+		self.name = name
+		self.message_id = message_id
+		self.length = length
+		self.signals = signals
+		self.signal_names = [signal[0] for signal in signals]
+		self.values = collections.namedtuple(name, self.signal_names)
+		self.compile()
+
+	##
+	## get_fields()
+	## Split the message into struct fields
+	## Returns the struct format and a list of [byte offset, size, [(signal name, shift, mask), ...]]
+	##
+	def get_fields(self):
+		fields = {}
+		for (name, start_bit, length) in self.signals:
+			byte = start_bit // 8
+			if (start_bit % 8 == 0) and (length // 8 in struct_field_formats) and (length % 8 == 0):
+				size = length // 8
+			elif (start_bit % 8) + length <= 8:
+				size = 1
+			else:
+				raise ValueError("Signal %s in %s isn't whole bytes or inside one byte" % (name, self.name))
+			if (start_bit + length) > 8*self.length:
+				raise ValueError("Signal %s doesn't fit in %s" % (name, self.name))
+
+			field = fields.setdefault(byte, [byte, size, []])
+			if field[1] != size:
+				raise ValueError("Signal %s overlaps another signal in %s" % (name, self.name))
+			field[2].append((name, start_bit % 8, (1 << length) - 1))
+
+		# pad the bytes no signal uses
+		format = '<'
+		position = 0
+		fields = [fields[byte] for byte in sorted(fields)]
+		for (byte, size, signals) in fields:
+			if byte < position:
+				raise ValueError("Signals overlap in %s" % self.name)
+			format += 'x'*(byte - position) + struct_field_formats[size]
+			position = byte + size
+		format += 'x'*(self.length - position)
+		return format, fields
+
+	##
+	## compile()
+	## Generate encode() and decode() for this message's layout
+	##
+	def compile(self):
+		format, fields = self.get_fields()
+		self.struct = struct.Struct(format)
+
+		# decode: unpack every field, then pull the signals out of them
+		field_names = ['f%i' % i for i in range(len(fields))]
+		signal_expressions = {}
+		for (field_name, (byte, size, signals)) in zip(field_names, fields):
+			for (name, shift, mask) in signals:
+				if shift == 0 and mask == (1 << 8*size) - 1:
+					signal_expressions[name] = field_name
+				elif shift == 0:
+					signal_expressions[name] = "(%s & 0x%X)" % (field_name, mask)
+				else:
+					signal_expressions[name] = "((%s >> %i) & 0x%X)" % (field_name, shift, mask)
+		decode_source = "def decode(data):\n"
+		decode_source += "\t(%s,) = unpack_from(data)\n" % ", ".join(field_names)
+		decode_source += "\treturn tuple_new(values, (%s))\n" % ", ".join(signal_expressions[name] for name in self.signal_names)
+
+		# encode: mask every signal into place, or together the ones that share a field
+		field_expressions = []
+		for (byte, size, signals) in fields:
+			parts = []
+			for (name, shift, mask) in signals:
+				if mask == (1 << 8*size) - 1:
+					parts.append("(int(%s) & 0x%X)" % (name, mask))
+				elif shift == 0:
+					parts.append("(%s & 0x%X)" % (name, mask))
+				else:
+					parts.append("((%s & 0x%X) << %i)" % (name, mask, shift))
+			field_expressions.append(" | ".join(parts))
+		encode_source = "def encode(%s):\n" % ", ".join("%s=0" % name for name in self.signal_names)
+		encode_source += "\treturn bytearray(pack(%s))\n" % ", ".join(field_expressions)
+
+		# tuple.__new__ skips the namedtuple's own __new__, which costs as much again as the unpacking
+		namespace = {'unpack_from': self.struct.unpack_from, 'pack': self.struct.pack, 'values': self.values, 'tuple_new': tuple.__new__}
+		exec decode_source + encode_source in namespace
+		self.decode = namespace['decode']
+		self.encode = namespace['encode']
+		self.source = decode_source + encode_source
+
+## end of class
+
+# the compiled messages, by name and by message ID
+messages = dict((definition[0], CANMessage(*definition)) for definition in message_definitions)
+messages_by_id = dict((message.message_id, message) for message in messages.values())
+mc_cmd_pc = messages['mc_cmd_pc']
+pc_status = messages['pc_status']
@@ -0,0 +1,161 @@
+# can_receiver.py
+# CAN receive stage for the master controller: drains everything the transport has waiting in one pass,
+# keeps only the newest frame of each message ID for the control loop and a ring of recent frames per ID
+# for working out message rates, gaps, jitter and receive latency
+#
+# Hardware timestamps are on the adapter's (or kernel's) clock, so latency is reported as the excess over the
+# smallest (receive time - hardware time) in that ID's ring. That is the time the frame waited in the driver
+# queue for the loop to come and read it, over and above the fastest it has ever been read.
+
+import collections
+import numpy as np
+
+##
+## CANFrame(receive_time, message_id, data, hardware_time)
+## Newest frame of one message ID from a poll
+##
+CANFrame = collections.namedtuple('CANFrame', ['receive_time', 'message_id', 'data', 'hardware_time'])
+
+##
+## FrameRing(size)
+## Preallocated ring of the last size frame times and data of one message ID
+##
+class FrameRing(object):
+	def __init__(self, size):
+		self.size = size
+		self.hardware_times = np.zeros(size)
+		self.receive_times = np.zeros(size)
+		self.data = np.zeros((size, 8), dtype=np.uint8)
+		self.lengths = np.zeros(size, dtype=np.uint8)
+		self.index = 0			# where the next frame goes
+		self.count = 0			# frames received since reset
+		self.coalesced = 0		# frames replaced by a newer one in the same poll, never seen by the loop
+
+	def add(self, receive_time, data, hardware_time):
+		i = self.index
+		self.hardware_times[i] = hardware_time
+		self.receive_times[i] = receive_time
+		length = len(data)
+		self.data[i, :length] = data
+		self.lengths[i] = length
+		self.index = (i + 1) % self.size
+		self.count += 1
+
+	##
+	## get_recent()
+	## Hardware and receive times of the frames in the ring, oldest first
+	##
+	def get_recent(self):
+		if self.count < self.size:
+			return self.hardware_times[:self.count], self.receive_times[:self.count]
+		order = np.roll(np.arange(self.size), -self.index)
+		return self.hardware_times[order], self.receive_times[order]
+
+	##
+	## get_frames()
+	## Data of the frames in the ring as bytearrays, oldest first
+	##
+	def get_frames(self):
+		number_of_frames = min(self.count, self.size)
+		first = (self.index - number_of_frames) % self.size
+		indexes = [(first + i) % self.size for i in range(number_of_frames)]
+		return [bytearray(self.data[i, :self.lengths[i]]) for i in indexes]
+
+	##
+	## get_stats()
+	## Rate (messages/s), gaps between frames, jitter (standard deviation of the gaps) and receive latency
+	## over the frames in the ring, times in ms
+	##
+	def get_stats(self):
+		stats = {'count': self.count, 'coalesced': self.coalesced}
+		hardware_times, receive_times = self.get_recent()
+		if len(hardware_times) < 2:
+			return stats
+
+		gaps = np.diff(hardware_times)
+		period = np.median(gaps)
+		latency = receive_times - hardware_times
+		excess_latency = latency - latency.min()
+		stats.update({'rate': round(len(gaps)/(hardware_times[-1] - hardware_times[0]), 1) if hardware_times[-1] > hardware_times[0] else 0,
+					  'gap_mean_ms': round(1000*gaps.mean(), 3),
+					  'gap_max_ms': round(1000*gaps.max(), 3),
+					  'late': int(np.count_nonzero(gaps > 2*period)),		# gaps long enough that a frame was missed or held up
+					  'jitter_ms': round(1000*gaps.std(), 3),
+					  'latency_p50_ms': round(1000*np.percentile(excess_latency, 50), 3),
+					  'latency_p99_ms': round(1000*np.percentile(excess_latency, 99), 3),
+					  'latency_max_ms': round(1000*excess_latency.max(), 3)})
+		return stats
+
+## end of class
+
+##
+## CANReceiver(transport, ring_size, batch_size)
+## Reads the transport dry each poll() and hands back the newest frame per message ID
+##
+class CANReceiver(object):
+	def __init__(self, transport, ring_size=256, batch_size=64):
+		self.transport = transport
+		self.ring_size = ring_size
+		self.batch_size = batch_size
+		self.rings = {}
+		self.reset_stats()
+
+	##
+	## reset_stats()
+	## Clear the per ID rings and poll counters
+	##
+	def reset_stats(self):
+		self.rings = {}
+		self.polls = 0
+		self.empty_polls = 0
+		self.max_batch = 0				# most frames read in one poll
+
+	##
+	## poll()
+	## Read every frame waiting on the transport
+	## Returns a dictionary of message ID -> CANFrame holding the newest frame of each ID read
+	##
+	def poll(self):
+		latest = {}
+		rings = self.rings
+		frames_read = 0
+		while True:
+			messages = self.transport.read_batch(self.batch_size)
+			for (receive_time, message_id, data, hardware_time) in messages:
+				ring = rings.get(message_id)
+				if ring is None:
+					ring = rings[message_id] = FrameRing(self.ring_size)
+				ring.add(receive_time, data, hardware_time)
+				if message_id in latest:
+					ring.coalesced += 1
+				latest[message_id] = CANFrame(receive_time, message_id, data, hardware_time)
+			frames_read += len(messages)
+			if len(messages) < self.batch_size:
+				break
+
+		self.polls += 1
+		if frames_read == 0:
+			self.empty_polls += 1
+		self.max_batch = max(self.max_batch, frames_read)
+		return latest
+
+	##
+	## get_frames(message_id)
+	## Data of the recent frames of one message ID, oldest first
+	##
+	def get_frames(self, message_id):
+		ring = self.rings.get(message_id)
+		return ring.get_frames() if ring is not None else []
+
+	##
+	## get_stats()
+	## Poll counters, transport overruns and the per ID rate, gap, jitter and latency statistics
+	##
+	def get_stats(self):
+		return {'polls': self.polls,
+				'empty_polls': self.empty_polls,
+				'max_batch': self.max_batch,
+				'overrun': self.transport.messages_overrun,
+				'ids': dict(("0x%X" % message_id, ring.get_stats()) for (message_id, ring) in sorted(self.rings.items()))}
+
+## end of class
@@ -0,0 +1,372 @@
+# can_transport.py
+# CAN bus transports for the master controller: PCAN USB dongle, Linux SocketCAN and an in-process loopback bus
+# Every transport reads and writes (message ID, data) pairs, so the MC/PC protocol code doesn't care what is underneath
+
+import collections
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import os
+import struct
+import threading
+import cv2
+
+from PCANBasic import *
+
+can_bit_rate = 125000		# bits/s, the paddle controller runs its bus at 125 kbit/s
+
+##
+## get_time()
+## Monotonic time (s), the same clock the puck tracker timestamps fixes with
+##
+def get_time():
+	return cv2.getTickCount() / cv2.getTickFrequency()
+
+## end of function
+
+##
+## get_frame_bits(length)
+## Bits a standard ID data frame of length data bytes takes on the bus
+## Includes SOF, arbitration, control, CRC, ACK, EOF and interframe space but not bit stuffing
+##
+def get_frame_bits(length):
+	return 47 + 8*length
+
+## end of function
+
+##
+## CANTransport(bit_rate)
+## Base class for all transports, keeps the statistics
+## Backends implement open(), close(), read_batch(), write() and fileno()
+##
+## open() returns True on success, otherwise the reason is in last_error
+## read_batch(max_messages) returns a list of (timestamp, message ID, data bytearray, hardware timestamp), empty if nothing is waiting
+##		timestamp is get_time() when the message was read, hardware timestamp is when the adapter (or kernel) received it
+##		on its own clock, in s. Only differences between hardware timestamps mean anything.
+## write(message_id, data) queues a message without blocking, returns False if it couldn't be queued
+## fileno() is a file descriptor that becomes readable when messages arrive, or None
+##
+class CANTransport(object):
+	def __init__(self, bit_rate=can_bit_rate):
+		self.bit_rate = bit_rate
+		self.last_error = ""
+		self.reset_stats()
+
+	##
+	## reset_stats()
+	## Clear the message counters and restart the bus load window
+	##
+	def reset_stats(self):
+		self.messages_received = 0
+		self.messages_sent = 0
+		self.messages_dropped = 0		# writes that could not be queued
+		self.messages_overrun = 0		# received messages lost because they weren't read in time
+		self.bits_on_bus = 0
+		self.stats_start_time = get_time()
+
+	def count_received(self, length):
+		self.messages_received += 1
+		self.bits_on_bus += get_frame_bits(length)
+
+	def count_sent(self, length):
+		self.messages_sent += 1
+		self.bits_on_bus += get_frame_bits(length)
+
+	##
+	## get_bus_load()
+	## Share of the bus bandwidth (0-1) used by the messages this transport sent and received since reset_stats()
+	##
+	def get_bus_load(self):
+		elapsed = get_time() - self.stats_start_time
+		if elapsed <= 0:
+			return 0.0
+		return self.bits_on_bus / (self.bit_rate * elapsed)
+
+	##
+	## get_stats()
+	## Message counters and bus load
+	##
+	def get_stats(self):
+		return {'received': self.messages_received,
+				'sent': self.messages_sent,
+				'dropped': self.messages_dropped,
+				'overrun': self.messages_overrun,
+				'bus_load': round(self.get_bus_load(), 4)}
+
+	def fileno(self):
+		return None
+
+## end of class
+
+##
+## PCANTransport(channel, baud_rate)
+## PEAK PCAN USB dongle through PCANBasic
+##
+class PCANTransport(CANTransport):
+	def __init__(self, channel=PCAN_USBBUS1, baud_rate=PCAN_BAUD_125K, bit_rate=can_bit_rate):
+		super(PCANTransport, self).__init__(bit_rate)
+		self.channel = channel
+		self.baud_rate = baud_rate
+		self.device = PCANBasic()
+		self.receive_event = None
+
+	def open(self):
+		status = self.device.Initialize(self.channel, self.baud_rate)
+		self.device.Reset(self.channel)
+		if status > 0:
+			self.last_error = self.get_error_text(status)
+			return False
+
+		status, event = self.device.GetValue(self.channel, PCAN_RECEIVE_EVENT)
+		self.receive_event = event if status == PCAN_ERROR_OK else None
+		return True
+
+	def close(self):
+		status = self.device.Uninitialize(self.channel)
+		if status > 0:
+			self.last_error = self.get_error_text(status)
+			return False
+		return True
+
+	def read_batch(self, max_messages=64):
+		messages = []
+		while len(messages) < max_messages:
+			status, message, timestamp = self.device.Read(self.channel)
+			if status & (PCAN_ERROR_OVERRUN | PCAN_ERROR_QOVERRUN):
+				# the controller or driver queue overflowed before this message, it is still good
+				self.messages_overrun += 1
+				status &= ~(PCAN_ERROR_OVERRUN | PCAN_ERROR_QOVERRUN)
+			if status != PCAN_ERROR_OK:
+				if status != PCAN_ERROR_QRCVEMPTY:
+					self.last_error = self.get_error_text(status)
+				break
+			data = bytearray(message.DATA[:message.LEN])
+			hardware_timestamp = (timestamp.millis + 0x100000000*timestamp.millis_overflow)/1000.0 + timestamp.micros/1000000.0
+			messages.append((get_time(), message.ID, data, hardware_timestamp))
+			self.count_received(message.LEN)
+		return messages
+
+	def write(self, message_id, data):
+		message = TPCANMsg()
+		message.ID = message_id
+		message.MSGTYPE = PCAN_MESSAGE_STANDARD
+		message.LEN = len(data)
+		for i in range(len(data)):
+			message.DATA[i] = data[i]
+
+		# Write only puts the message in the driver's transmit queue, it doesn't wait for the bus
+		status = self.device.Write(self.channel, message)
+		if status > 0:
+			self.last_error = self.get_error_text(status)
+			self.messages_dropped += 1
+			return False
+		self.count_sent(len(data))
+		return True
+
+	def fileno(self):
+		return self.receive_event
+
+	def get_error_text(self, status):
+		return self.device.GetErrorText(status, 0)[1]
+
+## end of class
+
+# SocketCAN definitions from linux/can.h, Python 2 has no AF_CAN in the socket module
+PF_CAN = 29
+SOCK_RAW = 3
+CAN_RAW = 1
+can_frame_format = struct.Struct("=IB3x8s")	# can_id, can_dlc, padding, data
+SIOCGSTAMP = 0x8906							# ioctl for the kernel receive time of the last frame read
+timeval_format = struct.Struct("@ll")
+
+class sockaddr_can(ctypes.Structure):
+	_fields_ = [('can_family', ctypes.c_ushort),
+				('can_ifindex', ctypes.c_int),
+				('rx_id', ctypes.c_uint32),
+				('tx_id', ctypes.c_uint32)]
+
+##
+## SocketCANTransport(interface)
+## Linux SocketCAN raw socket, works with real adapters (can0) and the virtual vcan driver:
+##		sudo modprobe vcan && sudo ip link add dev vcan0 type vcan && sudo ip link set up vcan0
+##
+class SocketCANTransport(CANTransport):
+	def __init__(self, interface='vcan0', bit_rate=can_bit_rate):
+		super(SocketCANTransport, self).__init__(bit_rate)
+		self.interface = interface
+		self.fd = None
+		self.timeval = timeval_format.pack(0, 0)
+
+	def open(self):
+		libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+		ifindex = libc.if_nametoindex(self.interface)
+		if ifindex == 0:
+			self.last_error = "No CAN interface %s" % self.interface
+			return False
+
+		fd = libc.socket(PF_CAN, SOCK_RAW, CAN_RAW)
+		if fd < 0:
+			self.last_error = os.strerror(ctypes.get_errno())
+			return False
+
+		address = sockaddr_can(PF_CAN, ifindex, 0, 0)
+		if libc.bind(fd, ctypes.byref(address), ctypes.sizeof(address)) < 0:
+			self.last_error = os.strerror(ctypes.get_errno())
+			os.close(fd)
+			return False
+
+		fcntl.fcntl(fd, fcntl.F_SETFL, os.O_NONBLOCK)
+		self.fd = fd
+		return True
+
+	def close(self):
+		if self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
+		return True
+
+	def read_batch(self, max_messages=64):
+		messages = []
+		while len(messages) < max_messages:
+			try:
+				frame = os.read(self.fd, can_frame_format.size)
+			except OSError as e:
+				if e.errno != errno.EAGAIN:
+					self.last_error = os.strerror(e.errno)
+				break
+			(message_id, length, data) = can_frame_format.unpack(frame)
+			(seconds, microseconds) = timeval_format.unpack(fcntl.ioctl(self.fd, SIOCGSTAMP, self.timeval))
+			messages.append((get_time(), message_id, bytearray(data[:length]), seconds + microseconds/1000000.0))
+			self.count_received(length)
+		return messages
+
+	def write(self, message_id, data):
+		frame = can_frame_format.pack(message_id, len(data), str(bytearray(data)))
+		try:
+			os.write(self.fd, frame)
+		except OSError as e:
+			# EAGAIN/ENOBUFS when the interface transmit queue is full
+			self.last_error = os.strerror(e.errno)
+			self.messages_dropped += 1
+			return False
+		self.count_sent(len(data))
+		return True
+
+	def fileno(self):
+		return self.fd
+
+## end of class
+
+##
+## VirtualCANBus()
+## In-process bus for LoopbackTransports, every message written by one is delivered to all the others
+##
+class VirtualCANBus(object):
+	def __init__(self):
+		self.transports = []
+		self.lock = threading.Lock()
+
+	def attach(self, transport):
+		with self.lock:
+			self.transports.append(transport)
+
+	def detach(self, transport):
+		with self.lock:
+			if transport in self.transports:
+				self.transports.remove(transport)
+
+	def send(self, sender, message_id, data):
+		timestamp = get_time()
+		with self.lock:
+			for transport in self.transports:
+				if transport is not sender:
+					transport.deliver(timestamp, message_id, data)
+
+## end of class
+
+##
+## LoopbackTransport(bus, queue_size)
+## Endpoint on a VirtualCANBus, for running the master controller against a simulator in the same process
+## A pipe is written when messages arrive so select() can wait on it like the other transports
+##
+class LoopbackTransport(CANTransport):
+	def __init__(self, bus, queue_size=1024, bit_rate=can_bit_rate):
+		super(LoopbackTransport, self).__init__(bit_rate)
+		self.bus = bus
+		self.rx_queue = collections.deque()
+		self.queue_size = queue_size
+		self.wake_rx = None
+		self.wake_tx = None
+
+	def open(self):
+		self.wake_rx, self.wake_tx = os.pipe()
+		fcntl.fcntl(self.wake_rx, fcntl.F_SETFL, os.O_NONBLOCK)
+		fcntl.fcntl(self.wake_tx, fcntl.F_SETFL, os.O_NONBLOCK)
+		self.bus.attach(self)
+		return True
+
+	def close(self):
+		self.bus.detach(self)
+		if self.wake_rx is not None:
+			os.close(self.wake_rx)
+			os.close(self.wake_tx)
+			self.wake_rx = None
+			self.wake_tx = None
+		return True
+
+	def deliver(self, timestamp, message_id, data):
+		if len(self.rx_queue) >= self.queue_size:
+			self.rx_queue.popleft()
+			self.messages_overrun += 1
+		self.rx_queue.append((timestamp, message_id, bytearray(data), timestamp))
+		try:
+			os.write(self.wake_tx, b'\x00')
+		except OSError:
+			pass
+
+	def read_batch(self, max_messages=64):
+		try:
+			os.read(self.wake_rx, 4096)
+		except OSError:
+			pass
+
+		messages = []
+		while self.rx_queue and len(messages) < max_messages:
+			(timestamp, message_id, data, hardware_timestamp) = self.rx_queue.popleft()
+			messages.append((get_time(), message_id, data, hardware_timestamp))
+			self.count_received(len(data))
+
+		# more left than we took, make sure select() wakes up for them
+		if self.rx_queue:
+			try:
+				os.write(self.wake_tx, b'\x00')
+			except OSError:
+				pass
+		return messages
+
+	def write(self, message_id, data):
+		self.bus.send(self, message_id, data)
+		self.count_sent(len(data))
+		return True
+
+	def fileno(self):
+		return self.wake_rx
+
+## end of class
+
+##
+## create_can_transport(backend, interface, bus)
+## Make a transport by name: 'pcan', 'socketcan' (interface names the SocketCAN device) or 'loopback' (on bus)
+##
+def create_can_transport(backend, interface='vcan0', bus=None):
+	if backend == 'pcan':
+		return PCANTransport()
+	elif backend == 'socketcan':
+		return SocketCANTransport(interface)
+	elif backend == 'loopback':
+		return LoopbackTransport(bus if bus is not None else VirtualCANBus())
+	raise ValueError("Unknown CAN transport backend %s" % backend)
+
+## end of function
@@ -0,0 +1,147 @@
+# can_tx_scheduler.py
+# Decides when the CAN worker sends the paddle command
+#
+# A command goes out straight away when it differs meaningfully from the last one sent: the position target moved
+# by min_change_mm or more, or the motor speeds or state command changed. An unchanged command is repeated at the
+# keep-alive period so the paddle controller always has a recent one, but only while the control loop is still
+# posting it: a command posted more than command_timeout ago is left alone, whatever the loop is doing now isn't
+# commanding the paddle controller. Every send has to fit in a bus load budget,
+# a token bucket refilled at budget * bit rate bits/s, so a fast moving target can't flood the 125 kbit/s bus;
+# a change that doesn't fit waits for the bucket to refill and goes out then, replaced by anything newer.
+
+import math
+
+from can_transport import can_bit_rate, get_frame_bits
+
+##
+## TxScheduler(message, min_change_mm, keep_alive_period, bus_budget, burst_frames, bit_rate)
+## message: the CANMessage the commands are, see can_codec.py
+## min_change_mm: smallest position change sent straight away (mm)
+## keep_alive_period: longest time between sends (s)
+## bus_budget: share of the bus bandwidth (0-1) the commands may use
+## burst_frames: how many frames can go out back to back before the budget holds them up
+## command_timeout: longest time since a command was posted that it is still kept alive (s)
+##
+class TxScheduler(object):
+	def __init__(self, message, min_change_mm=5, keep_alive_period=0.05, bus_budget=0.25, burst_frames=4, bit_rate=can_bit_rate,
+				 command_timeout=0.1):
+		self.message = message
+		self.min_change_mm = min_change_mm
+		self.keep_alive_period = keep_alive_period
+		self.command_timeout = command_timeout
+		self.bit_rate = bit_rate
+		self.frame_bits = get_frame_bits(message.length)
+		self.budget_bits_per_second = bus_budget*bit_rate
+		self.bucket_size = burst_frames*self.frame_bits
+		self.reset_stats()
+
+	##
+	## reset_stats()
+	## Clear the send counters and forget the last command sent
+	##
+	def reset_stats(self, now=0.0):
+		self.last_sent = None			# decoded last command sent
+		self.last_send_time = None
+		self.tokens = self.bucket_size
+		self.token_time = now
+		self.change_sends = 0
+		self.keep_alive_sends = 0
+		self.held_by_budget = 0			# sends the budget held up, counted once however long they wait
+		self.holding = False
+		self.bits_sent = 0
+		self.stats_start_time = now
+
+	##
+	## is_change(command)
+	## True if a decoded command differs enough from the last one sent to go out now
+	##
+	def is_change(self, command):
+		last = self.last_sent
+		if last is None:
+			return True
+		if (command.motor_speed_cmd_x != last.motor_speed_cmd_x or command.motor_speed_cmd_y != last.motor_speed_cmd_y
+				or command.state_cmd != last.state_cmd):
+			return True
+		return math.hypot(command.pos_cmd_x_mm - last.pos_cmd_x_mm, command.pos_cmd_y_mm - last.pos_cmd_y_mm) >= self.min_change_mm
+
+	##
+	## forget_last_sent()
+	## Something other than a command went to the paddle controller (a one shot), so the next command is a change
+	##
+	def forget_last_sent(self):
+		self.last_sent = None
+
+	##
+	## is_live(post_time, now)
+	## True if a command posted at post_time (None if unknown) is still being posted, so may be kept alive
+	##
+	def is_live(self, post_time, now):
+		return post_time is None or now - post_time <= self.command_timeout
+
+	def refill(self, now):
+		self.tokens = min(self.bucket_size, self.tokens + (now - self.token_time)*self.budget_bits_per_second)
+		self.token_time = now
+
+	##
+	## check(data, now, post_time)
+	## Whether to send the command data, posted at post_time, now: 'change', 'keep_alive' or None
+	## A send that is returned is counted against the budget and becomes the last command sent
+	##
+	def check(self, data, now, post_time=None):
+		command = self.message.decode(data)
+		if self.is_change(command):
+			reason = 'change'
+		elif now - self.last_send_time >= self.keep_alive_period and self.is_live(post_time, now):
+			reason = 'keep_alive'
+		else:
+			return None
+
+		self.refill(now)
+		if self.tokens < self.frame_bits:
+			if not self.holding:
+				self.held_by_budget += 1
+				self.holding = True
+			return None
+		self.holding = False
+		self.tokens -= self.frame_bits
+		self.bits_sent += self.frame_bits
+		self.last_sent = command
+		self.last_send_time = now
+		if reason == 'change':
+			self.change_sends += 1
+		else:
+			self.keep_alive_sends += 1
+		return reason
+
+	##
+	## get_next_check_time(now, post_time)
+	## When check() could next return a send for an unchanged command posted at post_time: the keep-alive time
+	## while the command is live, or when the budget has refilled enough if a send is being held up. None before
+	## the first send and when there is nothing to wait for, only a new command can be sent then
+	##
+	def get_next_check_time(self, now, post_time=None):
+		if self.last_send_time is None:
+			return None
+		next_time = None
+		if self.is_live(post_time, now):
+			next_time = self.last_send_time + self.keep_alive_period
+		if self.holding:
+			refill_time = self.token_time + (self.frame_bits - self.tokens)/self.budget_bits_per_second
+			next_time = refill_time if next_time is None else min(next_time, refill_time)
+		return next_time
+
+	##
+	## get_stats(commands_posted, now)
+	## Send counts, frames saved against sending every posted command and the share of the bus the commands used
+	##
+	def get_stats(self, commands_posted, now):
+		frames_sent = self.change_sends + self.keep_alive_sends
+		elapsed = max(now - self.stats_start_time, 1e-9)
+		return {'change_sends': self.change_sends,
+				'keep_alive_sends': self.keep_alive_sends,
+				'held_by_budget': self.held_by_budget,
+				'frames_saved': max(commands_posted - frames_sent, 0),
+				'tx_bus_load': round(self.bits_sent/(elapsed*self.bit_rate), 4),
+				'tx_bus_budget': round(self.budget_bits_per_second/self.bit_rate, 4)}
+
+## end of class
@@ -0,0 +1,285 @@
+# can_worker.py
+# CAN I/O thread for the master controller
+# The worker owns the transport: it reads the bus continuously through a CANReceiver and sends the paddle
+# command when its TxScheduler says so (see can_tx_scheduler.py), whatever the control loop is doing.
+#
+# The control loop never touches the transport. It replaces the latest command in a single slot mailbox, which is
+# one reference assignment and so needs no lock, and wakes the worker, which decides whether the new command goes out.
+# When the control loop stops commanding the paddle controller (a game ends, an error, calibrate) it empties the
+# mailbox, so the last command of a game isn't repeated once the game is over.
+# Commands that must not be replaced before they go out (calibrate, clear error) are queued as one shots instead
+# and sent as soon as the worker wakes up. The newest received frame of each ID is handed back the same way.
+
+import collections
+import errno
+import fcntl
+import logging
+import os
+import select
+import threading
+import numpy as np
+
+from can_transport import get_time
+from can_receiver import CANReceiver
+
+# longest the worker waits between reads on transports that can't signal received messages (s)
+receive_poll_period = 0.001
+
+##
+## make_wake_pipe()
+## Non blocking pipe to wake up a select() in another thread, returns (read end, write end)
+##
+def make_wake_pipe():
+	read_end, write_end = os.pipe()
+	fcntl.fcntl(read_end, fcntl.F_SETFL, os.O_NONBLOCK)
+	fcntl.fcntl(write_end, fcntl.F_SETFL, os.O_NONBLOCK)
+	return read_end, write_end
+
+## end of function
+
+##
+## wake(fd) / drain(fd)
+## Make a wake pipe readable / empty it again, a full pipe is already readable so that isn't an error
+##
+def wake(fd):
+	try:
+		os.write(fd, b'\x00')
+	except OSError as error:
+		if error.errno != errno.EAGAIN:
+			raise
+
+def drain(fd):
+	try:
+		os.read(fd, 4096)
+	except OSError as error:
+		if error.errno != errno.EAGAIN:
+			raise
+
+## end of function
+
+##
+## CANWorker(transport, scheduler, fix_latency, get_time, latency_ring_size)
+## transport: an open CAN transport, see can_transport.py
+## scheduler: TxScheduler for the mailbox commands, its message gives the ID they are sent with
+## fix_latency: LatencyHistogram for puck fix published -> command sent, or None
+## get_time: clock for the scheduler and the latencies, must be the puck tracker's clock for fix_latency
+##
+class CANWorker(object):
+	def __init__(self, transport, scheduler, fix_latency=None, get_time=get_time, latency_ring_size=4096):
+		self.transport = transport
+		self.receiver = CANReceiver(transport)
+		self.scheduler = scheduler
+		self.command_message_id = scheduler.message.message_id
+		self.fix_latency = fix_latency
+		self.get_time = get_time
+
+		# mailbox: (data, fix publish time, post time) of the latest command, replaced whole by post_command()
+		self.command = None
+		self.one_shots = collections.deque(maxlen=16)
+
+		# newest received frame of each message ID, and the ones get_new() already handed out
+		self.latest = {}
+		self.taken = {}
+
+		# received_ready wakes the control loop, command_ready wakes the worker
+		self.received_ready_rx, self.received_ready_tx = make_wake_pipe()
+		self.command_ready_rx, self.command_ready_tx = make_wake_pipe()
+
+		# post -> send time of the changes and how late the keep-alives were (s)
+		self.change_latency = np.zeros(latency_ring_size)
+		self.keep_alive_lateness = np.zeros(latency_ring_size)
+		self.running = False
+		self.thread = None
+		self.reset_stats()
+
+	##
+	## reset_stats()
+	## Clear the send counters and latency rings
+	##
+	def reset_stats(self):
+		self.commands_posted = 0
+		self.change_sends = 0
+		self.keep_alive_sends = 0
+		self.one_shots_sent = 0
+		self.send_errors = 0
+		self.scheduler.reset_stats(self.get_time())
+		self.receiver.reset_stats()
+
+	##
+	## post_command(data, fix_publish_time) / post_one_shot(data)
+	## Called from the control loop, never block
+	## post_command() replaces the latest command, fix_publish_time is when the puck fix the command was
+	## decided on was published, or None
+	## post_one_shot() queues a command to be sent once, straight away, ahead of the latest command
+	##
+	def post_command(self, data, fix_publish_time=None):
+		self.command = (data, fix_publish_time, self.get_time())
+		self.commands_posted += 1
+		wake(self.command_ready_tx)
+
+	def post_one_shot(self, data):
+		self.one_shots.append(data)
+		wake(self.command_ready_tx)
+
+	##
+	## clear_command()
+	## Called from the control loop when it stops commanding the paddle controller, empties the mailbox so nothing
+	## more is sent until the next post_command(). One shots already queued still go out
+	##
+	def clear_command(self):
+		self.command = None
+
+	##
+	## get_new(message_id)
+	## Called from the control loop, the newest frame of message_id if it arrived since the last call, otherwise None
+	##
+	def get_new(self, message_id):
+		frame = self.latest.get(message_id)
+		if frame is None or frame is self.taken.get(message_id):
+			return None
+		self.taken[message_id] = frame
+		return frame
+
+	##
+	## fileno()
+	## File descriptor that becomes readable when new frames arrive, empty it with drain()
+	##
+	def fileno(self):
+		return self.received_ready_rx
+
+	##
+	## receive()
+	## Read every frame waiting on the transport and publish the newest of each ID
+	##
+	def receive(self):
+		latest = self.receiver.poll()
+		if latest:
+			self.latest.update(latest)
+			wake(self.received_ready_tx)
+
+	##
+	## send(data)
+	## Write one command, returns True if the transport queued it
+	##
+	def send(self, data):
+		if self.transport.write(self.command_message_id, data):
+			return True
+		self.send_errors += 1
+		logging.error("Error transmitting CAN message: %s", self.transport.last_error)
+		return False
+
+	##
+	## send_one_shots()
+	## Send every queued one shot command in the order they were posted
+	##
+	def send_one_shots(self):
+		while self.one_shots:
+			if self.send(self.one_shots.popleft()):
+				self.one_shots_sent += 1
+				self.scheduler.forget_last_sent()
+
+	##
+	## send_command()
+	## Send the latest command in the mailbox if the scheduler says it is time
+	##
+	def send_command(self):
+		command = self.command
+		if command is None:
+			return
+		(data, fix_publish_time, post_time) = command
+		scheduler = self.scheduler
+		keep_alive_time = scheduler.last_send_time + scheduler.keep_alive_period if scheduler.last_send_time is not None else None
+		now = self.get_time()
+		reason = scheduler.check(data, now, post_time)
+		if reason is None or not self.send(data):
+			return
+
+		if reason == 'change':
+			self.change_latency[self.change_sends % len(self.change_latency)] = now - post_time
+			self.change_sends += 1
+			if fix_publish_time is not None and self.fix_latency is not None:
+				self.fix_latency.add(now - fix_publish_time)
+		else:
+			self.keep_alive_lateness[self.keep_alive_sends % len(self.keep_alive_lateness)] = now - keep_alive_time
+			self.keep_alive_sends += 1
+
+	##
+	## transmit()
+	## Send the one shots and then the latest command if it is due, for running the worker without its thread (mc_replay.py)
+	##
+	def transmit(self):
+		self.send_one_shots()
+		self.send_command()
+
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target=self.run, name="can_worker")
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.running = False
+		if self.thread is not None:
+			wake(self.command_ready_tx)
+			self.thread.join(1.0)
+			self.thread = None
+
+	def is_running(self):
+		return self.thread is not None and self.thread.is_alive()
+
+	def close(self):
+		for fd in (self.received_ready_rx, self.received_ready_tx, self.command_ready_rx, self.command_ready_tx):
+			os.close(fd)
+
+	def run(self):
+		get_time = self.get_time
+		wait_list = [self.command_ready_rx]
+		if self.transport.fileno() is not None:
+			wait_list.append(self.transport.fileno())
+			max_wait = self.scheduler.keep_alive_period
+		else:
+			max_wait = receive_poll_period
+
+		while self.running:
+			self.transmit()
+
+			# sleep until the next keep-alive is due or the budget has room again, unless a frame or command comes first
+			# with no command, or one no longer being posted, only a new command can be sent and that wakes us
+			now = get_time()
+			command = self.command
+			next_check_time = self.scheduler.get_next_check_time(now, command[2]) if command is not None else None
+			wait = max_wait if next_check_time is None else min(max(next_check_time - now, 0), max_wait)
+			ready_list = select.select(wait_list, [], [], wait)[0]
+			if self.command_ready_rx in ready_list:
+				drain(self.command_ready_rx)
+			self.receive()
+
+	##
+	## get_ring(ring, count)
+	## The filled part of a latency ring
+	##
+	def get_ring(self, ring, count):
+		return ring[:min(count, len(ring))]
+
+	##
+	## get_stats()
+	## Send counts, how long changes took to go out and how late the keep-alives were (ms),
+	## the scheduler's frames saved and bus load, and the receiver's statistics
+	##
+	def get_stats(self):
+		stats = {'commands_posted': self.commands_posted,
+				 'one_shots': self.one_shots_sent,
+				 'send_errors': self.send_errors}
+		stats.update(self.scheduler.get_stats(self.commands_posted, self.get_time()))
+		for (name, ring, count) in (('change_latency', self.change_latency, self.change_sends),
+									('keep_alive_lateness', self.keep_alive_lateness, self.keep_alive_sends)):
+			times = self.get_ring(ring, count)
+			if len(times) > 0:
+				stats.update({name + '_p50_ms': round(1000*np.percentile(times, 50), 3),
+							  name + '_p99_ms': round(1000*np.percentile(times, 99), 3),
+							  name + '_max_ms': round(1000*times.max(), 3)})
+		stats['transport_bus_load'] = round(self.transport.get_bus_load(), 4)
+		stats['receiver'] = self.receiver.get_stats()
+		return stats
+
+## end of class
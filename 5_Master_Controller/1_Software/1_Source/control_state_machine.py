@@ -0,0 +1,184 @@
+# control_state_machine.py
+# Table driven paddle control state machines, defined in settings.json under master_controller/control_state_machines
+#
+# Every state has an action, run each loop while in that state, and a list of (next state, guard) transitions
+# checked in order after the action, the first guard that is true wins. any_state_transitions are checked last
+# from every state and win over the state's own transitions.
+# Guards are python expressions over master controller globals. They are compiled once, and the globals each
+# one reads are found from its code, so a guard is only evaluated again when one of those globals has changed.
+# A guard can also read attributes (pt_state_enum.tracking) and call builtins (abs), these aren't inputs; any other
+# name a guard reads is an error when the state machine is built, not when the guard is first evaluated.
+
+import __builtin__
+import collections
+import dis
+
+##
+## ControlStateMachine(name, definition, guards, state_enum, actions, namespace, get_time)
+## definition: this state machine's entry from settings.json
+## guards: guard name -> expression, shared by all state machines
+## state_enum: enum of state names (mc_control_state_machine)
+## actions: action name -> function taking no arguments, its return value is passed back from step()
+## namespace: dictionary the guards are evaluated in, the master controller's globals()
+## get_time: clock for the time spent in each state (s)
+##
+class ControlStateMachine(object):
+	def __init__(self, name, definition, guards, state_enum, actions, namespace, get_time):
+		self.name = name
+		self.state_names = state_enum.reverse_mapping
+		self.namespace = namespace
+		self.get_time = get_time
+
+		# compile the guards this state machine uses and collect the inputs they read
+		used_guards = set(guard for state in definition['states'].values() for (next_state, guard) in state['transitions'])
+		used_guards.update(guard for (next_state, guard) in definition['any_state_transitions'])
+		self.guard_names = sorted(used_guards)
+		self.guard_code = [compile(guards[guard], guard, 'eval') for guard in self.guard_names]
+		guard_variables = [get_variables(code) for code in self.guard_code]
+		for (guard, variables) in zip(self.guard_names, guard_variables):
+			unknown = sorted(name for name in variables if name not in namespace and not hasattr(__builtin__, name))
+			if unknown:
+				raise ValueError("Guard %s in %s reads %s, which isn't a master controller global or a builtin" % (guard, self.name, ", ".join(unknown)))
+		self.inputs = sorted(set(name for variables in guard_variables for name in variables if name in namespace))
+		self.guard_inputs = [[self.inputs.index(name) for name in variables if name in namespace] for variables in guard_variables]
+		guard_index = dict((guard, i) for (i, guard) in enumerate(self.guard_names))
+
+		# transition table, indexed by state number
+		number_of_states = len(self.state_names)
+		self.actions = [None]*number_of_states
+		self.transitions = [[] for i in range(number_of_states)]
+		for (state_name, state) in definition['states'].items():
+			state_number = getattr(state_enum, state_name)
+			self.actions[state_number] = actions[state['action']]
+			self.transitions[state_number] = [(getattr(state_enum, next_state), guard_index[guard]) for (next_state, guard) in state['transitions']]
+		self.any_state_transitions = [(getattr(state_enum, next_state), guard_index[guard]) for (next_state, guard) in definition['any_state_transitions']]
+
+		# guard results from the last evaluation and the inputs they were evaluated with
+		self.input_values = [None]*len(self.inputs)
+		self.guard_values = [False]*len(self.guard_names)
+		self.guard_dirty = [True]*len(self.guard_names)
+
+		self.reset_stats()
+
+	##
+	## reset_stats()
+	## Clear the transition counts and state times
+	##
+	def reset_stats(self):
+		self.transition_counts = collections.defaultdict(int)
+		self.state_time = collections.defaultdict(float)
+		self.guard_evaluations = 0
+		self.steps = 0
+		self.last_step_time = None
+		self.last_state = None
+
+	##
+	## update_inputs()
+	## Mark the guards whose inputs changed since the last step
+	##
+	def update_inputs(self):
+		namespace = self.namespace
+		input_values = self.input_values
+		changed = []
+		for (i, name) in enumerate(self.inputs):
+			value = namespace[name]
+			if value != input_values[i]:
+				input_values[i] = value
+				changed.append(i)
+		if changed:
+			guard_dirty = self.guard_dirty
+			for (guard, inputs) in enumerate(self.guard_inputs):
+				if not guard_dirty[guard]:
+					for i in changed:
+						if i in inputs:
+							guard_dirty[guard] = True
+							break
+
+	def get_guard(self, guard):
+		if self.guard_dirty[guard]:
+			self.guard_values[guard] = bool(eval(self.guard_code[guard], self.namespace))
+			self.guard_dirty[guard] = False
+			self.guard_evaluations += 1
+		return self.guard_values[guard]
+
+	##
+	## pause()
+	## Stop the clock on the current state while the state machine isn't being stepped (the other game mode, another
+	## screen, tracking lost), so the time until the next step isn't counted as time spent in it
+	##
+	def pause(self):
+		if self.last_step_time is not None:
+			self.state_time[self.last_state] += self.get_time() - self.last_step_time
+			self.last_step_time = None
+
+	##
+	## step(state)
+	## Run state's action, then take the first transition whose guard is true
+	## Returns the next state and what the action returned
+	##
+	def step(self, state):
+		now = self.get_time()
+		if self.last_step_time is not None:
+			self.state_time[self.last_state] += now - self.last_step_time
+		self.last_step_time = now
+		self.steps += 1
+
+		result = self.actions[state]()
+
+		self.update_inputs()
+		next_state = state
+		for (transition_state, guard) in self.any_state_transitions:
+			if self.get_guard(guard):
+				next_state = transition_state
+				break
+		else:
+			for (transition_state, guard) in self.transitions[state]:
+				if self.get_guard(guard):
+					next_state = transition_state
+					break
+
+		if next_state != state:
+			self.transition_counts[(state, next_state)] += 1
+		self.last_state = next_state
+		return next_state, result
+
+	##
+	## get_stats()
+	## Transition counts, time spent in each state (s) and how many guards had to be evaluated
+	##
+	def get_stats(self):
+		names = self.state_names
+		return {'transitions': dict(("%s -> %s" % (names[a], names[b]), count) for ((a, b), count) in self.transition_counts.items()),
+				'state_time': dict((names[state], round(time, 3)) for (state, time) in self.state_time.items()),
+				'steps': self.steps,
+				'guard_evaluations': self.guard_evaluations}
+
+## end of class
+
+##
+## get_variables(code)
+## Names a compiled guard loads as variables, leaving out those it only reads as attributes (x.name)
+##
+def get_variables(code):
+	variables = set()
+	load_opcodes = (dis.opmap['LOAD_NAME'], dis.opmap['LOAD_GLOBAL'])
+	codes = [code]
+	while codes:
+		code = codes.pop()
+		bytecode = code.co_code
+		i = 0
+		while i < len(bytecode):
+			opcode = ord(bytecode[i])
+			if opcode >= dis.HAVE_ARGUMENT:
+				argument = ord(bytecode[i + 1]) + 256*ord(bytecode[i + 2])
+				if opcode in load_opcodes:
+					variables.add(code.co_names[argument])
+				i += 3
+			else:
+				i += 1
+
+		# generator expressions and lambdas in the guard are code objects of their own
+		codes.extend(constant for constant in code.co_consts if hasattr(constant, 'co_code'))
+	return variables
+
+## end of function
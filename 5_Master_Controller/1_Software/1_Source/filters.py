@@ -0,0 +1,155 @@
+# filters.py
+# Small fixed cost filters for the paddle target: running mean, running median and exponential smoothing
+#
+# The window filters keep their samples in a fixed capacity ring with a validity mask beside it, so an empty
+# slot is marked as such instead of being a 0 mm sample, and update their output as each sample goes in rather
+# than going over the whole window again. The rings are plain lists: for a handful of samples indexing a list
+# costs a fraction of indexing a numpy array. Each filter is selected and configured by a settings dictionary,
+# see create_filter().
+
+import bisect
+
+##
+## RingFilter(window)
+## Base for the window filters: the last window samples and which of them are valid
+## add(value, valid) puts a sample in, dropping the oldest, and returns the output, None while no sample is valid
+##
+class RingFilter(object):
+	def __init__(self, window):
+		self.window = window
+		self.values = [0.0]*window
+		self.valid = [False]*window
+		self.reset()
+
+	##
+	## reset()
+	## Forget every sample, e.g. when the state machine changes state
+	##
+	def reset(self):
+		self.valid[:] = [False]*self.window
+		self.index = 0
+		self.number_valid = 0
+
+	##
+	## push(value, valid)
+	## Put a sample in the ring, returns the sample it replaced as (value, valid)
+	##
+	def push(self, value, valid):
+		valid = bool(valid)
+		i = self.index
+		old_value = self.values[i]
+		old_valid = self.valid[i]
+		self.values[i] = value
+		self.valid[i] = valid
+		self.number_valid += valid - old_valid
+		self.index = i + 1 if i + 1 < self.window else 0
+		return old_value, old_valid
+
+## end of class
+
+##
+## RunningMean(window)
+## Mean of the valid samples in the window, a running sum updated with the sample going in and the one going out
+##
+class RunningMean(RingFilter):
+	def reset(self):
+		super(RunningMean, self).reset()
+		self.sum = 0.0
+
+	def add(self, value, valid=True):
+		old_value, old_valid = self.push(value, valid)
+		if old_valid:
+			self.sum -= old_value
+		if valid:
+			self.sum += value
+		if self.number_valid == 0:
+			# nothing left to average, start the sum again so rounding errors don't build up
+			self.sum = 0.0
+			return None
+		return self.sum / self.number_valid
+
+## end of class
+
+##
+## RunningMedian(window)
+## Median of the valid samples in the window, kept in a sorted list the samples are inserted into and removed from
+## with a binary search, only the list shift is linear and the windows used here are a handful of samples
+##
+class RunningMedian(RingFilter):
+	def reset(self):
+		super(RunningMedian, self).reset()
+		self.sorted_values = []
+
+	def add(self, value, valid=True):
+		old_value, old_valid = self.push(value, valid)
+		sorted_values = self.sorted_values
+		if old_valid:
+			del sorted_values[bisect.bisect_left(sorted_values, old_value)]
+		if valid:
+			bisect.insort(sorted_values, float(value))
+
+		n = len(sorted_values)
+		if n == 0:
+			return None
+		if n % 2:
+			return sorted_values[n // 2]
+		return (sorted_values[n // 2 - 1] + sorted_values[n // 2]) / 2.0
+
+## end of class
+
+##
+## ExponentialSmoothing(alpha)
+## output += alpha * (sample - output), invalid samples leave the output as it is
+## Needs no window, the first valid sample after a reset is passed straight through
+##
+class ExponentialSmoothing(object):
+	def __init__(self, alpha):
+		self.alpha = alpha
+		self.reset()
+
+	def reset(self):
+		self.output = None
+
+	def add(self, value, valid=True):
+		if valid:
+			if self.output is None:
+				self.output = float(value)
+			else:
+				self.output += self.alpha * (value - self.output)
+		return self.output
+
+## end of class
+
+##
+## PassThrough()
+## No filtering, the latest valid sample
+##
+class PassThrough(ExponentialSmoothing):
+	def __init__(self):
+		super(PassThrough, self).__init__(1.0)
+
+	def add(self, value, valid=True):
+		if valid:
+			self.output = float(value)
+		return self.output
+
+## end of class
+
+##
+## create_filter(config)
+## Make a filter from its settings: {"filter": "running_mean" or "running_median", "window": samples},
+## {"filter": "exponential", "alpha": 0-1} or {"filter": "none"}
+##
+def create_filter(config):
+	name = config['filter']
+	if name == 'running_mean':
+		return RunningMean(config['window'])
+	elif name == 'running_median':
+		return RunningMedian(config['window'])
+	elif name == 'exponential':
+		return ExponentialSmoothing(config['alpha'])
+	elif name == 'none':
+		return PassThrough()
+	raise ValueError("Unknown filter %s" % name)
+
+## end of function
@@ -0,0 +1,83 @@
+# flight_recorder.py
+# Fixed width binary recorder for every master controller loop, kept in a memory mapped ring file
+
+import ast
+import numpy as np
+
+# file layout: a fixed size header followed by number_of_records records
+header_size = 4096
+header_magic = 'AHRFLT01'
+header_dtype = np.dtype([('magic', 'S8'),
+						 ('record_size', '<u4'),
+						 ('number_of_records', '<u8'),
+						 ('records_written', '<u8'),
+						 ('record_dtype', 'S4000')])
+
+##
+## FlightRecorder(file_name, record_dtype, number_of_records)
+## Every record has the same numpy structured layout, so a session costs
+## number_of_records * record_dtype.itemsize bytes no matter how long it runs
+## Once the file is full the oldest records are overwritten
+## Records are written straight into the memory map, the OS takes care of getting them to disk
+##
+class FlightRecorder(object):
+	def __init__(self, file_name, record_dtype, number_of_records=1000000):
+		self.file_name = file_name
+		self.record_dtype = np.dtype(record_dtype)
+		self.number_of_records = number_of_records
+
+		file_size = header_size + number_of_records*self.record_dtype.itemsize
+		self.memory_map = np.memmap(file_name, dtype=np.uint8, mode='w+', shape=(file_size, ))
+		self.header = self.memory_map[:header_dtype.itemsize].view(header_dtype)
+		self.records = self.memory_map[header_size:].view(self.record_dtype)
+
+		self.header['magic'] = header_magic
+		self.header['record_size'] = self.record_dtype.itemsize
+		self.header['number_of_records'] = number_of_records
+		self.header['records_written'] = 0
+		self.header['record_dtype'] = str(self.record_dtype.descr)
+		self.records_written = 0
+
+	##
+	## append(record)
+	## Write one record, a tuple with a value for every field in order
+	##
+	def append(self, record):
+		self.records[self.records_written % self.number_of_records] = record
+		self.records_written += 1
+		self.header['records_written'] = self.records_written
+
+	##
+	## close()
+	## Flush the memory map to disk
+	##
+	def close(self):
+		self.memory_map.flush()
+		del self.records
+		del self.header
+		del self.memory_map
+
+## end of class
+
+##
+## load_flight_record(file_name)
+## Read a flight recorder file into a numpy structured array, oldest record first
+## Works on a file that is still being recorded, the newest record may be partly written
+##
+def load_flight_record(file_name):
+	header = np.fromfile(file_name, dtype=header_dtype, count=1)[0]
+	if header['magic'] != header_magic:
+		raise ValueError("%s is not a flight recorder file" % file_name)
+
+	record_dtype = np.dtype(ast.literal_eval(header['record_dtype']))
+	number_of_records = int(header['number_of_records'])
+	records_written = int(header['records_written'])
+	records = np.memmap(file_name, dtype=record_dtype, mode='r', offset=header_size, shape=(number_of_records, ))
+
+	# unwrap the ring so the records come out in the order they were written
+	if records_written <= number_of_records:
+		return np.array(records[:records_written])
+	oldest = records_written % number_of_records
+	return np.concatenate((records[oldest:], records[:oldest]))
+
+## end of function
@@ -0,0 +1,168 @@
+# frame_ring_buffer.py
+# Shared memory ring buffer for passing video frames between the MC, PT and UI processes
+
+import ctypes
+import multiprocessing.sharedctypes
+import numpy as np
+
+# indexes into the shared header
+header_latest_sequence = 0		# sequence number of the newest complete frame
+header_consumed_sequence = 1	# sequence number of the last frame the consumer took
+header_frames_produced = 2
+header_frames_consumed = 3
+header_frames_dropped = 4		# frames overwritten before the consumer took them
+header_closed = 5
+header_size = 6
+
+##
+## FrameRingBuffer(frame_shape, number_of_slots)
+## Fixed number of preallocated frame slots in shared memory, written by one producer
+## Every slot carries the sequence number of the frame in it, so readers can tell a complete
+## frame from one that is being overwritten without taking any locks
+## Frames can be any size up to frame_shape (rows, columns, channels), each one is stored
+## contiguously at the start of its slot so OpenCV can write straight into it
+##
+class FrameRingBuffer(object):
+	def __init__(self, frame_shape, number_of_slots=4):
+		self.frame_shape = tuple(frame_shape)
+		self.number_of_slots = number_of_slots
+		slot_size = int(np.prod(self.frame_shape))
+
+		# everything shared lives in RawArrays so it is inherited by the child processes
+		self.frames_raw = multiprocessing.sharedctypes.RawArray(ctypes.c_uint8, number_of_slots*slot_size)
+		self.slot_sequence_raw = multiprocessing.sharedctypes.RawArray(ctypes.c_int64, number_of_slots)
+		self.slot_shape_raw = multiprocessing.sharedctypes.RawArray(ctypes.c_int32, number_of_slots*3)
+		self.header_raw = multiprocessing.sharedctypes.RawArray(ctypes.c_int64, header_size)
+		self.map_arrays()
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		for name in ('frames', 'slot_sequence', 'slot_shape', 'header'):
+			del state[name]
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.map_arrays()
+
+	##
+	## map_arrays()
+	## Create the numpy views onto the shared memory
+	##
+	def map_arrays(self):
+		self.frames = np.frombuffer(self.frames_raw, dtype=np.uint8).reshape((self.number_of_slots, -1))
+		self.slot_sequence = np.frombuffer(self.slot_sequence_raw, dtype=np.int64)
+		self.slot_shape = np.frombuffer(self.slot_shape_raw, dtype=np.int32).reshape((self.number_of_slots, 3))
+		self.header = np.frombuffer(self.header_raw, dtype=np.int64)
+		self.write_sequence = 0
+		self.read_sequence = 0
+
+	##
+	## get_slot_frame(slot)
+	## View of the frame stored in a slot
+	##
+	def get_slot_frame(self, slot):
+		(rows, columns, channels) = self.slot_shape[slot]
+		frame = self.frames[slot, :rows*columns*channels]
+		if channels == 1:
+			return frame.reshape((rows, columns))
+		return frame.reshape((rows, columns, channels))
+
+	##
+	## get_write_buffer(shape)
+	## PRODUCER: Get the next free slot as an array of the given shape to draw/warp a frame into in place
+	## The frame is not visible to readers until commit() is called
+	##
+	def get_write_buffer(self, shape):
+		if len(shape) == 2:
+			shape = (shape[0], shape[1], 1)
+		if (shape[0] > self.frame_shape[0]) or (shape[1] > self.frame_shape[1]) or (shape[2] > self.frame_shape[2]):
+			raise ValueError("Frame of shape %s does not fit in ring buffer of shape %s" % (shape, self.frame_shape))
+
+		self.write_sequence = int(self.header[header_latest_sequence]) + 1
+		slot = self.write_sequence % self.number_of_slots
+
+		# mark the slot as being written before touching the pixels
+		self.slot_sequence[slot] = 0
+		self.slot_shape[slot] = shape
+		return self.get_slot_frame(slot)
+
+	##
+	## commit()
+	## PRODUCER: Publish the frame in the slot from get_write_buffer()
+	##
+	def commit(self):
+		slot = self.write_sequence % self.number_of_slots
+		self.slot_sequence[slot] = self.write_sequence
+		self.header[header_latest_sequence] = self.write_sequence
+		self.header[header_frames_produced] = int(self.header[header_frames_produced]) + 1
+
+	##
+	## write(frame)
+	## PRODUCER: Copy a frame into the next slot and publish it
+	##
+	def write(self, frame):
+		if self.header[header_closed]:
+			return
+		buffer = self.get_write_buffer(frame.shape)
+		buffer[...] = frame
+		self.commit()
+
+	##
+	## read_latest(copy)
+	## CONSUMER: Get the newest complete frame, or None if there is nothing new since the last read
+	## Without copy the frame is a view straight onto the shared slot, it stays valid until the
+	## producer comes back around to that slot (use is_current() to check)
+	##
+	def read_latest(self, copy=False):
+		sequence = int(self.header[header_latest_sequence])
+		if (sequence == 0) or (sequence == self.read_sequence):
+			return None
+
+		slot = sequence % self.number_of_slots
+		frame = self.get_slot_frame(slot)
+		if copy:
+			frame = frame.copy()
+
+		# the producer lapped us while we were looking, nothing usable this time
+		if int(self.slot_sequence[slot]) != sequence:
+			return None
+
+		if self.read_sequence != 0:
+			self.header[header_frames_dropped] = int(self.header[header_frames_dropped]) + sequence - self.read_sequence - 1
+		self.header[header_frames_consumed] = int(self.header[header_frames_consumed]) + 1
+		self.header[header_consumed_sequence] = sequence
+		self.read_sequence = sequence
+		return frame
+
+	##
+	## is_current()
+	## CONSUMER: Check the last frame read has not been overwritten since
+	##
+	def is_current(self):
+		return int(self.slot_sequence[self.read_sequence % self.number_of_slots]) == self.read_sequence
+
+	##
+	## needs_frame()
+	## PRODUCER: True once the consumer has taken the newest frame, lets producers skip work nobody will see
+	##
+	def needs_frame(self):
+		return self.header[header_consumed_sequence] == self.header[header_latest_sequence]
+
+	##
+	## get_stats()
+	## Frames produced, consumed and dropped
+	##
+	def get_stats(self):
+		return {'produced': int(self.header[header_frames_produced]),
+				'consumed': int(self.header[header_frames_consumed]),
+				'dropped': int(self.header[header_frames_dropped])}
+
+	##
+	## close()
+	## Stop accepting frames
+	##
+	def close(self):
+		self.header[header_closed] = 1
+
+## end of class
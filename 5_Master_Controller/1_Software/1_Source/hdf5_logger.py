@@ -0,0 +1,108 @@
+# hdf5_logger.py
+# Buffered HDF5 telemetry logger, the control loop only fills in memory and a separate process does all the disk writes
+
+import multiprocessing
+import signal
+import numpy as np
+import h5py
+import datetime
+
+##
+## HDF5Logger(file_name, group_name, columns, chunk_size, compression)
+## Logs rows of numeric columns into one HDF5 dataset per column (for MATLAB)
+## columns is a list of (name, dtype, units)
+## Rows collect in a preallocated columnar buffer, each full buffer is handed to the writer process
+## which appends it to chunked datasets, so the control loop never waits on the disk
+##
+class HDF5Logger(object):
+	def __init__(self, file_name, group_name, columns, chunk_size=1000, compression=None):
+		self.file_name = file_name
+		self.group_name = group_name
+		self.columns = columns
+		self.chunk_size = chunk_size
+		self.compression = compression
+		self.dtype = np.dtype([(name, dtype) for (name, dtype, units) in columns])
+		self.buffer = np.zeros(chunk_size, dtype=self.dtype)
+		self.count = 0
+		self.rows_logged = 0
+
+		self.chunk_queue = multiprocessing.Queue()
+		self.writer = multiprocessing.Process(target=hdf5_writer_process, name="hdf5_writer",
+			args=(file_name, group_name, columns, chunk_size, compression, self.chunk_queue))
+		self.writer.daemon = True
+		self.writer.start()
+
+	##
+	## append(row)
+	## Add one row, a tuple with a value for every column in order
+	##
+	def append(self, row):
+		self.buffer[self.count] = row
+		self.count += 1
+		if self.count == self.chunk_size:
+			self.flush()
+
+	##
+	## flush()
+	## Hand whatever is buffered to the writer process and start a fresh buffer
+	##
+	def flush(self):
+		if self.count == 0:
+			return
+		self.chunk_queue.put(self.buffer[:self.count])
+		self.rows_logged += self.count
+		self.buffer = np.zeros(self.chunk_size, dtype=self.dtype)
+		self.count = 0
+
+	##
+	## close()
+	## Flush the last rows and wait for the writer process to close the file
+	##
+	def close(self, timeout=5.0):
+		self.flush()
+		self.chunk_queue.put(None)
+		self.writer.join(timeout)
+
+## end of class
+
+##
+## hdf5_writer_process(file_name, group_name, columns, chunk_size, compression, chunk_queue)
+## Owns the HDF5 file. Creates the datasets then appends every chunk it receives until it gets None
+##
+def hdf5_writer_process(file_name, group_name, columns, chunk_size, compression, chunk_queue):
+	# leave Ctrl+C to the master controller, it closes the logger on the way out
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+	hdf5_file_handle = h5py.File(file_name, "w")
+
+	# point to the default data to be plotted
+	hdf5_file_handle.attrs['default'] = group_name
+	# give the HDF5 root some more attributes
+	hdf5_file_handle.attrs['file_name'] = file_name
+	hdf5_file_handle.attrs['file_time'] = str(datetime.datetime.now())
+	hdf5_file_handle.attrs['creator'] = 'master_controller.py'
+	hdf5_file_handle.attrs['project'] = 'Air Hockey Robot'
+
+	h_data = hdf5_file_handle.create_group(group_name)
+	datasets = []
+	for (name, dtype, units) in columns:
+		dset = h_data.create_dataset(name, (0, ), maxshape=(None, ), dtype=dtype, chunks=(chunk_size, ), compression=compression)
+		dset.attrs["units"] = units
+		datasets.append(dset)
+
+	while True:
+		chunk = chunk_queue.get()
+		if chunk is None:
+			break
+
+		# append the chunk to the end of every dataset
+		start = datasets[0].shape[0]
+		end = start + len(chunk)
+		for ((name, dtype, units), dset) in zip(columns, datasets):
+			dset.resize((end, ))
+			dset[start:end] = chunk[name]
+		hdf5_file_handle.flush()
+
+	hdf5_file_handle.close()
+
+## end of function
@@ -0,0 +1,129 @@
+# intercept_planner.py
+# Finds the earliest point along the puck's predicted path that the paddle can get to before the puck does
+#
+# The puck path is sampled every time_step seconds out to the planning horizon, bouncing off the side walls
+# (see trajectory.py). For every sample the paddle's travel time is worked out from the axis speed and
+# acceleration limits, each axis moving independently, and the first sample the paddle beats the puck to
+# is the intercept. All samples are evaluated at once with numpy in preallocated buffers.
+
+import collections
+import numpy as np
+
+##
+## Intercept(position_mm_x, position_mm_y, time, reachable)
+## Where to send the paddle and when the puck gets there (s from now)
+## reachable is False if the paddle can't beat the puck anywhere, the position is then the last
+## point on the puck path the paddle can be commanded to
+##
+Intercept = collections.namedtuple('Intercept', ['position_mm_x', 'position_mm_y', 'time', 'reachable'])
+
+##
+## get_move_times(distances, max_speed, acceleration, out)
+## Time (s) for an axis to travel each distance, accelerating and braking at acceleration with a
+## top speed of max_speed (a trapezoidal velocity profile, triangular if it never reaches top speed)
+##
+def get_move_times(distances, max_speed, acceleration, out):
+	max_speed = float(max_speed)
+	acceleration = float(acceleration)
+
+	# distance needed to get up to top speed and back down again
+	ramp_distance = max_speed*max_speed/acceleration
+	np.sqrt(distances/acceleration, out=out)
+	out *= 2
+	cruise = distances >= ramp_distance
+	out[cruise] = distances[cruise]/max_speed + max_speed/acceleration
+	return out
+
+## end of function
+
+##
+## InterceptPlanner(x_min, x_max, reach_min_mm_y, reach_max_mm_y, contact_offset_mm_y, ...)
+## x_min/x_max: range of the puck centre between the side walls
+## reach_min_mm_y/reach_max_mm_y: range of paddle y positions the planner may pick
+## contact_offset_mm_y: how far behind the puck centre the paddle is sent
+## command_latency: time (s) between planning and the paddle starting to move
+##
+class InterceptPlanner(object):
+	def __init__(self, x_min, x_max, reach_min_mm_y, reach_max_mm_y, contact_offset_mm_y,
+				 max_speed_mmps_x, max_speed_mmps_y, acceleration_mmps2_x, acceleration_mmps2_y,
+				 time_step=0.005, horizon=1.5, command_latency=0.02):
+		self.x_min = x_min
+		self.x_max = x_max
+		self.reach_min_mm_y = reach_min_mm_y
+		self.reach_max_mm_y = reach_max_mm_y
+		self.contact_offset_mm_y = contact_offset_mm_y
+		self.command_latency = command_latency
+		self.set_axis_limits(max_speed_mmps_x, max_speed_mmps_y, acceleration_mmps2_x, acceleration_mmps2_y)
+
+		# sample times and work buffers, allocated once
+		self.times = np.arange(1, int(round(horizon/time_step)) + 1)*time_step
+		number_of_samples = len(self.times)
+		self.puck_x = np.empty(number_of_samples)
+		self.paddle_y = np.empty(number_of_samples)
+		self.distance = np.empty(number_of_samples)
+		self.move_time_x = np.empty(number_of_samples)
+		self.move_time_y = np.empty(number_of_samples)
+		self.folded = np.empty(number_of_samples, dtype=bool)
+		self.reachable = np.empty(number_of_samples, dtype=bool)
+		self.in_reach = np.empty(number_of_samples, dtype=bool)
+
+	##
+	## set_axis_limits(max_speed_mmps_x, max_speed_mmps_y, acceleration_mmps2_x, acceleration_mmps2_y)
+	## Change the axis limits, e.g. when the game speed changes
+	##
+	def set_axis_limits(self, max_speed_mmps_x, max_speed_mmps_y, acceleration_mmps2_x, acceleration_mmps2_y):
+		self.max_speed_mmps_x = float(max_speed_mmps_x)
+		self.max_speed_mmps_y = float(max_speed_mmps_y)
+		self.acceleration_mmps2_x = float(acceleration_mmps2_x)
+		self.acceleration_mmps2_y = float(acceleration_mmps2_y)
+
+	##
+	## plan(puck_position_mm_x, puck_position_mm_y, puck_velocity_mmps_x, puck_velocity_mmps_y, paddle_position_mm_x, paddle_position_mm_y)
+	## Earliest reachable intercept, or None if the puck never comes within reach in the planning horizon
+	##
+	def plan(self, puck_position_mm_x, puck_position_mm_y, puck_velocity_mmps_x, puck_velocity_mmps_y, paddle_position_mm_x, paddle_position_mm_y):
+		times = self.times
+		puck_x = self.puck_x
+		paddle_y = self.paddle_y
+		distance = self.distance
+
+		# puck path with the table unfolded, then folded back between the walls
+		np.multiply(times, puck_velocity_mmps_x, out=puck_x)
+		puck_x += puck_position_mm_x - self.x_min
+		width = self.x_max - self.x_min
+		np.mod(puck_x, 2*width, out=puck_x)
+		np.greater(puck_x, width, out=self.folded)
+		puck_x[self.folded] = 2*width - puck_x[self.folded]
+		puck_x += self.x_min
+
+		# where the paddle has to be for each point on the path, and whether it is allowed there
+		np.multiply(times, puck_velocity_mmps_y, out=paddle_y)
+		paddle_y += puck_position_mm_y - self.contact_offset_mm_y
+		in_reach = self.in_reach
+		np.greater_equal(paddle_y, self.reach_min_mm_y, out=in_reach)
+		in_reach &= paddle_y <= self.reach_max_mm_y
+		if not in_reach.any():
+			return None
+
+		# paddle travel time to each point, the slower axis decides
+		np.subtract(puck_x, paddle_position_mm_x, out=distance)
+		np.abs(distance, out=distance)
+		get_move_times(distance, self.max_speed_mmps_x, self.acceleration_mmps2_x, self.move_time_x)
+		np.subtract(paddle_y, paddle_position_mm_y, out=distance)
+		np.abs(distance, out=distance)
+		get_move_times(distance, self.max_speed_mmps_y, self.acceleration_mmps2_y, self.move_time_y)
+		np.maximum(self.move_time_x, self.move_time_y, out=self.move_time_x)
+		self.move_time_x += self.command_latency
+
+		reachable = self.reachable
+		np.less_equal(self.move_time_x, times, out=reachable)
+		reachable &= in_reach
+		if reachable.any():
+			i = int(np.argmax(reachable))
+			return Intercept(float(puck_x[i]), float(paddle_y[i]), float(times[i]), True)
+
+		# can't beat the puck anywhere, go for the last point in reach and hope it slows down
+		i = len(in_reach) - 1 - int(np.argmax(in_reach[::-1]))
+		return Intercept(float(puck_x[i]), float(paddle_y[i]), float(times[i]), False)
+
+## end of class
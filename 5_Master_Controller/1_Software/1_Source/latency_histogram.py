@@ -0,0 +1,118 @@
+# latency_histogram.py
+# Latency histograms for timing paths through the master controller: fixed bins since start up, or a rolling window
+
+import numpy as np
+
+##
+## LatencyHistogram(bin_width_ms, number_of_bins)
+## Counts latencies into fixed width bins, adding a sample is a single array increment
+## Anything past the last bin is counted in the last bin
+##
+class LatencyHistogram(object):
+	def __init__(self, name, bin_width_ms=0.25, number_of_bins=200):
+		self.name = name
+		self.bin_width = bin_width_ms / 1000.0
+		self.counts = np.zeros(number_of_bins, dtype=np.int64)
+		self.total = 0.0
+		self.maximum = 0.0
+
+	##
+	## add(latency)
+	## Count a latency in seconds
+	##
+	def add(self, latency):
+		index = int(latency / self.bin_width)
+		if index < 0:
+			index = 0
+		elif index >= len(self.counts):
+			index = len(self.counts) - 1
+		self.counts[index] += 1
+		self.total += latency
+		if latency > self.maximum:
+			self.maximum = latency
+
+	##
+	## reset()
+	## Clear all counts
+	##
+	def reset(self):
+		self.counts.fill(0)
+		self.total = 0.0
+		self.maximum = 0.0
+
+	##
+	## get_count()
+	## Number of latencies counted
+	##
+	def get_count(self):
+		return int(self.counts.sum())
+
+	##
+	## get_percentile(percentile)
+	## Upper edge of the bin the given percentile (0-100) falls in, in seconds
+	##
+	def get_percentile(self, percentile):
+		count = self.get_count()
+		if count == 0:
+			return 0.0
+		index = np.searchsorted(np.cumsum(self.counts), count * percentile / 100.0)
+		return (index + 1) * self.bin_width
+
+	##
+	## get_summary()
+	## One line summary in milliseconds for the log
+	##
+	def get_summary(self):
+		count = self.get_count()
+		if count == 0:
+			return "%s: no samples" % self.name
+		return "%s: n=%i mean=%.2fms p50=%.2fms p90=%.2fms p99=%.2fms max=%.2fms" % (self.name, count,
+			1000 * self.total / count, 1000 * self.get_percentile(50), 1000 * self.get_percentile(90),
+			1000 * self.get_percentile(99), 1000 * self.maximum)
+
+## end of class
+
+##
+## RollingLatency(name, size)
+## Keeps the last size latencies in a ring, so its percentiles follow what the system is doing now
+## rather than everything since start up
+##
+class RollingLatency(object):
+	def __init__(self, name, size=1024):
+		self.name = name
+		self.samples = np.zeros(size)
+		self.count = 0
+
+	##
+	## add(latency)
+	## Put a latency in seconds in the ring, replacing the oldest
+	##
+	def add(self, latency):
+		self.samples[self.count % len(self.samples)] = latency
+		self.count += 1
+
+	def reset(self):
+		self.count = 0
+
+	##
+	## get_percentiles(percentiles)
+	## The given percentiles (0-100) of the latencies in the ring, in seconds
+	##
+	def get_percentiles(self, percentiles):
+		samples = self.samples[:min(self.count, len(self.samples))]
+		if len(samples) == 0:
+			return [0.0] * len(percentiles)
+		return list(np.percentile(samples, percentiles))
+
+	##
+	## get_summary()
+	## One line summary of the ring in milliseconds for the log
+	##
+	def get_summary(self):
+		if self.count == 0:
+			return "%s: no samples" % self.name
+		(p50, p90, p99, maximum) = self.get_percentiles([50, 90, 99, 100])
+		return "%s: last %i p50=%.2fms p90=%.2fms p99=%.2fms max=%.2fms" % (self.name, min(self.count, len(self.samples)),
+			1000 * p50, 1000 * p90, 1000 * p99, 1000 * maximum)
+
+## end of class
@@ -2,20 +2,22 @@
 # Capstone Master Controller module
 # By Stanislav Rashevskyi, David Eelman, Thomas Abdallah
 
-from PCANBasic import *
+from can_transport import create_can_transport, VirtualCANBus, LoopbackTransport
+from can_worker import CANWorker, drain
+from can_tx_scheduler import TxScheduler
+from can_codec import mc_cmd_pc, pc_status
+from paddle_controller_sim import PaddleControllerSim
 from time import sleep
 from pprint import pprint
 import sys
 import math
 import select
 import os
-import h5py
+import fcntl
 import numpy as np
-import datetime
 import time
 import json
 import cv2
-import Queue
 
 ### DO NOT CHANGE logging setup! now Kivy logger works with default python logger
 # Create and set format of the logging file
@@ -45,16 +47,42 @@ settings_path = "../../../6_User_Interface/1_Software/4_Json/"
 import multiprocessing
 import puck_tracker as pt
 import user_interface as ui
-
-# Initialize an instance of the PCANBasic class
-PCAN = PCANBasic() 		
+from frame_ring_buffer import FrameRingBuffer
+from shared_struct import SharedStruct
+from latency_histogram import LatencyHistogram, RollingLatency
+from hdf5_logger import HDF5Logger
+from flight_recorder import FlightRecorder
+from trajectory import get_trajectory_points
+from overlay import Overlay, OverlayRenderer
+from intercept_planner import InterceptPlanner
+from control_state_machine import ControlStateMachine
+from filters import create_filter
+
+# CAN transport to the paddle controller, created in main() so the decision logic can be imported without a CAN driver
+can_bus = None
 
 ##############################################################################################
 ## Global data storage
 ##############################################################################################
 
-# master controller loop delay
-timeout = 0.005
+# master controller loop timing
+# 'event' wakes the loop as soon as the puck tracker publishes a fix or a CAN message arrives
+# 'fixed_rate' sleeps for timeout every loop
+mc_loop_mode = 'event'
+timeout = 0.005				# loop delay in fixed_rate mode
+mc_loop_max_wait = 0.02		# longest the event loop waits without new data, keeps UI requests responsive
+pt_data_ready_rx = None		# pipe the puck tracker writes to every time it publishes a fix
+pt_data_ready_tx = None
+
+# CAN transport to the paddle controller, see can_transport.py
+can_transport_backend = 'pcan'			# 'pcan' (PCAN USB dongle), 'socketcan' or 'loopback'
+can_socketcan_interface = 'vcan0'		# SocketCAN interface for the 'socketcan' backend
+paddle_controller_sim = None			# simulated paddle controller on the 'loopback' bus, see paddle_controller_sim.py
+can_worker = None						# thread that owns the transport, reads it and sends the paddle command, see can_worker.py
+can_min_change_mm = 2					# paddle command position change sent straight away (mm), smaller ones wait for the keep-alive
+can_keep_alive_period = 0.05			# longest time between paddle command sends (s)
+can_tx_bus_budget = 0.25				# share of the 125 kbit/s bus the paddle commands may use
+can_command_timeout = 0.1				# a paddle command the loop hasn't posted for this long isn't kept alive (s)
 
 # object dimensions & distances
 table_width_mm_x = 774.7
@@ -94,11 +122,69 @@ pc_status_debug = 0		# for debug purposes in pc_status msg
 
 # hdf5
 hdf5_fileName = "PC_positions.hdf5"		# File name for hdf5 with PC positions
-hdf5_dset_size = 1000 			# dataset total number of elements for hdf5
-hdf5_dset_max_size = 30000 		# dataset max number of elements  after resize when we reset the counter for hdf5
-hdf5_dset_stop_resize = False	# flag that indicates whether to continue dataset resize or not
-hdf5_dset_count = 0				# count to track current element in hdf5 PC_data dataset
-hdf5_file_handle = 0			# handle to hdf5 file
+hdf5_chunk_size = 1000			# rows buffered in memory before they are written, also the dataset chunk size
+hdf5_compression = 'gzip'		# dataset compression, None to turn off (MATLAB reads gzip)
+hdf5_logger = None
+hdf5_PC_data_columns = [('time_sent', 'float64', 's'),
+						('pos_sent_x', 'uint16', 'mm'),
+						('pos_sent_y', 'uint16', 'mm'),
+						('time_rcvd', 'float64', 's'),
+						('pos_rcvd_x', 'uint16', 'mm'),
+						('pos_rcvd_y', 'uint16', 'mm')]
+
+# flight recorder, every loop's inputs and decisions
+# each record is about 110 bytes, 2 million records covers a bit over an hour at 500 loops per second
+flight_recorder_fileName = "flight_record.bin"
+flight_recorder_number_of_records = 2000000
+flight_recorder = None
+flight_record_fields = [('time', 'float64'),
+						('puck_fix_publish_time', 'float64'),
+						('puck_fix_capture_time', 'float64'),
+						('pt_fix_sequence', 'uint32'),
+						('puck_fix_valid', 'uint8'),
+						('puck_position_mm_x', 'float32'),
+						('puck_position_mm_y', 'float32'),
+						('puck_velocity_mmps_x', 'float32'),
+						('puck_velocity_mmps_y', 'float32'),
+						('puck_position_variance', 'float32'),
+						('puck_velocity_variance', 'float32'),
+						('pt_state', 'uint8'),
+						('pt_error', 'uint8'),
+						('ui_state', 'uint8'),
+						('ui_error', 'uint8'),
+						('ui_screen', 'uint8'),
+						('ui_game_state', 'uint8'),
+						('game_mode', 'uint8'),
+						('ui_diagnostic_request', 'uint8'),
+						('ui_paddle_position_mm_x', 'float32'),
+						('ui_paddle_position_mm_y', 'float32'),
+						('mc_motor_speed_cmd_x', 'uint8'),
+						('mc_motor_speed_cmd_y', 'uint8'),
+						('pc_pos_status_mm_x', 'uint16'),
+						('pc_pos_status_mm_y', 'uint16'),
+						('pc_state', 'uint8'),
+						('pc_error', 'uint8'),
+						('pc_goal_scored', 'uint8'),
+						('goal_event', 'uint8'),
+						('mc_state', 'uint8'),
+						('mc_error', 'uint8'),
+						('offense_sm_state', 'uint8'),
+						('defense_sm_state', 'uint8'),
+						('paddle_intercept_mm_y', 'float32'),
+						('paddle_position_mm_x', 'float32'),
+						('paddle_position_averaged_mm_x', 'float32'),
+						('mc_pos_cmd_mm_x', 'float32'),
+						('mc_pos_cmd_mm_y', 'float32'),
+						('mc_pos_cmd_sent_mm_x', 'float32'),
+						('mc_pos_cmd_sent_mm_y', 'float32'),
+						('pc_state_cmd', 'uint8')]
+
+# visualization frames, big enough for any warped view of the camera image
+visualization_frame_max_size = int(math.hypot(pt.camera_horizontal_resolution, pt.camera_vertical_resolution)) + 1
+visualization_frame_shape = (visualization_frame_max_size, visualization_frame_max_size, 3)
+visualization_ring_buffer_slots = 4
+visualization_overlay = True		# draw the predicted puck path and paddle positions on the visual game frames, turn off for headless runs
+overlay_renderer = None				# thread that draws the overlay and passes frames on to the UI, see overlay.py
 
 # general
 pt_state = 0
@@ -108,20 +194,63 @@ ui_error = 0
 mc_state = 0
 mc_error = 0
 ui_diagnostic_request = 0
+ui_screen = 0
+ui_game_state = 0
+game_mode = 0
+ui_paddle_position_mm_x = 0		# where the UI puts the paddle in the manual game
+ui_paddle_position_mm_y = 0
+ui_goal_acknowledged = False	# the UI has counted the goal in ui_rx, see send_UI_goal()
+ui_goal_scored = 0				# goal the UI is being shown in ui_rx
+pending_goal_scored = 0			# goal waiting for the UI to acknowledge the one before it
+ui_diagnostic_request_count = 0	# the UI counts the one shot requests it makes, see acknowledge_diagnostic_request()
+diagnostic_request_handled = 0	# count of the last one shot request handled, echoed to the UI in ui_rx
+
+# IPC
+# pt_rx and ui_rx writes are staged through the loop and published once, by tx_IPC()
+ipc_rx_time = 0					# time rx_IPC() took this loop (s)
+ipc_loops = 0
+ipc_loop_time = RollingLatency("MC IPC per loop")
 
 # puck prediction
 puck_position_mm_x = 0
 puck_position_mm_y = 0
 puck_velocity_mmps_x = 0
 puck_velocity_mmps_y = 0
+puck_position_variance = 0
+puck_velocity_variance = 0
+pt_frames_skipped = 0			# camera frames the puck tracker didn't get to
+pt_timestamp_fallbacks = 0		# camera frames the puck tracker timestamped on arrival, the driver timestamp was missing or on another clock
+pt_fix_latency = 0				# camera capture to puck tracker publish time of the last fix (s)
+puck_fix_publish_time = 0		# when the puck tracker published the last fix (s)
+puck_fix_capture_time = 0		# when the camera captured the frame of the last fix (s)
+puck_fix_valid = False			# the puck tracker had a puck estimate for the last fix
+pt_fix_sequence = 0				# sequence number of the last fix used, a fix is only used once
+pt_fixes_missed = 0				# fixes the puck tracker published that were replaced before the loop got to them
+puck_fix_pending = False		# a fix arrived that no paddle command has been sent for yet
+human_paddle_position_mm_x = 0	# the human's paddle from the same fix, to see shots coming
+human_paddle_position_mm_y = 0
+human_paddle_velocity_mmps_x = 0
+human_paddle_velocity_mmps_y = 0
+human_paddle_valid = False		# the puck tracker is tracking the human's paddle
+fix_to_cmd_latency = LatencyHistogram("Puck fix published -> PC command written")
+fix_age_compensation = True		# move the puck on by its velocity for the age of the fix before predicting from it
+fix_age_max = 0.1				# longest fix age compensated for (s), older fixes are stale anyway
+pt_latency_stages = [('grab', "Camera capture -> PT got frame"),
+					 ('warp', "PT warp"),
+					 ('detect', "PT puck detection and filter"),
+					 ('publish', "PT publish"),
+					 ('consume', "PT published -> MC used fix"),
+					 ('total', "Camera capture -> MC used fix")]
+pt_stage_latency = dict((stage, RollingLatency(name)) for (stage, name) in pt_latency_stages)
 last_puck_position_mm_x = 0
 last_puck_position_mm_y = 0
-paddle_position_averaged_window_size = 3
-paddle_position_averaged_array = np.zeros(paddle_position_averaged_window_size)
-paddle_position_averaged_index = 0
+paddle_target_filters = {}				# game mode -> (filter, whether the filtered target is commanded), from settings, see filters.py
+trajectory_max_bounces_drawn = 10		# bounces drawn on the visualization, the prediction itself follows every bounce
 paddle_offense_position_mm_y = 500
 paddle_defense_position_mm_y = 0
 paddle_position_mm_x = 0
+paddle_position_averaged_mm_x = 0
+paddle_intercept_mm_y = 0				# line the paddle was last asked to intercept the puck on
 attack_line_mm_y = 400
 defense_line_mm_y = 0
 min_puck_velocity_mmps_y = -400
@@ -131,6 +260,19 @@ offense_sm_state = 0
 last_offense_sm_state = 0
 defense_sm_state = 0
 last_defense_sm_state = 0
+offense_state_machine = None			# table driven state machines from the settings file, see control_state_machine.py
+defense_state_machine = None
+
+# where the attack state sends the paddle
+# 'planner' goes for the earliest point on the puck's path the paddle can get to in time, see intercept_planner.py
+# 'fixed_line' always intercepts on attack_line_mm_y
+attack_intercept_mode = 'planner'
+axis_max_speed_mmps_x = [1000, 2000, 3000]		# paddle top speed for each motor speed setting (slow, medium, fast)
+axis_max_speed_mmps_y = [1000, 2000, 3000]
+axis_acceleration_mmps2_x = 20000
+axis_acceleration_mmps2_y = 20000
+intercept_planner = InterceptPlanner(puck_radius_mm, table_width_mm_x - puck_radius_mm, defense_line_mm_y, attack_line_mm_y, paddle_radius_mm,
+	axis_max_speed_mmps_x[mc_motor_speed_cmd_x], axis_max_speed_mmps_y[mc_motor_speed_cmd_y], axis_acceleration_mmps2_x, axis_acceleration_mmps2_y)
 
 
 ##############################################################################################
@@ -138,22 +280,9 @@ last_defense_sm_state = 0
 ## Refer to: https://github.com/tabdallah/capstone/blob/master/1_Planning/System_Interface_Design.xlsx
 ##############################################################################################
 
-# CAN message ID's
-ID_mc_cmd_pc =		0x100		# CAN message ID for Master Controller Command to PC on X and Y position
-ID_pc_status = 		0x101 		# CAN message ID for Paddle Controller Status
-
-# CAN signal masks for Tx
-mask_pos_cmd_mm_x_b0 		=	0x00FF		# Hex mask for pos_cmd_mm_x signal (msg byte0)
-mask_pos_cmd_mm_x_b1 		=	0xFF00		# Hex mask for pos_cmd_mm_x signal (msg byte1)
-mask_pos_cmd_mm_y_b2 		=	0x00FF		# Hex mask for pos_cmd_mm_y signal (msg byte2)
-mask_pos_cmd_mm_y_b3		=	0xFF00		# Hex mask for pos_cmd_mm_y signal (msg byte3)
-mask_motor_speed_cmd_x_b4 	=	0x0003		# Hex mask for motor_speed_cmd_x signal (msg byte4) 	
-mask_motor_speed_cmd_y_b4 	=	0x000C		# Hex mask for motor_speed_cmd_y signal (msg byte4)
-
-# CAN signal masks for Rx
-mask_motor_speed_x_b4 		=	0x0003		# Hex mask for motor_speed_x signal (msg byte4) 	
-mask_motor_speed_y_b4 		=	0x000C		# Hex mask for motor_speed_y signal (msg byte4)
-mask_goal_scored_b4			=	0x00F0		# Hex mask for goal_scored signal (msg byte5)
+# CAN message ID's, the signal layouts are in can_codec.py
+ID_mc_cmd_pc =		mc_cmd_pc.message_id		# CAN message ID for Master Controller Command to PC on X and Y position
+ID_pc_status = 		pc_status.message_id 		# CAN message ID for Paddle Controller Status
 
 ##############################################################################################
 ## Enumeration functions
@@ -259,51 +388,49 @@ def get_settings():
 	mm_per_pixel_x = settings['puck_tracker']['scaling_factors']['mm_per_pixel_y']
 	mm_per_pixel_y = settings['puck_tracker']['scaling_factors']['mm_per_pixel_x']
 
+	create_control_state_machines()
+	create_paddle_target_filters()
+
 ##############################################################################################
 ## CAN functions
 ##############################################################################################
 
 ##
-## init_PCAN()
-## Initialize the PCAN USB Dongle & Check for Errors
-## Resets Tx & Rx queues
+## init_CAN(device)
+## Open the CAN transport & Check for Errors
 ##
-def init_PCAN(device):
+def init_CAN(device):
 	global mc_state
 	global mc_error
 	
-	status = PCANBasic.Initialize(device, PCAN_USBBUS1, PCAN_BAUD_125K)
-	PCANBasic.Reset(device, PCAN_USBBUS1) #TODO - why is this necessary?
-	
-	if status > 0:
-		logging.error("Error Initializing PCAN USB")
-		logging.error(PCANBasic.GetErrorText(device, status, 0))
+	if not device.open():
+		logging.error("Error Initializing CAN transport: %s", device.last_error)
 		mc_state = mc_state_enum.error
 		mc_error = mc_error_enum.pcan
 	else:
-		logging.info("PCAN USB Initialized")
+		logging.info("CAN transport %s Initialized", can_transport_backend)
+		if can_worker is not None and not can_worker.is_running():
+			can_worker.start()
 
 ## end of function
 
 ###
-## Uninit_PCAN()
-## Uninitialize the PCAN USB Dongle & check for errors
-##
-def Uninit_PCAN(device):
-	status = PCANBasic.Uninitialize(device, PCAN_USBBUS1)
-	if status > 0:
-		logging.error("Error Uninitializing PCAN USB")
-		logging.error(PCANBasic.GetErrorText(device, status, 0))
+## Uninit_CAN(device)
+## Close the CAN transport & check for errors
+##
+def Uninit_CAN(device):
+	if not device.close():
+		logging.error("Error Uninitializing CAN transport: %s", device.last_error)
 	else:
-		logging.info("PCAN USB Uninitialized")
+		logging.info("CAN transport Uninitialized, %s", device.get_stats())
 
 ## end of function
 
 ##
-## rx_CAN(device)
-## Receive any pending CAN messages and populate global variables as necessary
+## rx_CAN(worker)
+## Populate global variables from the newest CAN messages the worker received since the last loop
 ##
-def rx_CAN(device):
+def rx_CAN(worker):
 	global pc_pos_status_mm_x
 	global pc_pos_status_mm_y
 	global pc_state
@@ -314,55 +441,33 @@ def rx_CAN(device):
 	global pc_motor_speed_x
 	global pc_status_debug
 
-	message = PCANBasic.Read(PCAN, PCAN_USBBUS1)
-
 	# Save last read data 
 	last_pc_goal_scored = pc_goal_scored
 
-	# Keep reading messages until there aren't any more
-	while message[1].ID > 1:
-		# Process PC Status X message
-		if message[1].ID == ID_pc_status:
-			pc_pos_status_mm_x_b0 = message[1].DATA[0]
-			pc_pos_status_mm_x_b1 = message[1].DATA[1]
-			pc_pos_status_mm_x = pc_pos_status_mm_x_b0 | (pc_pos_status_mm_x_b1 << 8)
-			logging.debug("Incoming message from PC: Paddle Pos X: %s", pc_pos_status_mm_x)
-
-			pc_pos_status_mm_y_b2 = message[1].DATA[2]
-			pc_pos_status_mm_y_b3 = message[1].DATA[3]
-			pc_pos_status_mm_y = pc_pos_status_mm_y_b2 | (pc_pos_status_mm_y_b3 << 8)
-			logging.debug("Incoming message from PC: Paddle Pos Y: %s", pc_pos_status_mm_y)
-
-			pc_status_motor_goal_b4 = message[1].DATA[4]
-			pc_motor_speed_x = pc_status_motor_goal_b4 & mask_motor_speed_x_b4
-			logging.debug("Incoming message from PC: Motor Speed X: %s", pc_motor_speed_x)
-
-			pc_motor_speed_y = pc_status_motor_goal_b4 & mask_motor_speed_y_b4
-			logging.debug("Incoming message from PC: Motor Speed Y: %s", pc_motor_speed_y)
-
-			pc_goal_scored = (pc_status_motor_goal_b4 & mask_goal_scored_b4) >> 4
-			logging.debug("Incoming message from PC: Goal Scored: %s", pc_goal_scored)
-		
-			pc_state = int(message[1].DATA[5])
-			logging.debug("Incoming message from PC: State: %s", pc_state)
-			
-			pc_error = int(message[1].DATA[6])
-			logging.debug("Incoming message from PC: Error: %s", pc_error)
-
-			# empty byte for debugging
-			#pc_status_debug = message[1].DATA[7]
-			#logging.debug("Incoming message from PC: Debug: %s", pc_status_debug)
-
-		# Read next message
-		message = PCANBasic.Read(PCAN, PCAN_USBBUS1)
+	# Only the newest PC status since the last loop matters, older ones are kept by the receiver for its statistics
+	frame = worker.get_new(ID_pc_status)
+	if frame is not None and len(frame.data) == pc_status.length:
+		status = pc_status.decode(frame.data)
+		pc_pos_status_mm_x = status.pos_x_mm
+		pc_pos_status_mm_y = status.pos_y_mm
+		pc_motor_speed_x = status.motor_speed_x
+		pc_motor_speed_y = status.motor_speed_y
+		pc_goal_scored = status.goal_scored
+		pc_state = status.state
+		pc_error = status.error
+		pc_status_debug = status.pc_status_debug
+		logging.debug("Incoming message from PC: %s", status)
 
 ## end of function
 
 ## 
-## Tx_PC_Cmd(device)
-## Transmit the command message to the Paddle Controller
+## Tx_PC_Cmd(worker)
+## Put the command message to the Paddle Controller in the worker's mailbox, it goes out straight away if it
+## changed enough, otherwise with the next keep-alive (see can_tx_scheduler.py)
+## Calibrate and clear error are only sent once and must not be replaced by the next command, so they are queued
+## and the latest command is dropped, it mustn't be repeated after them
 ##
-def Tx_PC_Cmd(device):
+def Tx_PC_Cmd(worker):
 	global mc_pos_cmd_mm_x
 	global mc_pos_cmd_mm_y
 	global mc_pos_cmd_sent_mm_x
@@ -371,37 +476,40 @@ def Tx_PC_Cmd(device):
 	global mc_motor_speed_cmd_y
 	global pc_state_cmd
 	global mc_cmd_pc_debug
+	global puck_fix_pending
 	
 	# Don't send new position if PC is not in ON state
 	if pc_state != pc_state_enum.on:
 		mc_pos_cmd_mm_x = mc_pos_cmd_sent_mm_x
 		mc_pos_cmd_mm_y = mc_pos_cmd_sent_mm_y
 
-	message = TPCANMsg()
-
-	message.ID = ID_mc_cmd_pc
-	message.MSGTYPE = PCAN_MESSAGE_STANDARD
-	message.LEN = 8
-	message.DATA[0] = (int(mc_pos_cmd_mm_x) & mask_pos_cmd_mm_x_b0)
-	message.DATA[1] = ((int(mc_pos_cmd_mm_x) & mask_pos_cmd_mm_x_b1) >> 8)
-	message.DATA[2] = (int(mc_pos_cmd_mm_y) & mask_pos_cmd_mm_y_b2)
-	message.DATA[3] = ((int(mc_pos_cmd_mm_y) & mask_pos_cmd_mm_y_b3) >> 8)
-	message.DATA[4] = (mc_motor_speed_cmd_x & (mc_motor_speed_cmd_y << 2))
-	message.DATA[5] = pc_state_cmd 
-	#message.DATA[6] = 0 				# not defined yet
-	#message.DATA[7] = mc_cmd_pc_debug  # for debugging
+	message = mc_cmd_pc.encode(mc_pos_cmd_mm_x, mc_pos_cmd_mm_y, mc_motor_speed_cmd_x, mc_motor_speed_cmd_y, pc_state_cmd)
 
 	# Save last sent position command
 	mc_pos_cmd_sent_mm_x = mc_pos_cmd_mm_x
 	mc_pos_cmd_sent_mm_y = mc_pos_cmd_mm_y
 
-	logging.debug("Transmitting message to PC: %s", message)
+	logging.debug("Transmitting message to PC: %s", list(message))
+
+	if pc_state_cmd in (pc_state_cmd_enum.calibration, pc_state_cmd_enum.clear_error):
+		worker.clear_command()
+		worker.post_one_shot(message)
+	elif puck_fix_pending:
+		worker.post_command(message, puck_fix_publish_time)
+		puck_fix_pending = False
+	else:
+		worker.post_command(message)
+
+## end of function
 
-	# Send the message and check if it was successful
-	status = PCANBasic.Write(device, PCAN_USBBUS1, message)
-	if status > 0:
-		logging.error("Error transmitting CAN message")
-		logging.error(PCANBasic.GetErrorText(device, status, 0))
+##
+## clear_PC_Cmd()
+## The MC has stopped commanding the Paddle Controller (no game is being played, an error, quitting): empty the
+## worker's mailbox so the last command isn't sent again, the PC keeps whatever it was last told
+##
+def clear_PC_Cmd():
+	if can_worker is not None:
+		can_worker.clear_command()
 
 ## end of function
 
@@ -412,142 +520,83 @@ def Tx_PC_Cmd(device):
 
 ##
 ## create_HDF5()
-## Create/truncate logger HDF5 file (for MATLAB) using h5py library
-## Example code used - http://download.nexusformat.org/sphinx/examples/h5py/index.html
+## Start the HDF5 logger (for MATLAB) for X-Y positions to and from PC
+## The file is written by the logger's own process, see hdf5_logger.py
 ##
 def create_HDF5():
-	global hdf5_fileName
-	global hdf5_dset_size
-	global hdf5_file_handle
+	global hdf5_logger
 
-	# create file
-	hdf5_file_handle = h5py.File(hdf5_fileName, "w")
-	#dset = f.create_dataset("positions", (1000,), dtype='uint16')
+	hdf5_logger = HDF5Logger(hdf5_fileName, 'PC_data', hdf5_PC_data_columns, hdf5_chunk_size, hdf5_compression)
 	logging.debug("Created %s for logging", hdf5_fileName)
 
-	# point to the default data to be plotted
-	hdf5_file_handle.attrs['default'] = 'PC_data'
-	# give the HDF5 root some more attributes
-	hdf5_file_handle.attrs['file_name'] = hdf5_fileName
-	hdf5_file_handle.attrs['file_time'] = str(datetime.datetime.now())
-	hdf5_file_handle.attrs['creator'] = 'mc_prototype.py'
-	hdf5_file_handle.attrs['project'] = 'Air Hockey Robot'
-	#f.attrs[u'HDF5_Version']     = six.u(h5py.version.hdf5_version)
-	#f.attrs[u'h5py_version']     = six.u(h5py.version.version)
-	logging.debug("Added hdf5 attributes")
-
-	# create the group for X-Y positions to and from PC
-	h_data = hdf5_file_handle.create_group('PC_data')
-	logging.debug("Created hdf5 PC_data group")
-
-	# dataset for sent ahd received X-Y command positions to PC
-	h_pos_sent_x = h_data.create_dataset("pos_sent_x", (hdf5_dset_size, ), maxshape=(None, ), dtype='uint16')
-	h_pos_sent_x.attrs["units"] = "mm"
-	h_pos_sent_y = h_data.create_dataset("pos_sent_y", (hdf5_dset_size, ), maxshape=(None, ), dtype='uint16')
-	h_pos_sent_y.attrs["units"] = "mm"
-
-	h_pos_rcvd_x = h_data.create_dataset("pos_rcvd_x", (hdf5_dset_size, ), maxshape=(None, ), dtype='uint16')
-	h_pos_rcvd_x.attrs["units"] = "mm"
-	h_pos_rcvd_y = h_data.create_dataset("pos_rcvd_y", (hdf5_dset_size, ), maxshape=(None, ), dtype='uint16')
-	h_pos_rcvd_y.attrs["units"] = "mm"
-	logging.debug("Created hdf5 datasets for PC sent and received X-Y positions")
-
-	# timestamps for sent and received X-Y command positions to PC
-	# no h5py support of time datatype, so will use string
-	h_time_sent = h_data.create_dataset("time_sent", (hdf5_dset_size, ), maxshape=(None, ), dtype='S30')
-	h_time_sent.attrs["units"] = "time"
-
-	h_time_rcvd = h_data.create_dataset("time_rcvd", (hdf5_dset_size, ), maxshape=(None, ), dtype='S30')
-	h_time_rcvd.attrs["units"] = "time"
-	logging.debug("Created hdf5 datasets for PC sent and received X-Y times")
-
 ## end of function
 
 ##
 ## Close_HDF5()
-## Close HDF5 file (for MATLAB) using h5py library
+## Write out anything still buffered and close the HDF5 file
 ##
 def Close_HDF5():
-	global hdf5_file_handle
-	# make sure to close the file
-	hdf5_file_handle.close()
-	logging.debug("Closed hdf5 file")
+	hdf5_logger.close()
+	logging.debug("Closed hdf5 file after %i rows", hdf5_logger.rows_logged)
 
 ## end of function
 
 ##
-## add_pos_sent_HDF5()
-## Add new sent X-Y position and its' timestamp to HDF5 PC_data group
-## ARGUMENTS: time_rcvd - timestamp of MC sent X-Y position to PC in a string format
+## add_PC_data_HDF5(time_rcvd, time_sent)
+## Add the received and sent X-Y positions and their timestamps to HDF5 PC_data group
+## ARGUMENTS: time_rcvd - monotonic time (s) the PC position was received
+##			  time_sent - monotonic time (s) the MC position command was sent
 ##
-def add_pos_sent_HDF5(time_rcvd):
-	global hdf5_file_handle
-	global hdf5_dset_count
-	global mc_pos_cmd_sent_mm_x
-	global mc_pos_cmd_sent_mm_x
+def add_PC_data_HDF5(time_rcvd, time_sent):
+	hdf5_logger.append((time_sent, mc_pos_cmd_sent_mm_x, mc_pos_cmd_sent_mm_y,
+		time_rcvd, pc_pos_status_mm_x, pc_pos_status_mm_y))
 
-	i = hdf5_dset_count
+## end of function
 
-	# store received positions with a puck_position_mm_xtimestamp
-	hdf5_file_handle['/PC_data/pos_sent_x'][i] = mc_pos_cmd_sent_mm_x
-	hdf5_file_handle['/PC_data/pos_sent_y'][i] = mc_pos_cmd_sent_mm_y
-	hdf5_file_handle['/PC_data/time_sent'][i] = time_rcvd
-	logging.debug("Stored sent XY position no. %i", i)
 
-## end of function
+##############################################################################################
+## Flight recorder functions
+##############################################################################################
 
 ##
-## add_pos_rcvd_HDF5()
-## Add new received X-Y position and its' timestamp to HDF5 PC_data group
-## ARGUMENTS: time_rcvd - timestamp of PC received X-Y position in a string format 
+## create_flight_recorder()
+## Create/truncate the flight recorder file, load it with flight_recorder.load_flight_record()
 ##
-def add_pos_rcvd_HDF5(time_rcvd):
-	global hdf5_file_handle
-	global hdf5_dset_count
-	global pc_pos_status_mm_x
-	global pc_pos_status_mm_y
+def create_flight_recorder():
+	global flight_recorder
 
-	i = hdf5_dset_count
+	flight_recorder = FlightRecorder(flight_recorder_fileName, flight_record_fields, flight_recorder_number_of_records)
+	logging.debug("Created %s for flight recording, %i byte records", flight_recorder_fileName, flight_recorder.record_dtype.itemsize)
 
-	# store received positions with a timestamp
-	hdf5_file_handle['/PC_data/pos_rcvd_x'][i] = pc_pos_status_mm_x
-	hdf5_file_handle['/PC_data/pos_rcvd_y'][i] = pc_pos_status_mm_y
-	hdf5_file_handle['/PC_data/time_rcvd'][i] = time_rcvd
-	logging.debug("Stored received XY position no. %i", i)
+## end of function
+
+##
+## close_flight_recorder()
+## Flush the flight recorder file to disk
+##
+def close_flight_recorder():
+	logging.debug("Closed flight recorder after %i loops", flight_recorder.records_written)
+	flight_recorder.close()
 
 ## end of function
 
 ##
-## update_dset_HDF5()
-## Update counter
-## Resize PC_data datasets if hdf5_dset_size is reached: Increase the size by hdf5_dset_size rows
-## When reached max size of allowed elements in file stop resizing and reset counter to 0
-## FAQ used - http://docs.h5py.org/en/latest/faq.html#appending-data-to-a-dataset 
-##
-def update_dset_HDF5():
-	global hdf5_dset_size
-	global hdf5_file_handle
-	global hdf5_dset_count
-	global hdf5_dset_stop_resize
-
-	# increase counter
-	hdf5_dset_count += 1
-
-	# every hdf5_dset_size resize until reached hdf5_dset_max_size
-	if (hdf5_dset_count % hdf5_dset_size) == 0:
-		if hdf5_dset_count < hdf5_dset_max_size:
-			if hdf5_dset_stop_resize is False:
-				# resizing all PC_data datasets
-				hdf5_file_handle['/PC_data/pos_rcvd_x'].resize((hdf5_dset_count+hdf5_dset_size, ))
-				hdf5_file_handle['/PC_data/pos_rcvd_y'].resize((hdf5_dset_count+hdf5_dset_size, ))
-				hdf5_file_handle['/PC_data/time_rcvd'].resize((hdf5_dset_count+hdf5_dset_size, ))
-				hdf5_file_handle['/PC_data/pos_sent_x'].resize((hdf5_dset_count+hdf5_dset_size, ))
-				hdf5_file_handle['/PC_data/pos_sent_y'].resize((hdf5_dset_count+hdf5_dset_size, ))
-				hdf5_file_handle['/PC_data/time_sent'].resize((hdf5_dset_count+hdf5_dset_size, ))
-				logging.debug("Resized all hdf5 PC_data datasets to %i", hdf5_dset_count+hdf5_dset_size)
-		else:
-			hdf5_dset_count = 0
-			hdf5_dset_stop_resize = True
+## record_flight_data(loop_time)
+## Record this loop's inputs and decisions, in the order of flight_record_fields
+## ARGUMENTS: loop_time - monotonic time (s) at the start of the loop
+##
+def record_flight_data(loop_time):
+	flight_recorder.append((loop_time, puck_fix_publish_time, puck_fix_capture_time, pt_fix_sequence, puck_fix_valid,
+		puck_position_mm_x, puck_position_mm_y, puck_velocity_mmps_x, puck_velocity_mmps_y,
+		puck_position_variance, puck_velocity_variance, pt_state, pt_error,
+		ui_state, ui_error, ui_screen, ui_game_state, game_mode, ui_diagnostic_request,
+		ui_paddle_position_mm_x, ui_paddle_position_mm_y,
+		mc_motor_speed_cmd_x, mc_motor_speed_cmd_y,
+		pc_pos_status_mm_x, pc_pos_status_mm_y, pc_state, pc_error, pc_goal_scored,
+		pc_goal_scored != last_pc_goal_scored, mc_state, mc_error,
+		offense_sm_state, defense_sm_state,
+		paddle_intercept_mm_y, paddle_position_mm_x, paddle_position_averaged_mm_x,
+		mc_pos_cmd_mm_x, mc_pos_cmd_mm_y, mc_pos_cmd_sent_mm_x, mc_pos_cmd_sent_mm_y, pc_state_cmd))
 
 ## end of function
 
@@ -577,21 +626,28 @@ def init_IPC():
 	global pt_process
 	global visualization_data_tx
 	global visualization_data_rx
-
-	# create arrays for bidirectional communication with other processes
-	ui_rx = multiprocessing.Array('f', len(settings['user_interface']['enumerations']['ui_rx']))
-	ui_tx = multiprocessing.Array('f', len(settings['user_interface']['enumerations']['ui_tx']))
-	pt_rx = multiprocessing.Array('f', len(settings['puck_tracker']['enumerations']['pt_rx']))
-	pt_tx = multiprocessing.Array('f', len(settings['puck_tracker']['enumerations']['pt_tx']))
-	visualization_data_rx = multiprocessing.Queue(1)
-	visualization_data_tx = multiprocessing.Queue(1)
-	logging.debug("Created IPC Arrays & Queue")
-
-	# create seperate processes for the User Interface and Puck Tracker and give them Arrays & Queue for IPC
+	global pt_data_ready_rx
+	global pt_data_ready_tx
+
+	# create shared records for bidirectional communication with other processes, laid out by their enumerations
+	ui_rx = SharedStruct(settings['user_interface']['enumerations']['ui_rx'])
+	ui_tx = SharedStruct(settings['user_interface']['enumerations']['ui_tx'])
+	pt_rx = SharedStruct(settings['puck_tracker']['enumerations']['pt_rx'])
+	pt_tx = SharedStruct(settings['puck_tracker']['enumerations']['pt_tx'])
+	visualization_data_rx = FrameRingBuffer(visualization_frame_shape, visualization_ring_buffer_slots)
+	visualization_data_tx = FrameRingBuffer(visualization_frame_shape, visualization_ring_buffer_slots)
+	logging.debug("Created IPC shared records & frame ring buffers")
+
+	# non blocking pipe the puck tracker uses to wake up the main loop
+	pt_data_ready_rx, pt_data_ready_tx = os.pipe()
+	fcntl.fcntl(pt_data_ready_rx, fcntl.F_SETFL, os.O_NONBLOCK)
+	fcntl.fcntl(pt_data_ready_tx, fcntl.F_SETFL, os.O_NONBLOCK)
+
+	# create seperate processes for the User Interface and Puck Tracker and give them shared records & frame ring buffers for IPC
 	ui_process = multiprocessing.Process(target=ui.ui_process, name="ui", args=(ui_rx, ui_tx, visualization_data_tx))
-	logging.debug("Created User Interface process with Arrays and a Queue")
-	pt_process = multiprocessing.Process(target=pt.pt_process, name="pt", args=(pt_rx, pt_tx, visualization_data_rx))
-	logging.debug("Created Puck Tracker process with Arrays and a Queue")
+	logging.debug("Created User Interface process with shared records and a frame ring buffer")
+	pt_process = multiprocessing.Process(target=pt.pt_process, name="pt", args=(pt_rx, pt_tx, visualization_data_rx, pt_data_ready_tx))
+	logging.debug("Created Puck Tracker process with shared records and a frame ring buffer")
 
 	# start child processes
 	ui_process.start()
@@ -602,6 +658,10 @@ def init_IPC():
 	ui_rx[ui_rx_enum.state_cmd] = ui_state_cmd_enum.run
 	pt_rx[pt_rx_enum.state_cmd] = pt_state_cmd_enum.idle
 
+	# from here on the main loop's writes go out together at the end of each loop
+	ui_rx.set_batch_writes(True)
+	pt_rx.set_batch_writes(True)
+
 ## end of function
 
 ##
@@ -613,8 +673,24 @@ def rx_IPC():
 	global puck_position_mm_y
 	global puck_velocity_mmps_x 
 	global puck_velocity_mmps_y
+	global puck_position_variance
+	global puck_velocity_variance
+	global pt_frames_skipped
+	global pt_timestamp_fallbacks
+	global pt_fix_latency
+	global puck_fix_publish_time
+	global puck_fix_capture_time
+	global puck_fix_valid
+	global pt_fix_sequence
+	global pt_fixes_missed
+	global puck_fix_pending
 	global last_puck_position_mm_x
 	global last_puck_position_mm_y
+	global human_paddle_position_mm_x
+	global human_paddle_position_mm_y
+	global human_paddle_velocity_mmps_x
+	global human_paddle_velocity_mmps_y
+	global human_paddle_valid
 	global pt_state
 	global pt_error
 	global ui_state
@@ -625,36 +701,144 @@ def rx_IPC():
 	global game_mode
 	global mc_motor_speed_cmd_x
 	global mc_motor_speed_cmd_y
-
-	# store last received data values
-	last_puck_position_mm_x = puck_position_mm_x
-	last_puck_position_mm_y = puck_position_mm_y
-
-	# get data from puck tracker
-	pt_state = int(pt_tx[pt_tx_enum.state])
-	pt_error = int(pt_tx[pt_tx_enum.error])
-	puck_position_mm_x = pt_tx[pt_tx_enum.puck_position_x]
-	puck_position_mm_y = pt_tx[pt_tx_enum.puck_position_y]
-	puck_velocity_mmps_x = pt_tx[pt_tx_enum.puck_velocity_x]
-	puck_velocity_mmps_y = pt_tx[pt_tx_enum.puck_velocity_y]
+	global ui_paddle_position_mm_x
+	global ui_paddle_position_mm_y
+	global ui_goal_acknowledged
+	global ui_diagnostic_request_count
+	global ipc_rx_time
+
+	start_time = get_time()
+
+	# get data from puck tracker, all of it from one update so a fix is never mixed with the next one
+	pt_data = pt_tx.snapshot()
+	pt_state = int(pt_data[pt_tx_enum.state])
+	pt_error = int(pt_data[pt_tx_enum.error])
+
+	# only take a fix once, when its sequence number moves on
+	sequence = int(pt_data[pt_tx_enum.sequence])
+	if sequence != pt_fix_sequence:
+		if sequence > pt_fix_sequence + 1 and pt_fix_sequence != 0:
+			pt_fixes_missed += sequence - pt_fix_sequence - 1
+		pt_fix_sequence = sequence
+
+		# store last received data values
+		last_puck_position_mm_x = puck_position_mm_x
+		last_puck_position_mm_y = puck_position_mm_y
+
+		puck_position_mm_x = pt_data[pt_tx_enum.puck_position_x]
+		puck_position_mm_y = pt_data[pt_tx_enum.puck_position_y]
+		puck_velocity_mmps_x = pt_data[pt_tx_enum.puck_velocity_x]
+		puck_velocity_mmps_y = pt_data[pt_tx_enum.puck_velocity_y]
+		puck_position_variance = pt_data[pt_tx_enum.puck_position_variance]
+		puck_velocity_variance = pt_data[pt_tx_enum.puck_velocity_variance]
+		puck_fix_valid = bool(pt_data[pt_tx_enum.fix_valid])
+		pt_frames_skipped = int(pt_data[pt_tx_enum.frames_skipped])
+		pt_timestamp_fallbacks = int(pt_data[pt_tx_enum.timestamp_fallbacks])
+		pt_fix_latency = pt_data[pt_tx_enum.fix_latency]
+		puck_fix_publish_time = pt_data[pt_tx_enum.publish_time]
+		puck_fix_capture_time = pt_data[pt_tx_enum.capture_time]
+		human_paddle_position_mm_x = pt_data[pt_tx_enum.human_paddle_position_x]
+		human_paddle_position_mm_y = pt_data[pt_tx_enum.human_paddle_position_y]
+		human_paddle_velocity_mmps_x = pt_data[pt_tx_enum.human_paddle_velocity_x]
+		human_paddle_velocity_mmps_y = pt_data[pt_tx_enum.human_paddle_velocity_y]
+		human_paddle_valid = bool(pt_data[pt_tx_enum.human_paddle_valid])
+		puck_fix_pending = True
+		add_pt_stage_latencies(pt_data, get_time())
 
 	# get data from user interface
-	ui_state = int(ui_tx[ui_tx_enum.state])
-	ui_error = int(ui_tx[ui_tx_enum.error])
-	ui_diagnostic_request = int(ui_tx[ui_tx_enum.diagnostic_request])
-	ui_game_state = int(ui_tx[ui_tx_enum.game_state])
-	ui_screen = int(ui_tx[ui_tx_enum.screen])
-	mc_motor_speed_cmd_x = int(ui_tx[ui_tx_enum.game_speed_x])
-	mc_motor_speed_cmd_y = int(ui_tx[ui_tx_enum.game_speed_y])
-	game_mode = int(ui_tx[ui_tx_enum.game_mode])
+	ui_data = ui_tx.snapshot()
+	ui_state = int(ui_data[ui_tx_enum.state])
+	ui_error = int(ui_data[ui_tx_enum.error])
+	ui_diagnostic_request = int(ui_data[ui_tx_enum.diagnostic_request])
+	ui_game_state = int(ui_data[ui_tx_enum.game_state])
+	ui_screen = int(ui_data[ui_tx_enum.screen])
+	mc_motor_speed_cmd_x = int(ui_data[ui_tx_enum.game_speed_x])
+	mc_motor_speed_cmd_y = int(ui_data[ui_tx_enum.game_speed_y])
+	game_mode = int(ui_data[ui_tx_enum.game_mode])
+	ui_paddle_position_mm_x = ui_data[ui_tx_enum.paddle_position_x]
+	ui_paddle_position_mm_y = ui_data[ui_tx_enum.paddle_position_y]
+	ui_goal_acknowledged = bool(ui_data[ui_tx_enum.goal_acknowledged])
+
+	# a one shot request stays in ui_tx after it is handled, it is only new while the UI's count is ahead of ours
+	ui_diagnostic_request_count = int(ui_data[ui_tx_enum.diagnostic_request_count])
+	if ((ui_diagnostic_request in (ui_diagnostic_request_enum.calibrate_paddle_controller, ui_diagnostic_request_enum.clear_errors)) and
+		(ui_diagnostic_request_count == diagnostic_request_handled)):
+		ui_diagnostic_request = ui_diagnostic_request_enum.idle
 
 	# pass through data from ui to pt
-	pt_rx[pt_rx_enum.lower_hue] = ui_tx[ui_tx_enum.lower_hue]
-	pt_rx[pt_rx_enum.lower_sat] = ui_tx[ui_tx_enum.lower_sat]
-	pt_rx[pt_rx_enum.lower_val] = ui_tx[ui_tx_enum.lower_val]
-	pt_rx[pt_rx_enum.upper_hue] = ui_tx[ui_tx_enum.upper_hue]
-	pt_rx[pt_rx_enum.upper_sat] = ui_tx[ui_tx_enum.upper_sat]
-	pt_rx[pt_rx_enum.upper_val] = ui_tx[ui_tx_enum.upper_val]	
+	pt_rx.update({pt_rx_enum.lower_hue: ui_data[ui_tx_enum.lower_hue],
+				  pt_rx_enum.lower_sat: ui_data[ui_tx_enum.lower_sat],
+				  pt_rx_enum.lower_val: ui_data[ui_tx_enum.lower_val],
+				  pt_rx_enum.upper_hue: ui_data[ui_tx_enum.upper_hue],
+				  pt_rx_enum.upper_sat: ui_data[ui_tx_enum.upper_sat],
+				  pt_rx_enum.upper_val: ui_data[ui_tx_enum.upper_val]})
+
+	ipc_rx_time = get_time() - start_time
+
+## end of function
+
+##
+## tx_IPC()
+## Publish everything the loop wrote to pt_rx and ui_rx, one update each, and time the loop's IPC
+##
+def tx_IPC():
+	global ipc_loops
+
+	start_time = get_time()
+	pt_rx.publish()
+	ui_rx.publish()
+	ipc_loop_time.add(ipc_rx_time + get_time() - start_time)
+	ipc_loops += 1
+
+## end of function
+
+##
+## add_pt_stage_latencies(pt_data, now)
+## Add how long each stage took to get the fix just taken (a pt_tx snapshot) from the camera to here
+##
+def add_pt_stage_latencies(pt_data, now):
+	grab = pt_data[pt_tx_enum.grab_latency]
+	warp = pt_data[pt_tx_enum.warp_time]
+	detect = pt_data[pt_tx_enum.detect_time]
+	pt_stage_latency['grab'].add(grab)
+	pt_stage_latency['warp'].add(warp)
+	pt_stage_latency['detect'].add(detect)
+	pt_stage_latency['publish'].add(pt_fix_latency - grab - warp - detect)
+	pt_stage_latency['consume'].add(now - puck_fix_publish_time)
+	pt_stage_latency['total'].add(now - puck_fix_capture_time)
+
+## end of function
+
+##
+## get_time()
+## Monotonic time (s), the same clock the puck tracker timestamps fixes with
+##
+def get_time():
+	return cv2.getTickCount() / cv2.getTickFrequency()
+
+## end of function
+
+##
+## wait_for_data()
+## Wait until there is something new to act on: a puck tracker fix or a CAN message from the CAN worker
+## In fixed_rate mode just sleep for timeout
+##
+def wait_for_data():
+	if mc_loop_mode == 'fixed_rate':
+		sleep(timeout)
+		return
+
+	wait_list = [pt_data_ready_rx, can_worker.fileno()]
+	ready_list = select.select(wait_list, [], [], mc_loop_max_wait)[0]
+
+	# empty the pipes, we only care that there is new data
+	if pt_data_ready_rx in ready_list:
+		try:
+			os.read(pt_data_ready_rx, 4096)
+		except OSError:
+			pass
+	if can_worker.fileno() in ready_list:
+		drain(can_worker.fileno())
 
 ## end of function
 
@@ -685,6 +869,125 @@ def filter_tx_PC_cmd():
 
 ## end of function
 
+##
+## create_control_state_machines()
+## Build the offense and defense state machines from their tables in the settings file
+##
+def create_control_state_machines():
+	global offense_state_machine
+	global defense_state_machine
+
+	definitions = settings['master_controller']['control_state_machines']
+	actions = {'go_home': paddle_go_home,
+			   'attack': paddle_attack,
+			   'defend': paddle_defend,
+			   'return_puck': paddle_return_puck}
+	offense_state_machine = ControlStateMachine("offense", definitions['offense'], definitions['guards'],
+		mc_control_state_machine_enum, actions, globals(), lambda: get_time())
+	defense_state_machine = ControlStateMachine("defense", definitions['defense'], definitions['guards'],
+		mc_control_state_machine_enum, actions, globals(), lambda: get_time())
+
+## end of function
+
+##
+## pause_control_state_machines(running)
+## Stop the state time clock of every control state machine but running (None for all of them) for the loops it
+## isn't stepped in
+##
+def pause_control_state_machines(running=None):
+	for state_machine in (offense_state_machine, defense_state_machine):
+		if (state_machine is not None) and (state_machine is not running):
+			state_machine.pause()
+
+## end of function
+
+##
+## create_paddle_target_filters()
+## Make the filter for the predicted paddle x position of each game mode from the settings file
+##
+def create_paddle_target_filters():
+	global paddle_target_filters
+
+	configs = settings['master_controller']['paddle_target_filters']
+	paddle_target_filters = {}
+	for (mode, config) in configs.items():
+		paddle_target_filters[getattr(ui_game_mode_enum, mode)] = (create_filter(config), config['command_filtered'])
+
+## end of function
+
+##
+## get_paddle_target_mm_x()
+## The predicted paddle x position to command, filtered or not as the game mode's settings say
+##
+def get_paddle_target_mm_x():
+	if paddle_target_filters[game_mode][1]:
+		return paddle_position_averaged_mm_x
+	return paddle_position_mm_x
+
+## end of function
+
+##
+## paddle_go_home()
+## State machine action: wait in front of the goal
+## Actions return the predicted puck path for the visualization
+##
+def paddle_go_home():
+	global mc_pos_cmd_mm_x
+	global mc_pos_cmd_mm_y
+
+	mc_pos_cmd_mm_x = goal_center_mm_x
+	mc_pos_cmd_mm_y = 0
+	return []
+
+## end of function
+
+##
+## paddle_attack()
+## State machine action: meet the puck as far up the table as we can get to in time
+##
+def paddle_attack():
+	global mc_pos_cmd_mm_x
+	global mc_pos_cmd_mm_y
+
+	if attack_intercept_mode == 'planner':
+		trajectory_points = get_paddle_intercept_mm()
+	else:
+		trajectory_points = get_paddle_position_mm_x(attack_line_mm_y)
+	mc_pos_cmd_mm_x = get_paddle_target_mm_x()
+	mc_pos_cmd_mm_y = paddle_intercept_mm_y
+	return trajectory_points
+
+## end of function
+
+##
+## paddle_defend()
+## State machine action: block the puck on the defense line
+##
+def paddle_defend():
+	global mc_pos_cmd_mm_x
+	global mc_pos_cmd_mm_y
+
+	trajectory_points = get_paddle_position_mm_x(defense_line_mm_y)
+	mc_pos_cmd_mm_x = get_paddle_target_mm_x()
+	mc_pos_cmd_mm_y = defense_line_mm_y
+	return trajectory_points
+
+## end of function
+
+##
+## paddle_return_puck()
+## State machine action: go and get a puck that stopped in our end
+##
+def paddle_return_puck():
+	global mc_pos_cmd_mm_x
+	global mc_pos_cmd_mm_y
+
+	mc_pos_cmd_mm_x = puck_position_mm_x
+	mc_pos_cmd_mm_y = puck_position_mm_y
+	return []
+
+## end of function
+
 ##
 ## paddle_control_offense_state_machine()
 ## Control paddle position commands through a state machine that 
@@ -693,112 +996,15 @@ def filter_tx_PC_cmd():
 def paddle_control_offense_state_machine():
 	global offense_sm_state
 	global last_offense_sm_state
-	global mc_pos_cmd_mm_x
-	global mc_pos_cmd_mm_y
-	global paddle_position_averaged_array
-	global paddle_position_averaged_index
 
-	# get frame for visualization
-	if visualization_data_rx.empty():
-		frame = [0]
-		frame_received = False
-	else:
-		frame = visualization_data_rx.get(True)
-		frame_received = True
+	last_offense_sm_state = offense_sm_state
+	offense_sm_state, trajectory_points = offense_state_machine.step(offense_sm_state)
 
-	# when we change states, clear the averaging array
+	# when we change states, start filtering the paddle target again
 	if offense_sm_state != last_offense_sm_state:
-		paddle_position_averaged_array.fill(0)
-		paddle_position_averaged_index = 0
-
-	# STATE MACHINE
-	if offense_sm_state == mc_control_state_machine_enum.home:
-		# go home
-		mc_pos_cmd_mm_x = goal_center_mm_x
-		mc_pos_cmd_mm_y = 0
-
-		# if the puck is coming towards us from the opponents end - attack
-		if ((puck_velocity_mmps_y < min_puck_velocity_mmps_y) and 
-			(puck_position_mm_y > (table_length_mm_y/2))):
-			offense_sm_state = mc_control_state_machine_enum.attack
-		
-		# if puck in our end and somewhat stationary - return
-		if ((puck_velocity_stopped_low_mmps_y < puck_velocity_mmps_y < puck_velocity_stopped_high_mmps_y) and
-			(puck_position_mm_y < (table_length_mm_y/2))):
-			offense_sm_state = mc_control_state_machine_enum.return_puck
-			   
-		# if puck past attack line and coming towards us - defend
-		if ((puck_position_mm_y < attack_line_mm_y) and
-			(puck_velocity_mmps_y < min_puck_velocity_mmps_y)):
-		   offense_sm_state = mc_control_state_machine_enum.defend
-
-	elif offense_sm_state == mc_control_state_machine_enum.attack:
-		# do attack things
-		frame = get_paddle_position_mm_x(attack_line_mm_y, frame, frame_received)
-		mc_pos_cmd_mm_x = paddle_position_mm_x
-		mc_pos_cmd_mm_y = attack_line_mm_y
-
-		# if puck not in our end and somewhat stationary/moving away - home
-		if ((puck_velocity_mmps_y > min_puck_velocity_mmps_y) and
-			(puck_position_mm_y > (table_length_mm_y/2))):
-			defense_sm_state = mc_control_state_machine_enum.home
-
-		# if puck moving away from us - home
-		if (puck_velocity_mmps_y > 0):
-			offense_sm_state = mc_control_state_machine_enum.home
-		
-		# if puck moved past attack line - defend
-		if ((puck_position_mm_y < attack_line_mm_y) and
-			(puck_velocity_mmps_y < min_puck_velocity_mmps_y)):
-			offense_sm_state = mc_control_state_machine_enum.defend
-
-		#if puck in our end and somewhat stationary - return
-		if ((puck_velocity_stopped_low_mmps_y < puck_velocity_mmps_y < puck_velocity_stopped_high_mmps_y) and
-			(puck_position_mm_y < (table_length_mm_y/2))):
-			offense_sm_state = mc_control_state_machine_enum.return_puck
-
-	elif offense_sm_state == mc_control_state_machine_enum.defend:
-		# do defense things
-		frame = get_paddle_position_mm_x(defense_line_mm_y, frame, frame_received)
-		mc_pos_cmd_mm_x = paddle_position_mm_x
-		mc_pos_cmd_mm_y = defense_line_mm_y
-
-		# if puck not in our end and somewhat stationary/moving away - home
-		if ((puck_velocity_mmps_y > min_puck_velocity_mmps_y) and
-			(puck_position_mm_y > (table_length_mm_y/2))):
-			defense_sm_state = mc_control_state_machine_enum.home
-
-		#if puck in our end and somewhat stationary - return
-		if ((puck_velocity_stopped_low_mmps_y < puck_velocity_mmps_y < puck_velocity_stopped_high_mmps_y) and
-			(puck_position_mm_y < (table_length_mm_y/2))):
-			offense_sm_state = mc_control_state_machine_enum.return_puck
-
-	elif offense_sm_state == mc_control_state_machine_enum.return_puck:
-		# do return things
-		mc_pos_cmd_mm_x = puck_position_mm_x
-		mc_pos_cmd_mm_y = puck_position_mm_y
-
-		# if puck out of our end - home
-		if (puck_position_mm_y > (table_length_mm_y/2)):
-			offense_sm_state = mc_control_state_machine_enum.home
-
-	else:
-		pass # TODO - Errors?
+		paddle_target_filters[ui_game_mode_enum.offense][0].reset()
 
-	# if puck not seen - home
-	if ((puck_position_mm_x == 0) and 
-		(puck_position_mm_y == 0)):
-		offense_sm_state = mc_control_state_machine_enum.home
-
-	# send the puck tracker image on to the user interface
-	if frame_received:
-		frame = cv2.resize(frame, dsize=(800,600), interpolation=cv2.INTER_LINEAR)
-		try:
-			visualization_data_tx.put_nowait(frame)
-		except:
-			pass
-
-	last_offense_sm_state = offense_sm_state
+	show_overlay("Offense: " + mc_control_state_machine_enum.reverse_mapping[offense_sm_state], trajectory_points, paddle_intercept_mm_y)
 
 # end of function
 
@@ -810,185 +1016,140 @@ def paddle_control_offense_state_machine():
 def paddle_control_defense_state_machine():
 	global defense_sm_state
 	global last_defense_sm_state
-	global mc_pos_cmd_mm_x
-	global mc_pos_cmd_mm_y
-	global paddle_position_averaged_array
-	global paddle_position_averaged_index
 
-	# get frame for visualization
-	if visualization_data_rx.empty():
-		frame = [0]
-		frame_received = False
-	else:
-		frame = visualization_data_rx.get(True)
-		frame_received = True
+	last_defense_sm_state = defense_sm_state
+	defense_sm_state, trajectory_points = defense_state_machine.step(defense_sm_state)
 
-	# when we change states, clear the averaging array
+	# when we change states, start filtering the paddle target again
 	if defense_sm_state != last_defense_sm_state:
-		paddle_position_averaged_array.fill(0)
-		paddle_position_averaged_index = 0
-	
-	# STATE MACHINE
-	if defense_sm_state == mc_control_state_machine_enum.home:
-		# go home
-		mc_pos_cmd_mm_x = goal_center_mm_x
-		mc_pos_cmd_mm_y = 0
-
-		# if puck in our end and somewhat stationary - return
-		if ((puck_velocity_stopped_low_mmps_y < puck_velocity_mmps_y < puck_velocity_stopped_high_mmps_y) and
-			(puck_position_mm_y < (table_length_mm_y/2))):
-			defense_sm_state = mc_control_state_machine_enum.return_puck
-			   
-		# if puck coming towards us - defend
-		if (puck_velocity_mmps_y < min_puck_velocity_mmps_y):
-			defense_sm_state = mc_control_state_machine_enum.defend
-
-	elif defense_sm_state == mc_control_state_machine_enum.defend:
-		# do defense things
-		frame = get_paddle_position_mm_x(defense_line_mm_y, frame, frame_received)
-		mc_pos_cmd_mm_x = paddle_position_mm_x
-		mc_pos_cmd_mm_y = defense_line_mm_y
-
-		# if puck not in our end and somewhat stationary/moving away - home
-		if ((puck_velocity_mmps_y > min_puck_velocity_mmps_y) and
-			(puck_position_mm_y > (table_length_mm_y/2))):
-			defense_sm_state = mc_control_state_machine_enum.home
-		
-		# if puck in our end moving away - home
-		if ((puck_velocity_mmps_y > puck_velocity_stopped_high_mmps_y) and
-			(puck_position_mm_y < (table_length_mm_y/2))):
-			defense_sm_state = mc_control_state_machine_enum.home
-			
-		# if puck in our end and somewhat stationary - return
-		if ((puck_velocity_stopped_low_mmps_y < puck_velocity_mmps_y < puck_velocity_stopped_high_mmps_y) and
-			(puck_position_mm_y < (table_length_mm_y/2))):
-			defense_sm_state = mc_control_state_machine_enum.return_puck
-
-	elif defense_sm_state == mc_control_state_machine_enum.return_puck:
-		# do return things
-		mc_pos_cmd_mm_x = puck_position_mm_x
-		mc_pos_cmd_mm_y = puck_position_mm_y
-
-		# if puck out of our end - home
-		if (puck_position_mm_y > (table_length_mm_y/2)):
-			defense_sm_state = mc_control_state_machine_enum.home
+		paddle_target_filters[ui_game_mode_enum.defense][0].reset()
 
-	else:
-		pass # TODO - Errors?
-
-	# if puck not seen - home
-	if ((puck_position_mm_x == 0) and 
-		(puck_position_mm_y == 0)):
-		defense_sm_state = mc_control_state_machine_enum.home
+	show_overlay("Defense: " + mc_control_state_machine_enum.reverse_mapping[defense_sm_state], trajectory_points, paddle_intercept_mm_y)
 
-	# send the puck tracker image on to the user interface
-	if frame_received:
-		frame = cv2.resize(frame, dsize=(800,600), interpolation=cv2.INTER_LINEAR)
-		try:
-			visualization_data_tx.put_nowait(frame)
-		except:
-			pass
+# end of function
 
-	last_defense_sm_state = defense_sm_state
+##
+## get_puck_position_now()
+## Where the puck is now: the last fix moved on by the puck velocity for the time since the camera captured it
+## Returns the fix as it is if age compensation is off or the fix has no puck estimate
+##
+def get_puck_position_now():
+	if not (fix_age_compensation and puck_fix_valid):
+		return (puck_position_mm_x, puck_position_mm_y)
+	age = min(max(get_time() - puck_fix_capture_time, 0), fix_age_max)
+	return (puck_position_mm_x + puck_velocity_mmps_x*age, puck_position_mm_y + puck_velocity_mmps_y*age)
 
-# end of function
+## end of function
 
 ##
-## get_paddle_position_mm_x(puck_intercept_position_mm_y, frame, frame_received)
+## get_paddle_position_mm_x(puck_intercept_position_mm_y)
 ## Get an x axis position for the paddle based on desired intercept position
 ## 		and puck bounce prediction
+## Returns the predicted puck path for the visualization, empty if there is no new prediction
 ##	
-def get_paddle_position_mm_x(puck_intercept_position_mm_y, frame, frame_received):
+def get_paddle_position_mm_x(puck_intercept_position_mm_y):
 	global paddle_position_mm_x
 	global paddle_position_averaged_mm_x
-	global paddle_position_averaged_array
-	global paddle_position_averaged_index
+	global paddle_intercept_mm_y
+
+	paddle_intercept_mm_y = puck_intercept_position_mm_y
 
-	# using the equation of a line y = mx + b, find paddle position necessary to intercept the puck
+	# follow the puck's last movement to the intercept line, bouncing off the side walls
 	vector_mm_x = puck_position_mm_x - last_puck_position_mm_x
 	vector_mm_y = puck_position_mm_y - last_puck_position_mm_y
-			
-	if (vector_mm_x == 0) or (vector_mm_y == 0):
-		# avoid divide by zero TODO - logic?
-		return frame
-	else:
-		slope = vector_mm_y/vector_mm_x
-	
-	# b = y - mx
-	intercept_mm_y = puck_position_mm_y - (slope * puck_position_mm_x)
-	
-	# x = (y - b)/m
-	paddle_position_mm_x = ((puck_intercept_position_mm_y + paddle_radius_mm) - intercept_mm_y) / slope
 
-	# predict bounces and get a raw paddle x position prediction
-	bounce_count = 0
-	while True:
-		if (table_width_mm_x - puck_radius_mm) >= paddle_position_mm_x >= puck_radius_mm:
-			if frame_received:
-				if bounce_count == 0:
-					cv2.line(frame, (int(puck_position_mm_y/mm_per_pixel_y), int(puck_position_mm_x/mm_per_pixel_x)), (int((puck_intercept_position_mm_y)/mm_per_pixel_y), int(paddle_position_mm_x/mm_per_pixel_x)), (255,0,0), 3)
-				else:
-					cv2.line(frame, (int(last_bounce_mm_y/mm_per_pixel_y), int(last_bounce_mm_x/mm_per_pixel_x)), (int((puck_intercept_position_mm_y)/mm_per_pixel_y), int(paddle_position_mm_x/mm_per_pixel_x)), (255,0,0), 3)
-			break
+	if vector_mm_y == 0:
+		# moving parallel to the intercept line, it never gets there
+		return []
 
-		elif paddle_position_mm_x < puck_radius_mm:
-			bounce_mm_y = (slope * puck_radius_mm) + intercept_mm_y
-			bounce_mm_x = puck_radius_mm
-			slope = -slope
-			intercept_mm_y = bounce_mm_y - (slope * puck_radius_mm)
-			paddle_position_mm_x = ((puck_intercept_position_mm_y + paddle_radius_mm) - intercept_mm_y) / slope
-			if frame_received:
-				if bounce_count == 0:
-					cv2.line(frame, (int(puck_position_mm_y/mm_per_pixel_y), int(puck_position_mm_x/mm_per_pixel_x)), (int(bounce_mm_y/mm_per_pixel_y), int(bounce_mm_x/mm_per_pixel_x)), (255,0,0), 3)
-				else:
-					cv2.line(frame, (int(last_bounce_mm_y/mm_per_pixel_y), int(last_bounce_mm_x/mm_per_pixel_x)), (int((bounce_mm_y)/mm_per_pixel_y), int(bounce_mm_x/mm_per_pixel_x)), (255,0,0), 3)
-
-		elif paddle_position_mm_x > (table_width_mm_x - puck_radius_mm):
-			bounce_mm_y = (slope * (table_width_mm_x - puck_radius_mm)) + intercept_mm_y
-			bounce_mm_x = (table_width_mm_x - puck_radius_mm)
-			slope = -slope
-			intercept_mm_y = bounce_mm_y - (slope * (table_width_mm_x - puck_radius_mm))
-			paddle_position_mm_x = ((puck_intercept_position_mm_y + paddle_radius_mm) - intercept_mm_y) / slope
-			if frame_received:
-				if bounce_count == 0:
-					cv2.line(frame, (int(puck_position_mm_y/mm_per_pixel_y), int(puck_position_mm_x/mm_per_pixel_x)), (int(bounce_mm_y/mm_per_pixel_y), int(bounce_mm_x/mm_per_pixel_x)), (255,0,0), 3)
-				else:
-					cv2.line(frame, (int(last_bounce_mm_y/mm_per_pixel_y), int(last_bounce_mm_x/mm_per_pixel_x)), (int((bounce_mm_y)/mm_per_pixel_y), int(bounce_mm_x/mm_per_pixel_x)), (255,0,0), 3)
-					
-		last_bounce_mm_y = bounce_mm_y
-		last_bounce_mm_x = bounce_mm_x
-		bounce_count += 1
+	(position_now_mm_x, position_now_mm_y) = get_puck_position_now()
+	trajectory_points = get_trajectory_points(position_now_mm_x, position_now_mm_y, vector_mm_x, vector_mm_y,
+		puck_intercept_position_mm_y + paddle_radius_mm, puck_radius_mm, table_width_mm_x - puck_radius_mm, trajectory_max_bounces_drawn)
+	paddle_position_mm_x = trajectory_points[-1][0]
 
 	logging.debug("Paddle position mm x: %i", paddle_position_mm_x)
 
-	# draw a circle around the raw desired paddle position
-	if frame_received:
-		cv2.circle(frame, (int((puck_intercept_position_mm_y)/mm_per_pixel_y), int(paddle_position_mm_x/mm_per_pixel_x)), 10, (0, 0, 255), 2)
-	
-	# now that we have a predicted x position, take an average to improve accuracy  
-	paddle_position_averaged_array[paddle_position_averaged_index] = paddle_position_mm_x
-	number_non_zero_values = np.count_nonzero(paddle_position_averaged_array)
-	if number_non_zero_values != 0:
-		paddle_position_averaged_mm_x = (np.sum(paddle_position_averaged_array)) / number_non_zero_values
-	else:
-		paddle_position_averaged_mm_x = 0
-	
-	# manage index for array
-	paddle_position_averaged_index += 1
-	if paddle_position_averaged_index >= paddle_position_averaged_window_size:
-		paddle_position_averaged_index = 0
-
-	# draw a circle around the averaged desired paddle position
-	if frame_received:
-		cv2.circle(frame, (int(puck_intercept_position_mm_y/mm_per_pixel_y), int(paddle_position_averaged_mm_x/mm_per_pixel_x)), 10, (0, 255, 255), 2)
+	# now that we have a predicted x position, filter it to improve accuracy
+	paddle_position_averaged_mm_x = paddle_target_filters[game_mode][0].add(paddle_position_mm_x)
 
 	logging.debug("Paddle position mm x averaged: %i", paddle_position_averaged_mm_x)
 
-	# after our paddle postion prediction is drawn onto the frame, return the frame
-	return frame
+	return trajectory_points
 
 # end of function 
 
+##
+## get_paddle_intercept_mm()
+## Send the paddle to the earliest point on the puck's path it can reach in time, between the defense and attack lines
+## Falls back to intercepting on the attack line when the puck won't come within reach
+## Returns the predicted puck path for the visualization
+##
+def get_paddle_intercept_mm():
+	global paddle_position_mm_x
+	global paddle_position_averaged_mm_x
+	global paddle_intercept_mm_y
+
+	intercept_planner.set_axis_limits(axis_max_speed_mmps_x[mc_motor_speed_cmd_x], axis_max_speed_mmps_y[mc_motor_speed_cmd_y],
+		axis_acceleration_mmps2_x, axis_acceleration_mmps2_y)
+	(position_now_mm_x, position_now_mm_y) = get_puck_position_now()
+	intercept = intercept_planner.plan(position_now_mm_x, position_now_mm_y, puck_velocity_mmps_x, puck_velocity_mmps_y,
+		pc_pos_status_mm_x, pc_pos_status_mm_y)
+	if intercept is None:
+		return get_paddle_position_mm_x(attack_line_mm_y)
+
+	logging.debug("Paddle intercept mm: x=%i y=%i in %.3f s, reachable: %s", intercept.position_mm_x, intercept.position_mm_y,
+		intercept.time, intercept.reachable)
+
+	# the planner works from the filtered puck velocity, so there is nothing to average
+	paddle_position_mm_x = intercept.position_mm_x
+	paddle_position_averaged_mm_x = intercept.position_mm_x
+	paddle_intercept_mm_y = intercept.position_mm_y
+
+	return get_trajectory_points(position_now_mm_x, position_now_mm_y, puck_velocity_mmps_x, puck_velocity_mmps_y,
+		intercept.position_mm_y + paddle_radius_mm, puck_radius_mm, table_width_mm_x - puck_radius_mm, trajectory_max_bounces_drawn)
+
+## end of function
+
+##
+## start_overlay_renderer()
+## Start the thread that draws the visual game overlay onto the puck tracker frames for the user interface
+##
+def start_overlay_renderer():
+	global overlay_renderer
+
+	overlay_renderer = OverlayRenderer(visualization_data_rx, visualization_data_tx, mm_per_pixel_x, mm_per_pixel_y)
+	overlay_renderer.start()
+	logging.debug("Started overlay renderer")
+
+## end of function
+
+##
+## show_overlay(state_name, trajectory_points, intercept_mm_y)
+## Hand what the paddle control state machine decided this loop over to the overlay renderer
+##
+def show_overlay(state_name, trajectory_points, intercept_mm_y):
+	if overlay_renderer is None:
+		return
+
+	if not visualization_overlay:
+		overlay_renderer.show(None)
+	elif trajectory_points:
+		overlay_renderer.show(Overlay(state_name, trajectory_points, intercept_mm_y, paddle_position_mm_x, paddle_position_averaged_mm_x))
+	else:
+		overlay_renderer.show(Overlay(state_name, trajectory_points, intercept_mm_y, None, None))
+
+## end of function
+
+##
+## hide_overlay()
+## Stop passing visual game frames on to the user interface
+##
+def hide_overlay():
+	if overlay_renderer is not None:
+		overlay_renderer.hide()
+
+## end of function
+
 ## 
 ## make_decisions()
 ## Controls interface between puck tracker, user interface, and paddle controller
@@ -999,16 +1160,32 @@ def make_decisions():
 
 	# Check ALL states
 	if ((pt_state == pt_state_enum.quit) or (ui_state == ui_state_enum.request_quit) or (ui_state == ui_state_enum.quit)):
+		pause_control_state_machines()
 		handle_quits()
 		return
 	
 	elif ((mc_state == mc_state_enum.error) or (pt_state == pt_state_enum.error) or (ui_state == ui_state_enum.error) or (pc_state == pc_state_enum.error)):
+		pause_control_state_machines()
 		handle_errors()
 		return
 	
 	elif ui_state != ui_state_enum.running:
+		pause_control_state_machines()
+		clear_PC_Cmd()
 		return
 
+	# only the visual game steps the control state machines
+	if ui_screen != ui_screen_enum.visual:
+		pause_control_state_machines()
+
+	# only the visual game and the calibration screens send frames through the overlay renderer
+	if ui_screen not in (ui_screen_enum.visual, ui_screen_enum.fiducial_calibration, ui_screen_enum.puck_calibration):
+		hide_overlay()
+
+	# only the games command the PC, on any other screen it is left as the game left it
+	if ui_screen not in (ui_screen_enum.visual, ui_screen_enum.manual):
+		clear_PC_Cmd()
+
 	# Check which UI screen we are on, this dictates a large part of what state we'll be in
 	if ui_screen == ui_screen_enum.visual:
 		handle_visual_game()
@@ -1046,6 +1223,33 @@ def send_UI_states():
 	logging.debug("MC: pt_state: %s, pt_error: %s", pt_state, pt_error)
 	logging.debug("MC: mc_state: %s, mc_error: %s", mc_state, mc_error)
 	logging.debug("MC: pc_state: %s, pc_error: %s", pc_state, pc_error)
+	send_UI_goal()
+## end of function
+
+##
+## send_UI_goal()
+## Show the UI the next goal scored once it has acknowledged the last one
+##
+## The MC is the only writer of ui_rx, so the UI doesn't clear the goal itself: it sets goal_acknowledged in
+## ui_tx once it has counted the goal, the MC clears the goal, and the UI drops goal_acknowledged when it sees
+## it cleared, so no goal is counted twice. A goal scored in the meantime waits in pending_goal_scored; the
+## handshake takes a few UI updates (~0.3 s) and goals are seconds apart, so one waiting goal is enough.
+##
+def send_UI_goal():
+	global ui_goal_scored
+	global pending_goal_scored
+
+	if ui_goal_acknowledged:
+		if ui_goal_scored == ui_goal_scored_enum.none:
+			return
+		ui_goal_scored = ui_goal_scored_enum.none
+	elif (ui_goal_scored == ui_goal_scored_enum.none) and (pending_goal_scored != ui_goal_scored_enum.none):
+		ui_goal_scored = pending_goal_scored
+		pending_goal_scored = ui_goal_scored_enum.none
+	else:
+		return
+	ui_rx[ui_rx_enum.goal_scored] = ui_goal_scored
+
 ## end of function
 
 
@@ -1061,7 +1265,10 @@ def handle_errors():
 	global visualization_data_rx
 	global ui_process
 	global pt_process
-	global PCAN
+	global can_bus
+
+	# no game commands while there is an error, only the shut off and clear error commands below
+	clear_PC_Cmd()
 
 	# MC error
 	if mc_state == mc_state_enum.error:
@@ -1071,7 +1278,7 @@ def handle_errors():
 			if mc_error == mc_error_enum.pcan:
 				mc_state = mc_state_enum.running
 				mc_error = mc_error_enum.none
-				init_PCAN(PCAN)
+				init_CAN(can_bus)
 
 	# PC error
 	if pc_state == pc_state_enum.error:
@@ -1079,7 +1286,7 @@ def handle_errors():
 		
 		if ui_diagnostic_request == ui_diagnostic_request_enum.clear_errors:
 			pc_state_cmd = pc_state_cmd_enum.clear_error
-			Tx_PC_Cmd(PCAN)
+			Tx_PC_Cmd(can_worker)
 			logging.error("MC: Commanding PC to Clear Error State to resolve the issue")
 			pc_state_cmd = pc_state_cmd_enum.off
 	
@@ -1089,7 +1296,7 @@ def handle_errors():
 		# shut off PC
 		if (pc_state != pc_state_enum.off):
 			pc_state_cmd = pc_state_cmd_enum.off
-			Tx_PC_Cmd(PCAN)
+			Tx_PC_Cmd(can_worker)
 
 		# shut off PT and MC
 		pt_rx[pt_rx_enum.state_cmd] = pt_state_cmd_enum.quit
@@ -1106,7 +1313,7 @@ def handle_errors():
 			# shut off PC
 			if (pc_state != pc_state_enum.off):
 				pc_state_cmd = pc_state_cmd_enum.off
-				Tx_PC_Cmd(PCAN)
+				Tx_PC_Cmd(can_worker)
 
 			# shut off UI and MC
 			ui_rx[ui_rx_enum.state_cmd] = ui_state_cmd_enum.quit
@@ -1114,7 +1321,7 @@ def handle_errors():
 				prepare_to_quit()
 				sys.exit(0)
 
-	ui_tx[ui_tx_enum.diagnostic_request] = ui_diagnostic_request_enum.idle
+	acknowledge_diagnostic_request()
 
 ## end of function
 
@@ -1131,9 +1338,34 @@ def prepare_to_quit():
 		else:
 			logging.info("UI and PT processes are terminated")
 			break
+	if overlay_renderer is not None:
+		overlay_renderer.stop()
+		logging.info("Overlay renderer: %s", overlay_renderer.get_stats())
 	Close_HDF5()
-	Uninit_PCAN(PCAN)
-	logging.info("Closing visualization pipes")
+	close_flight_recorder()
+	if can_worker is not None:
+		can_worker.stop()
+		logging.info("CAN worker: %s", can_worker.get_stats())
+	Uninit_CAN(can_bus)
+	if paddle_controller_sim is not None:
+		paddle_controller_sim.stop()
+	logging.info(fix_to_cmd_latency.get_summary())
+	for (stage, name) in pt_latency_stages:
+		logging.info(pt_stage_latency[stage].get_summary())
+	logging.info("PT fixes missed: %i of %i", pt_fixes_missed, pt_fix_sequence)
+	logging.info("PT frames timestamped on arrival instead of by the camera driver: %i", pt_timestamp_fallbacks)
+	logging.info("PT -> MC record: %s", pt_tx.get_stats())
+	logging.info("UI -> MC record: %s", ui_tx.get_stats())
+	logging.info("MC -> PT record: %s", pt_rx.get_stats())
+	logging.info("MC -> UI record: %s", ui_rx.get_stats())
+	logging.info(ipc_loop_time.get_summary())
+	logging.info("MC IPC shared record accesses per loop: %.1f over %i loops",
+		sum(record.get_accesses() for record in (pt_tx, ui_tx, pt_rx, ui_rx)) / float(max(ipc_loops, 1)), ipc_loops)
+	logging.info("Offense state machine: %s", offense_state_machine.get_stats())
+	logging.info("Defense state machine: %s", defense_state_machine.get_stats())
+	logging.info("Closing visualization ring buffers")
+	logging.info("PT -> MC visualization frames: %s", visualization_data_rx.get_stats())
+	logging.info("MC -> UI visualization frames: %s", visualization_data_tx.get_stats())
 	visualization_data_tx.close()
 	visualization_data_rx.close()
 	logging.info("Ready to quit MC")
@@ -1150,6 +1382,9 @@ def handle_quits():
 	global ui_process
 	global pt_process
 	global pc_state_cmd
+
+	# the only command left to send is off, below
+	clear_PC_Cmd()
 	
 	if ui_state == ui_state_enum.request_quit:
 		logging.debug("MC: UI is requesting to quit")
@@ -1161,7 +1396,7 @@ def handle_quits():
 
 	if (pc_state != pc_state_enum.off):
 		pc_state_cmd = pc_state_cmd_enum.off
-		Tx_PC_Cmd(PCAN)	
+		Tx_PC_Cmd(can_worker)	
 		
 	if (ui_state == ui_state_enum.quit and pt_state == pt_state_enum.quit):
 		logging.info("MC: UI and PT are in quit state, PC is in OFF, ready to be terminated")
@@ -1176,26 +1411,36 @@ def handle_quits():
 ##
 def handle_visual_game():
 	global pc_state_cmd
+	global pending_goal_scored
 	pt_rx[pt_rx_enum.state_cmd] = pt_state_cmd_enum.track
 
 	# check if we're tracking
 	if pt_state != pt_state_enum.tracking:
 		logging.debug("MC: Camera isn't in tracking state, can't start visual game")	
+		hide_overlay()
+		pause_control_state_machines()
+		clear_PC_Cmd()
 		return
 
 	if game_mode == ui_game_mode_enum.offense:
+		pause_control_state_machines(offense_state_machine)
 		paddle_control_offense_state_machine()
 	elif game_mode == ui_game_mode_enum.defense:
+		pause_control_state_machines(defense_state_machine)
 		paddle_control_defense_state_machine()
+	else:
+		pause_control_state_machines()
 
 	if ui_game_state == ui_game_state_enum.playing:
-		if pc_goal_scored != last_pc_goal_scored:
-			ui_rx[ui_rx_enum.goal_scored] = pc_goal_scored
+		if pc_goal_scored != last_pc_goal_scored and pc_goal_scored != ui_goal_scored_enum.none:
+			pending_goal_scored = pc_goal_scored
 		pc_state_cmd = pc_state_cmd_enum.on
-		Tx_PC_Cmd(PCAN)
+		Tx_PC_Cmd(can_worker)
 	elif ui_game_state == ui_game_state_enum.stopped:
 		pc_state_cmd = pc_state_cmd_enum.off
-		Tx_PC_Cmd(PCAN)
+		Tx_PC_Cmd(can_worker)
+	else:
+		clear_PC_Cmd()
 
 ## end of function
 
@@ -1207,23 +1452,27 @@ def handle_manual_game():
 	global mc_pos_cmd_mm_x
 	global mc_pos_cmd_mm_y
 	global pc_state_cmd
+	global pending_goal_scored
 
 	if (pt_state != pt_state_enum.tracking)	and (pt_state != pt_state_enum.idle):
 		logging.debug("MC: Camera isn't in tracking or idle state, can't start manual game")
+		clear_PC_Cmd()
 		return
 
 	if ui_game_state == ui_game_state_enum.playing:
-		if pc_goal_scored != last_pc_goal_scored:
-			ui_rx[ui_rx_enum.goal_scored] = pc_goal_scored
+		if pc_goal_scored != last_pc_goal_scored and pc_goal_scored != ui_goal_scored_enum.none:
+			pending_goal_scored = pc_goal_scored
 		pc_state_cmd = pc_state_cmd_enum.on
-		mc_pos_cmd_mm_x = ui_tx[ui_tx_enum.paddle_position_x]
-		mc_pos_cmd_mm_y = ui_tx[ui_tx_enum.paddle_position_y]
+		mc_pos_cmd_mm_x = ui_paddle_position_mm_x
+		mc_pos_cmd_mm_y = ui_paddle_position_mm_y
 		logging.info("MC Manual game: x=%s y=%s", mc_pos_cmd_mm_x, mc_pos_cmd_mm_y)
-		Tx_PC_Cmd(PCAN)
+		Tx_PC_Cmd(can_worker)
 
 	elif ui_game_state == ui_game_state_enum.stopped:
 		pc_state_cmd = pc_state_cmd_enum.off
-		Tx_PC_Cmd(PCAN)
+		Tx_PC_Cmd(can_worker)
+	else:
+		clear_PC_Cmd()
 
 ## end of function
 
@@ -1235,43 +1484,47 @@ def handle_diagnostic_requests():
 	global pc_state_cmd
 
 	if ui_diagnostic_request == ui_diagnostic_request_enum.calibrate_paddle_controller:
-		ui_tx[ui_tx_enum.diagnostic_request] = ui_diagnostic_request_enum.idle
+		acknowledge_diagnostic_request()
 		pc_state_cmd = pc_state_cmd_enum.calibration
-		Tx_PC_Cmd(PCAN)
+		Tx_PC_Cmd(can_worker)
 		pc_state_cmd = pc_state_cmd_enum.off
 
 	if ui_diagnostic_request == ui_diagnostic_request_enum.clear_errors:
-		ui_tx[ui_tx_enum.diagnostic_request] = ui_diagnostic_request_enum.idle
+		acknowledge_diagnostic_request()
 		pc_state_cmd = pc_state_cmd_enum.clear_error
-		Tx_PC_Cmd(PCAN)
+		Tx_PC_Cmd(can_worker)
 		pc_state_cmd = pc_state_cmd_enum.off
 
 # end of fuction
 
+##
+## acknowledge_diagnostic_request()
+## Mark the UI's latest one shot request (clear errors, calibrate the PC) handled, so it is only acted on once
+##
+## The UI makes a request by writing it to ui_tx along with its request count plus one, and the MC echoes the count
+## it has handled back in ui_rx, so neither process writes the other's record
+##
+def acknowledge_diagnostic_request():
+	global diagnostic_request_handled
+
+	if diagnostic_request_handled != ui_diagnostic_request_count:
+		diagnostic_request_handled = ui_diagnostic_request_count
+		ui_rx[ui_rx_enum.diagnostic_request_handled] = diagnostic_request_handled
+
+## end of function
+
 ##  
 ## calibrate_fiducials()
 ## Calibrate fiducials when in the UI settings 
 ##
 def calibrate_fiducials():
-	global visualization_data_tx
-	global visualization_data_rx
-
 	if ui_diagnostic_request == ui_diagnostic_request_enum.calibrate_fiducials:
 		pt_rx[pt_rx_enum.state_cmd] = pt_state_cmd_enum.calibrate_fiducials
 	else:
 		pt_rx[pt_rx_enum.state_cmd] = pt_state_cmd_enum.find_fiducials
 
-	# get frame for visualization
-	try:
-		frame = visualization_data_rx.get(False)
-	except Queue.Empty:
-		pass
-	else:
-		try:
-			visualization_data_tx.get_nowait()
-			visualization_data_tx.put(frame)
-		except Queue.Empty:
-			visualization_data_tx.put(frame)
+	# pass the frames for visualization on to the user interface, through the renderer as it is the only writer
+	show_calibration_frames()
 	
 ## end of function
 
@@ -1282,17 +1535,18 @@ def calibrate_fiducials():
 def calibrate_puck():
 	pt_rx[pt_rx_enum.state_cmd] = pt_state_cmd_enum.find_puck
 
-	# get frame for visualization
-	try:
-		frame = visualization_data_rx.get(False)
-	except Queue.Empty:
-		pass
-	else:
-		try:
-			visualization_data_tx.get_nowait()
-			visualization_data_tx.put(frame)
-		except Queue.Empty:
-			visualization_data_tx.put(frame)	
+	# pass the frames for visualization on to the user interface
+	show_calibration_frames()
+
+## end of function
+
+##
+## show_calibration_frames()
+## Have the overlay renderer pass the puck tracker's frames on to the user interface without an overlay
+##
+def show_calibration_frames():
+	if overlay_renderer is not None:
+		overlay_renderer.show(None)
 
 ## end of function
 
@@ -1303,47 +1557,74 @@ def calibrate_puck():
 ## 
 ## main()
 ##
-try:
-	# Create enums
-	get_enums()
-	get_settings()
-
-	# Set initial master controller state/error
-	mc_state = mc_state_enum.running
-	mc_error = mc_error_enum.none
-
-	# Create HDF5 file for logging PC position data
-	create_HDF5()
-
-	# Initialize PCAN device
-	init_PCAN(PCAN)
-
-	# Initialize IPC between MC - PC - UI
-	init_IPC()
-
-	logging.info("MC: Entering main loop")
-
-	# Master Controller loop
-	while True:
-		rx_IPC()
-		rx_CAN(PCAN)
-		add_pos_rcvd_HDF5(str(datetime.datetime.now())) # TODO - is this working right?
-		make_decisions()
-		add_pos_sent_HDF5(str(datetime.datetime.now())) # TODO - is this working right?
-		update_dset_HDF5()
-		sleep(timeout)
-
-except KeyboardInterrupt:
-	mc_state = mc_state_enum.stopped
-	mc_error = mc_error_enum.crashed
-	send_UI_states()
-	prepare_to_quit()
-	sys.exit()
+if __name__ == '__main__':
+	try:
+		# Create enums
+		get_enums()
+		get_settings()
+
+		# Create the CAN transport to the paddle controller
+		# On the loopback bus there is no paddle controller hardware, so run the simulator in its place
+		if can_transport_backend == 'loopback':
+			virtual_can_bus = VirtualCANBus()
+			can_bus = create_can_transport(can_transport_backend, can_socketcan_interface, virtual_can_bus)
+			pc_sim_transport = LoopbackTransport(virtual_can_bus)
+			pc_sim_transport.open()
+			paddle_controller_sim = PaddleControllerSim(pc_sim_transport)
+			paddle_controller_sim.start()
+			logging.info("Paddle controller simulator started on the loopback CAN bus")
+		else:
+			can_bus = create_can_transport(can_transport_backend, can_socketcan_interface)
+
+		# Set initial master controller state/error
+		mc_state = mc_state_enum.running
+		mc_error = mc_error_enum.none
+
+		# Create HDF5 file for logging PC position data
+		create_HDF5()
+
+		# Create flight recorder for every loop's inputs and decisions
+		create_flight_recorder()
+
+		# Initialize CAN transport, the worker thread reads and writes it from here on
+		can_worker = CANWorker(can_bus, TxScheduler(mc_cmd_pc, can_min_change_mm, can_keep_alive_period, can_tx_bus_budget,
+			command_timeout=can_command_timeout),
+			fix_to_cmd_latency, get_time)
+		init_CAN(can_bus)
+
+		# Initialize IPC between MC - PC - UI
+		init_IPC()
+
+		# Draw the visual game overlay off the control loop
+		start_overlay_renderer()
+
+		logging.info("MC: Entering main loop")
+
+		# Master Controller loop
+		while True:
+			loop_time = get_time()
+			rx_IPC()
+			rx_CAN(can_worker)
+			time_rcvd = get_time()
+			make_decisions()
+			tx_IPC()
+			add_PC_data_HDF5(time_rcvd, get_time())
+			record_flight_data(loop_time)
+			wait_for_data()
+
+	except KeyboardInterrupt:
+		mc_state = mc_state_enum.stopped
+		mc_error = mc_error_enum.crashed
+		send_UI_states()
+		tx_IPC()
+		prepare_to_quit()
+		sys.exit()
 
-except Exception as e:
-	# Really Broken. Quit the puck tracker so we release the webcam and I don't have to reboot the computer over and over
-	print e # TODO - redirect this to the log file
-	pt_rx[pt_rx_enum.state_cmd] = pt_state_cmd_enum.quit
+	except Exception as e:
+		# Really Broken. Quit the puck tracker so we release the webcam and I don't have to reboot the computer over and over
+		print e # TODO - redirect this to the log file
+		pt_rx[pt_rx_enum.state_cmd] = pt_state_cmd_enum.quit
+		pt_rx.publish()
 ## end of function
 
 ##############################################################################################
@@ -0,0 +1,279 @@
+# mc_replay.py
+# Replays a flight recorder file through the master controller decision logic
+# No camera, PCAN dongle or user interface needed, runs as fast as the decision logic allows
+#
+# Usage (from this directory): python mc_replay.py <flight record> [<replayed flight record>]
+# The recorded puck tracker, user interface and paddle controller inputs of every loop are fed to
+# rx_IPC(), rx_CAN() and make_decisions() on a simulated clock. Every CAN message the master controller
+# sends is captured, and the replayed decisions are compared against the recorded ones.
+# Give a second file name to also record the replayed run, so two versions of the strategy can be compared.
+# replay() can be called more than once in a process, every call starts the master controller from scratch.
+
+import sys
+import time
+import logging
+import numpy as np
+import numpy.lib.recfunctions as recfunctions
+
+import master_controller as mc
+from frame_ring_buffer import FrameRingBuffer
+from shared_struct import SharedStruct
+from can_transport import VirtualCANBus, LoopbackTransport
+from can_worker import CANWorker
+from can_tx_scheduler import TxScheduler
+from can_codec import mc_cmd_pc, pc_status
+from flight_recorder import FlightRecorder, load_flight_record
+
+# replayed positions within this many mm of the recorded ones count as the same decision
+position_tolerance_mm = 0.5
+
+# captured outgoing CAN commands
+replay_command_dtype = np.dtype([('time', 'float64'),
+								 ('id', 'uint16'),
+								 ('pos_cmd_mm_x', 'uint16'),
+								 ('pos_cmd_mm_y', 'uint16'),
+								 ('motor_speed_cmd', 'uint8'),
+								 ('state_cmd', 'uint8')])
+
+##
+## ReplayClock()
+## Simulated clock, stands in for master_controller.get_time()
+##
+class ReplayClock(object):
+	def __init__(self):
+		self.time = 0.0
+
+	def get_time(self):
+		return self.time
+
+## end of class
+
+##
+## ReplayPaddleController(bus, clock)
+## Stands in for the paddle controller on a loopback CAN bus: sends the recorded status messages
+## and captures everything the master controller writes
+##
+class ReplayPaddleController(object):
+	def __init__(self, bus, clock):
+		self.clock = clock
+		self.transport = LoopbackTransport(bus)
+		self.transport.open()
+		self.commands = []
+
+	##
+	## send_pc_status(record)
+	## Send the paddle controller status message the master controller received in a recorded loop
+	##
+	def send_pc_status(self, record):
+		data = pc_status.encode(pos_x_mm=record['pc_pos_status_mm_x'], pos_y_mm=record['pc_pos_status_mm_y'],
+			goal_scored=record['pc_goal_scored'], state=record['pc_state'], error=record['pc_error'])
+		self.transport.write(pc_status.message_id, data)
+
+	##
+	## capture_commands()
+	## Keep every message the master controller wrote since the last call, stamped with the simulated time
+	##
+	def capture_commands(self):
+		for (timestamp, message_id, data, hardware_timestamp) in self.transport.read_batch(1024):
+			if message_id == mc_cmd_pc.message_id:
+				command = mc_cmd_pc.decode(data)
+				self.commands.append((self.clock.time, message_id, command.pos_cmd_x_mm, command.pos_cmd_y_mm,
+					command.motor_speed_cmd_x | (command.motor_speed_cmd_y << 2), command.state_cmd))
+
+## end of class
+
+##
+## set_up_master_controller(clock, device)
+## device is the master controller's end of the loopback CAN bus
+## Start the master controller afresh, load settings and give it its IPC records, empty frame buffers and the
+## simulated clock
+##
+def set_up_master_controller(clock, device):
+	# reload the module so nothing an earlier replay in this process left in its globals (state machines, target
+	# filters, last fix, latencies) carries over, each replay starts from the same state a new process would
+	reload(mc)
+	mc.get_enums()
+	mc.get_settings()
+	mc.mc_state = mc.mc_state_enum.running
+	mc.mc_error = mc.mc_error_enum.none
+
+	mc.can_bus = device
+	mc.get_time = clock.get_time
+	mc.ui_rx = SharedStruct(mc.settings['user_interface']['enumerations']['ui_rx'])
+	mc.ui_tx = SharedStruct(mc.settings['user_interface']['enumerations']['ui_tx'])
+	mc.pt_rx = SharedStruct(mc.settings['puck_tracker']['enumerations']['pt_rx'])
+	mc.pt_tx = SharedStruct(mc.settings['puck_tracker']['enumerations']['pt_tx'])
+	mc.ui_rx.set_batch_writes(True)
+	mc.pt_rx.set_batch_writes(True)
+
+	# nothing is ever written to these, so there is never a frame to draw on
+	mc.visualization_data_rx = FrameRingBuffer((1, 1, 3), 1)
+	mc.visualization_data_tx = FrameRingBuffer((1, 1, 3), 1)
+
+	# the recorded session decides when to stop, there are no processes or files to clean up
+	mc.prepare_to_quit = lambda: None
+
+## end of function
+
+##
+## add_fix_fields(records)
+## Records from before fixes carried a sequence number, capture time and validity flag get them made up:
+## a new fix whenever the publish time changes, captured when it was published, valid if the puck was found
+##
+def add_fix_fields(records):
+	if 'pt_fix_sequence' in records.dtype.names:
+		return records
+	publish_time = records['puck_fix_publish_time']
+	sequence = np.ones(len(records), dtype=np.uint32)
+	sequence[1:] += np.cumsum(publish_time[1:] != publish_time[:-1], dtype=np.uint32)
+	valid = ((records['puck_position_mm_x'] != 0) | (records['puck_position_mm_y'] != 0)).astype(np.uint8)
+	return recfunctions.append_fields(records, ['puck_fix_capture_time', 'pt_fix_sequence', 'puck_fix_valid'],
+		[publish_time.copy(), sequence, valid], usemask=False)
+
+## end of function
+
+##
+## feed_record(record, paddle_controller)
+## Put one recorded loop's inputs where rx_IPC() and rx_CAN() look for them
+##
+def feed_record(record, paddle_controller):
+	pt_tx_enum = mc.pt_tx_enum
+	mc.pt_tx.update({pt_tx_enum.state: record['pt_state'],
+					 pt_tx_enum.error: record['pt_error'],
+					 pt_tx_enum.puck_position_x: record['puck_position_mm_x'],
+					 pt_tx_enum.puck_position_y: record['puck_position_mm_y'],
+					 pt_tx_enum.puck_velocity_x: record['puck_velocity_mmps_x'],
+					 pt_tx_enum.puck_velocity_y: record['puck_velocity_mmps_y'],
+					 pt_tx_enum.puck_position_variance: record['puck_position_variance'],
+					 pt_tx_enum.puck_velocity_variance: record['puck_velocity_variance'],
+					 pt_tx_enum.publish_time: record['puck_fix_publish_time'],
+					 pt_tx_enum.capture_time: record['puck_fix_capture_time'],
+					 pt_tx_enum.fix_valid: record['puck_fix_valid'],
+					 pt_tx_enum.sequence: record['pt_fix_sequence']})
+
+	# the MC saw a one shot request only in the loop it was new in, so each one recorded is a new request
+	ui_tx_enum = mc.ui_tx_enum
+	request_count = mc.diagnostic_request_handled
+	if record['ui_diagnostic_request'] in (mc.ui_diagnostic_request_enum.calibrate_paddle_controller,
+		mc.ui_diagnostic_request_enum.clear_errors):
+		request_count += 1
+	mc.ui_tx.update({ui_tx_enum.state: record['ui_state'],
+					 ui_tx_enum.error: record['ui_error'],
+					 ui_tx_enum.screen: record['ui_screen'],
+					 ui_tx_enum.game_state: record['ui_game_state'],
+					 ui_tx_enum.game_mode: record['game_mode'],
+					 ui_tx_enum.diagnostic_request: record['ui_diagnostic_request'],
+					 ui_tx_enum.diagnostic_request_count: request_count,
+					 ui_tx_enum.game_speed_x: record['mc_motor_speed_cmd_x'],
+					 ui_tx_enum.game_speed_y: record['mc_motor_speed_cmd_y'],
+					 ui_tx_enum.paddle_position_x: record['ui_paddle_position_mm_x'],
+					 ui_tx_enum.paddle_position_y: record['ui_paddle_position_mm_y']})
+
+	paddle_controller.send_pc_status(record)
+
+## end of function
+
+##
+## replay(records, replay_file_name)
+## Run every record through the decision logic
+## Returns the captured CAN commands, the replayed decisions and the replay time (s)
+##
+def replay(records, replay_file_name=None):
+	clock = ReplayClock()
+	bus = VirtualCANBus()
+	device = LoopbackTransport(bus)
+	device.open()
+	paddle_controller = ReplayPaddleController(bus, clock)
+	set_up_master_controller(clock, device)
+
+	# the worker's thread isn't started, the loop below receives and transmits in step with the records
+	scheduler = TxScheduler(mc_cmd_pc, mc.can_min_change_mm, mc.can_keep_alive_period, mc.can_tx_bus_budget,
+		command_timeout=mc.can_command_timeout)
+	worker = CANWorker(device, scheduler, fix_latency=mc.fix_to_cmd_latency, get_time=clock.get_time)
+	mc.can_worker = worker
+
+	if replay_file_name is not None:
+		mc.flight_recorder = FlightRecorder(replay_file_name, mc.flight_record_fields, max(len(records), 1))
+
+	decisions = np.zeros(len(records), dtype=[('offense_sm_state', 'uint8'), ('defense_sm_state', 'uint8'),
+		('mc_pos_cmd_mm_x', 'float32'), ('mc_pos_cmd_mm_y', 'float32')])
+
+	start_time = time.time()
+	number_of_loops = 0
+	for record in records:
+		clock.time = record['time']
+		feed_record(record, paddle_controller)
+		try:
+			mc.rx_IPC()
+			worker.receive()
+			mc.rx_CAN(worker)
+			mc.make_decisions()
+			mc.tx_IPC()
+			worker.transmit()
+		except SystemExit:
+			logging.info("Replay: recorded session quit after %i loops", number_of_loops)
+			break
+		paddle_controller.capture_commands()
+		if replay_file_name is not None:
+			mc.record_flight_data(record['time'])
+		decisions[number_of_loops] = (mc.offense_sm_state, mc.defense_sm_state, mc.mc_pos_cmd_mm_x, mc.mc_pos_cmd_mm_y)
+		number_of_loops += 1
+	replay_time = time.time() - start_time
+
+	worker.close()
+	if replay_file_name is not None:
+		mc.flight_recorder.close()
+
+	commands = np.array(paddle_controller.commands, dtype=replay_command_dtype)
+	return commands, decisions[:number_of_loops], replay_time
+
+## end of function
+
+##
+## compare_decisions(records, decisions)
+## Indexes of the loops where the replayed decisions differ from the recorded ones
+##
+def compare_decisions(records, decisions):
+	records = records[:len(decisions)]
+	different = ((records['offense_sm_state'] != decisions['offense_sm_state']) |
+				 (records['defense_sm_state'] != decisions['defense_sm_state']) |
+				 (np.abs(records['mc_pos_cmd_mm_x'] - decisions['mc_pos_cmd_mm_x']) > position_tolerance_mm) |
+				 (np.abs(records['mc_pos_cmd_mm_y'] - decisions['mc_pos_cmd_mm_y']) > position_tolerance_mm))
+	return np.flatnonzero(different)
+
+## end of function
+
+##############################################################################################
+## MAIN() function
+##############################################################################################
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		print "Usage: python mc_replay.py <flight record> [<replayed flight record>]"
+		sys.exit(1)
+
+	# keep debug logging out of the timing
+	logging.getLogger().setLevel(logging.WARNING)
+
+	records = add_fix_fields(load_flight_record(sys.argv[1]))
+	replay_file_name = sys.argv[2] if len(sys.argv) > 2 else None
+	commands, decisions, replay_time = replay(records, replay_file_name)
+
+	number_of_loops = len(decisions)
+	if number_of_loops == 0:
+		print "Nothing to replay in %s" % sys.argv[1]
+		sys.exit(0)
+
+	recorded_time = records['time'][number_of_loops - 1] - records['time'][0]
+	print "Replayed %i loops (%.1f s of play) in %.2f s: %.0f loops/s, %.0fx real time" % (number_of_loops,
+		recorded_time, replay_time, number_of_loops / replay_time, recorded_time / max(replay_time, 1e-9))
+	print "Captured %i CAN commands to the paddle controller" % len(commands)
+
+	different = compare_decisions(records, decisions)
+	if len(different) == 0:
+		print "Replayed decisions match the recording"
+	else:
+		print "Replayed decisions differ from the recording in %i loops, first at loop %i (t=%.3f s)" % (len(different),
+			different[0], records['time'][different[0]] - records['time'][0])
+
+## end of function
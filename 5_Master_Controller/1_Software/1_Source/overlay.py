@@ -0,0 +1,128 @@
+# overlay.py
+# Visualization overlay for the master controller
+# The decision logic only describes what to draw; an OverlayRenderer thread composites it onto the newest
+# puck tracker frame and passes the result on to the user interface, so no image work happens in the control loop
+
+import collections
+import threading
+import time
+import cv2
+
+##
+## Overlay(state, trajectory_points, intercept_mm_y, position_mm_x, position_averaged_mm_x)
+## What the paddle control state machine decided this loop, all positions in table mm
+## trajectory_points is the predicted puck path as a list of (x, y), empty if nothing was predicted
+## position_mm_x/position_averaged_mm_x are the raw and averaged paddle positions on the intercept line,
+## None if there is no prediction
+##
+Overlay = collections.namedtuple('Overlay', ['state', 'trajectory_points', 'intercept_mm_y', 'position_mm_x', 'position_averaged_mm_x'])
+
+##
+## draw_overlay(frame, overlay, mm_per_pixel_x, mm_per_pixel_y)
+## Draw an overlay onto a puck tracker frame in place, the frame's columns run along the table length (y)
+##
+def draw_overlay(frame, overlay, mm_per_pixel_x, mm_per_pixel_y):
+	points = overlay.trajectory_points
+	for i in range(len(points) - 1):
+		(start_mm_x, start_mm_y) = points[i]
+		(end_mm_x, end_mm_y) = points[i + 1]
+		cv2.line(frame, (int(start_mm_y/mm_per_pixel_y), int(start_mm_x/mm_per_pixel_x)), (int(end_mm_y/mm_per_pixel_y), int(end_mm_x/mm_per_pixel_x)), (255,0,0), 3)
+
+	# circles around the raw and averaged desired paddle positions
+	if overlay.position_mm_x is not None:
+		cv2.circle(frame, (int(overlay.intercept_mm_y/mm_per_pixel_y), int(overlay.position_mm_x/mm_per_pixel_x)), 10, (0, 0, 255), 2)
+	if overlay.position_averaged_mm_x is not None:
+		cv2.circle(frame, (int(overlay.intercept_mm_y/mm_per_pixel_y), int(overlay.position_averaged_mm_x/mm_per_pixel_x)), 10, (0, 255, 255), 2)
+
+	cv2.putText(frame, overlay.state, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+
+## end of function
+
+##
+## OverlayRenderer(frame_source, frame_sink, mm_per_pixel_x, mm_per_pixel_y, output_size, poll_period)
+## Thread that takes every new frame from frame_source, scales it to output_size (columns, rows) in frame_sink
+## and draws the latest overlay onto the scaled copy, never onto the puck tracker's frame
+## The control loop hands over overlays with show() and stops the rendering with hide(), both just
+## swap a reference so they never wait for the thread. This thread is frame_sink's only producer, anything else
+## that wants frames passed on to the user interface uses show(None)
+##
+class OverlayRenderer(object):
+	def __init__(self, frame_source, frame_sink, mm_per_pixel_x, mm_per_pixel_y, output_size=(800, 600), poll_period=0.005):
+		self.frame_source = frame_source
+		self.frame_sink = frame_sink
+		self.mm_per_pixel_x = mm_per_pixel_x
+		self.mm_per_pixel_y = mm_per_pixel_y
+		self.output_size = output_size
+		self.poll_period = poll_period
+
+		self.visible = False
+		self.overlay = None
+		self.frames_rendered = 0
+		self.frames_torn = 0
+		self.render_time = 0.0
+		self.running = False
+		self.thread = None
+
+	##
+	## show(overlay)
+	## Render frames with this overlay from now on, None renders the frames without one
+	##
+	def show(self, overlay):
+		self.overlay = overlay
+		self.visible = True
+
+	##
+	## hide()
+	## Leave the frames alone until the next show()
+	##
+	def hide(self):
+		self.visible = False
+
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target=self.run, name="overlay_renderer")
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.running = False
+		if self.thread is not None:
+			self.thread.join(1.0)
+
+	def run(self):
+		while self.running:
+			frame = self.frame_source.read_latest() if self.visible else None
+			if frame is None:
+				time.sleep(self.poll_period)
+				continue
+
+			start_time = time.time()
+			overlay = self.overlay
+			(rows, columns) = frame.shape[:2]
+			frame_resized = self.frame_sink.get_write_buffer((self.output_size[1], self.output_size[0]) + frame.shape[2:])
+			cv2.resize(frame, dsize=self.output_size, dst=frame_resized, interpolation=cv2.INTER_LINEAR)
+
+			# the frame is a view onto the puck tracker's slot, if the tracker came back round to the slot during the
+			# resize the copy may be half of two frames, so it is dropped and the sink's slot is used for the next one
+			if not self.frame_source.is_current():
+				self.frames_torn += 1
+				continue
+
+			if overlay is not None:
+				draw_overlay(frame_resized, overlay, self.mm_per_pixel_x*rows/float(self.output_size[1]),
+					self.mm_per_pixel_y*columns/float(self.output_size[0]))
+			self.frame_sink.commit()
+			self.render_time += time.time() - start_time
+			self.frames_rendered += 1
+
+	##
+	## get_stats()
+	## Frames rendered, frames dropped because the puck tracker overwrote them mid resize and the average time
+	## to render one (ms)
+	##
+	def get_stats(self):
+		return {'frames_rendered': self.frames_rendered,
+				'frames_torn': self.frames_torn,
+				'average_render_time_ms': round(1000*self.render_time/max(self.frames_rendered, 1), 3)}
+
+## end of class
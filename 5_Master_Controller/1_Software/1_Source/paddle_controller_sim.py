@@ -0,0 +1,471 @@
+# paddle_controller_sim.py
+# Paddle controller simulator, stands in for the HCS12 paddle controller on a CAN bus
+# Follows the firmware in 4_Paddle_Controller/2_Software/1_Source: the same state machine, position control,
+# speed limiting and status message, driving a model of the belt driven X and Y axes
+#
+# Usage: python paddle_controller_sim.py [socketcan interface]
+# Runs in real time on a SocketCAN interface (vcan0 by default) for a master controller in another process
+# The master controller starts one by itself on its own bus when can_transport_backend is 'loopback'
+
+import sys
+import time
+import threading
+
+from can_transport import get_time, create_can_transport
+from can_codec import mc_cmd_pc, pc_status
+
+# CAN protocol, see can.h and can_codec.py
+paddle_radius_mm = 48
+goal_none = 0
+goal_human = 1		# Goal scored on human
+goal_robot = 2		# Goal scored on robot
+
+# state machine, see state_machine.h
+state_off = 0
+state_calibration = 1
+state_on = 2
+state_error = 3
+
+state_cmd_off = 0
+state_cmd_calibration = 1
+state_cmd_on = 2
+state_cmd_clear_error = 3
+
+error_none = 0
+error_y_axis_overload = 1
+error_x_axis_overload = 2
+error_can_buffer_full = 3
+error_can_tx = 4
+error_light_screen_centre = 5
+
+# motor drive, see dcm.h
+dcm_mm_per_rev = 40
+dcm_enc_ticks_per_rev = 48
+dcm_overload_strike_count_limit = 50
+dcm_overload_speed_mm_per_s = 3
+dcm_brake = 0
+dcm_forward = 1
+dcm_reverse = 2
+dcm_homing_speed = 11		# duty 45 while homing, in calc_speed units
+
+control_period = 0.001		# the position control runs at 1 kHz
+
+##
+## c_div(a, b)
+## Integer division that truncates towards zero like C does
+##
+def c_div(a, b):
+	return int(float(a) / b)
+
+## end of function
+
+##
+## SimAxis(...)
+## One belt driven axis: the firmware's dcm_t position controller plus a DC motor model
+## The motor's torque falls linearly from stall to zero at no-load speed, so the acceleration it can
+## give the paddle drops as the paddle speeds up: a = a_stall*(drive - v/v_no_load) - friction
+## Positions are in the firmware's axis frame, mm from the home switch, where the encoder is zeroed
+##
+class SimAxis(object):
+	def __init__(self, length_mm, boundary_mm, home_mm, gain_p, gain_p_factor, gain_i, integral_limit, slew_rate,
+				 speed_limit_distance_factor, no_load_speed_mm_per_s, stall_acceleration_mm_per_s2, friction_mm_per_s2=500.0):
+		# firmware parameters
+		self.length_mm = length_mm
+		self.boundary_mm = boundary_mm
+		self.home_mm = home_mm
+		self.max_speed = 100
+		self.gain_p = gain_p
+		self.gain_p_factor = gain_p_factor
+		self.gain_i = gain_i
+		self.integral_limit = integral_limit
+		self.slew_rate = slew_rate
+		self.speed_limit_distance_factor = speed_limit_distance_factor
+
+		# motor and belt
+		self.no_load_speed = no_load_speed_mm_per_s
+		self.stall_acceleration = stall_acceleration_mm_per_s2
+		self.friction = friction_mm_per_s2
+
+		# the paddle starts somewhere in the middle until it is homed
+		self.position = length_mm / 2.0
+		self.velocity = 0.0
+		self.jammed = False
+
+		self.enabled = False
+		self.homing = False
+		self.position_cmd_mm = length_mm / 2
+		self.position_mm_old = 0
+		self.speed_mm_per_s = 0
+		self.error_i = 0
+		self.calc_speed = 0
+		self.set_speed = 0
+		self.direction = dcm_brake
+		self.direction_old = dcm_brake
+		self.overload_strike_counter = 0
+		self.overload = False
+
+	def get_encoder_ticks(self):
+		return max(int(self.position * dcm_enc_ticks_per_rev / dcm_mm_per_rev), 0)
+
+	def get_position_mm(self):
+		return (self.get_encoder_ticks() * dcm_mm_per_rev) // dcm_enc_ticks_per_rev
+
+	##
+	## at_home()
+	## True when the paddle is on the home switch
+	##
+	def at_home(self):
+		return self.position <= 0
+
+	##
+	## control()
+	## One 1 ms pass of the firmware: speed calculation, overload check, position control and drive slew
+	##
+	def control(self):
+		position_mm = self.get_position_mm()
+
+		# dcm_speed_calc()
+		self.speed_mm_per_s = 1000 * abs(position_mm - self.position_mm_old)
+		self.position_mm_old = position_mm
+
+		# dcm_overload_check()
+		if self.direction != self.direction_old:
+			self.overload_strike_counter = 0
+		self.direction_old = self.direction
+		if not self.enabled:
+			self.overload_strike_counter = 0
+		elif self.set_speed == self.max_speed:
+			if self.speed_mm_per_s < dcm_overload_speed_mm_per_s:
+				self.overload_strike_counter += 1
+			else:
+				self.overload_strike_counter = 0
+		if self.overload_strike_counter >= dcm_overload_strike_count_limit:
+			self.overload = True
+			self.enabled = False
+
+		if self.homing:
+			self.calc_speed = dcm_homing_speed
+			self.direction = dcm_reverse
+		else:
+			self.position_control(position_mm)
+
+		# x_axis_set_dcm_drive(), the drive can only ramp up by slew_rate per pass
+		set_speed = self.calc_speed
+		if set_speed > self.set_speed + self.slew_rate:
+			set_speed = self.set_speed + self.slew_rate
+		self.set_speed = set_speed if self.direction != dcm_brake else 0
+
+	##
+	## position_control(position_mm)
+	## dcm_control() and dcm_calculate_speed_limit()
+	##
+	def position_control(self, position_mm):
+		if not self.enabled:
+			self.calc_speed = 0
+			self.direction = dcm_brake
+			return
+
+		# Limit position commands to stay inside the virtual limit
+		if self.position_cmd_mm > (self.length_mm - self.boundary_mm):
+			self.position_cmd_mm = self.length_mm - self.boundary_mm
+		if self.position_cmd_mm < self.boundary_mm:
+			self.position_cmd_mm = self.boundary_mm
+
+		# Stop if at desired position
+		position_error_mm = self.position_cmd_mm - position_mm
+		if abs(position_error_mm) <= 3:
+			self.error_i = 0
+			self.calc_speed = 0
+			self.direction = dcm_brake
+			return
+
+		# PI control
+		self.error_i += c_div(position_error_mm, self.gain_i)
+		self.error_i = max(min(self.error_i, self.integral_limit), -self.integral_limit)
+		error_p = c_div(position_error_mm * self.gain_p, self.gain_p_factor)
+		error_calc = self.error_i + error_p
+
+		# Slow down approaching the ends of the axis, harder the faster we are going
+		if self.direction == dcm_forward:
+			distance_to_limit_mm = (self.length_mm - self.boundary_mm) - position_mm
+		elif self.direction == dcm_reverse:
+			distance_to_limit_mm = position_mm - self.boundary_mm
+		else:
+			distance_to_limit_mm = 0
+		distance_to_limit_mm = max(distance_to_limit_mm, 0)
+		speed_limit_mm_per_s = c_div(distance_to_limit_mm + 5, self.speed_limit_distance_factor) * c_div(10000 - self.speed_mm_per_s + 50, 10)
+		if self.speed_mm_per_s > speed_limit_mm_per_s:
+			if self.direction == dcm_forward:
+				error_calc = speed_limit_mm_per_s - self.speed_mm_per_s
+			elif self.direction == dcm_reverse:
+				error_calc = self.speed_mm_per_s - speed_limit_mm_per_s
+
+		# Drive motor to desired position
+		self.calc_speed = min(self.max_speed, abs(error_calc))
+		self.direction = dcm_forward if error_calc > 0 else dcm_reverse
+
+	##
+	## move(dt)
+	## Advance the motor and paddle by dt seconds at the current drive
+	##
+	def move(self, dt):
+		if self.jammed:
+			self.velocity = 0.0
+			return
+
+		drive = self.set_speed / float(self.max_speed)
+		if self.direction == dcm_reverse:
+			drive = -drive
+
+		acceleration = self.stall_acceleration * (drive - self.velocity / self.no_load_speed)
+		if self.velocity > 0:
+			acceleration -= self.friction
+		elif self.velocity < 0:
+			acceleration += self.friction
+		elif abs(acceleration) <= self.friction:
+			acceleration = 0.0
+		self.velocity += acceleration * dt
+		self.position += self.velocity * dt
+
+		# mechanical end stops
+		if self.position < 0:
+			self.position = 0.0
+			self.velocity = 0.0
+		elif self.position > self.length_mm:
+			self.position = float(self.length_mm)
+			self.velocity = 0.0
+
+## end of class
+
+##
+## PaddleControllerSim(transport, status_period)
+## The paddle controller: answers 0x100 commands with 0x101 status messages every status_period seconds
+## and straight away on every state change, like the firmware
+##
+class PaddleControllerSim(object):
+	def __init__(self, transport, status_period=0.01):
+		self.transport = transport
+		self.status_period = status_period
+
+		# axis parameters from x_axis.h and y_axis.h
+		self.x_axis = SimAxis(775, 100, 54, 3, 10, 1, 5, 2, 30, 4000.0, 60000.0)
+		self.y_axis = SimAxis(850, 100, 76, 5, 10, 1, 10, 1, 75, 6000.0, 80000.0)
+
+		self.state = state_off
+		self.state_cmd = state_cmd_off
+		self.error = error_none
+		self.calibration_step = None
+		self.goal = goal_none
+		self.goal_end_time = 0.0
+		self.light_screen_blocked = False
+
+		self.sim_time = 0.0
+		self.next_status_time = 0.0
+		self.commands_received = 0
+		self.status_sent = 0
+		self.running = False
+		self.thread = None
+
+	##
+	## receive()
+	## can_rx_handler(): take the latest commands from the master controller
+	##
+	def receive(self):
+		for (timestamp, message_id, data, hardware_timestamp) in self.transport.read_batch():
+			if message_id != mc_cmd_pc.message_id or len(data) != mc_cmd_pc.length:
+				continue
+			command = mc_cmd_pc.decode(data)
+			self.commands_received += 1
+			self.x_axis.position_cmd_mm = command.pos_cmd_x_mm
+			if self.state != state_calibration:
+				self.y_axis.position_cmd_mm = command.pos_cmd_y_mm
+			self.state_cmd = command.state_cmd
+
+	##
+	## send_status()
+	## can_send_status()
+	##
+	def send_status(self):
+		pos_x_mm = ((self.x_axis.get_encoder_ticks() * 10 * dcm_mm_per_rev) // dcm_enc_ticks_per_rev) // 10 + paddle_radius_mm + self.x_axis.home_mm
+		pos_y_mm = ((self.y_axis.get_encoder_ticks() * 10 * dcm_mm_per_rev) // dcm_enc_ticks_per_rev) // 10 + paddle_radius_mm + self.y_axis.home_mm
+
+		# the firmware doesn't report motor speeds yet
+		data = pc_status.encode(pos_x_mm=pos_x_mm, pos_y_mm=pos_y_mm, goal_scored=self.goal, state=self.state, error=self.error)
+		if self.transport.write(pc_status.message_id, data):
+			self.status_sent += 1
+		elif self.error == error_none:
+			self.error = error_can_tx
+
+	##
+	## enter_state(new_state)
+	## sm_enter_state()
+	##
+	def enter_state(self, new_state):
+		self.state = new_state
+		enabled = new_state in (state_calibration, state_on)
+		self.x_axis.enabled = enabled
+		self.y_axis.enabled = enabled
+		if new_state == state_calibration:
+			self.calibration_step = 'home_y'
+			self.y_axis.homing = True
+		self.send_status()
+
+	##
+	## error_handling()
+	## sm_error_handling()
+	##
+	def error_handling(self):
+		if self.state_cmd == state_cmd_clear_error:
+			self.error = error_none
+			self.x_axis.overload = False
+			self.y_axis.overload = False
+
+		if self.error != error_none:
+			return
+		if self.y_axis.overload:
+			self.error = error_y_axis_overload
+		elif self.x_axis.overload:
+			self.error = error_x_axis_overload
+		elif self.light_screen_blocked:
+			self.error = error_light_screen_centre
+
+	##
+	## calibrate()
+	## Homing sequence: y to its switch, y out to boundary + 100, x to its switch, then on
+	## The firmware blocks while it does this, here it is spread over the control passes
+	##
+	def calibrate(self):
+		x_axis = self.x_axis
+		y_axis = self.y_axis
+		if self.calibration_step == 'home_y':
+			if y_axis.at_home():
+				y_axis.homing = False
+				y_axis.position = 0.0
+				y_axis.velocity = 0.0
+				y_axis.position_cmd_mm = y_axis.boundary_mm + 100
+				self.calibration_step = 'clear_y'
+		elif self.calibration_step == 'clear_y':
+			if abs(y_axis.position_cmd_mm - y_axis.get_position_mm()) <= 3:
+				x_axis.homing = True
+				self.calibration_step = 'home_x'
+		elif self.calibration_step == 'home_x':
+			if x_axis.at_home():
+				x_axis.homing = False
+				x_axis.position = 0.0
+				x_axis.velocity = 0.0
+				x_axis.position_cmd_mm = x_axis.length_mm / 2
+				y_axis.position_cmd_mm = y_axis.home_mm
+				self.calibration_step = None
+				self.state_cmd = state_cmd_on
+				self.enter_state(state_on)
+
+	##
+	## state_machine_step()
+	## sm_step()
+	##
+	def state_machine_step(self):
+		if (self.error != error_none) and (self.state != state_error):
+			self.x_axis.homing = False
+			self.y_axis.homing = False
+			self.enter_state(state_error)
+			return
+
+		if self.state == state_off:
+			if self.state_cmd in (state_cmd_on, state_cmd_calibration):
+				self.enter_state(state_calibration)
+		elif self.state == state_calibration:
+			self.calibrate()
+		elif self.state == state_on:
+			if self.state_cmd == state_cmd_off:
+				self.enter_state(state_off)
+			elif self.state_cmd == state_cmd_calibration:
+				self.enter_state(state_calibration)
+		elif self.state == state_error:
+			if (self.error == error_none) and (self.state_cmd == state_cmd_clear_error):
+				self.enter_state(state_off)
+
+	##
+	## step()
+	## One control period of the firmware and the mechanics
+	##
+	def step(self):
+		self.receive()
+		self.error_handling()
+		self.state_machine_step()
+
+		for axis in (self.x_axis, self.y_axis):
+			axis.control()
+			axis.move(control_period)
+
+		self.sim_time += control_period
+		if self.goal != goal_none and self.sim_time >= self.goal_end_time:
+			self.goal = goal_none
+		if self.sim_time >= self.next_status_time:
+			self.send_status()
+			self.next_status_time += self.status_period
+
+	##
+	## advance(duration)
+	## Run the simulation for duration seconds of simulated time, as fast as possible
+	##
+	def advance(self, duration):
+		for i in range(int(round(duration / control_period))):
+			self.step()
+
+	##
+	## score_goal(goal, duration)
+	## Block a goal light screen for duration seconds, goal is goal_human or goal_robot
+	##
+	def score_goal(self, goal, duration=0.5):
+		self.goal = goal
+		self.goal_end_time = self.sim_time + duration
+
+	##
+	## start() / stop()
+	## Run the simulation in real time on a background thread
+	##
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target=self.run, name="paddle_controller_sim")
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.running = False
+		if self.thread is not None:
+			self.thread.join(1.0)
+
+	def run(self):
+		start_time = get_time() - self.sim_time
+		while self.running:
+			# catch up with the wall clock, then sleep until the next control pass is due
+			while self.sim_time < get_time() - start_time:
+				self.step()
+			time.sleep(control_period)
+
+## end of class
+
+##############################################################################################
+## MAIN() function
+##############################################################################################
+
+if __name__ == '__main__':
+	interface = sys.argv[1] if len(sys.argv) > 1 else 'vcan0'
+	transport = create_can_transport('socketcan', interface)
+	if not transport.open():
+		print "Could not open %s: %s" % (interface, transport.last_error)
+		sys.exit(1)
+
+	sim = PaddleControllerSim(transport)
+	sim.start()
+	print "Paddle controller simulator running on %s, Ctrl+C to stop" % interface
+	try:
+		while True:
+			time.sleep(1.0)
+			print "state %i error %i x %i mm y %i mm, %i commands received, %i status sent, %s" % (sim.state, sim.error,
+				sim.x_axis.get_position_mm(), sim.y_axis.get_position_mm(), sim.commands_received, sim.status_sent, transport.get_stats())
+	except KeyboardInterrupt:
+		sim.stop()
+		transport.close()
+
+## end of function
@@ -0,0 +1,197 @@
+# shared_struct.py
+# Shared memory records for the IPC between the MC, PT and UI processes, in place of multiprocessing.Array
+#
+# A record is laid out by its enumeration in settings.json, one float64 field per name in the enumeration's order,
+# so the enum value is the field index and pt_tx[pt_tx_enum.sequence] works as it did on the Array. The record
+# lives in a RawArray behind a sequence counter and nothing takes a lock: the process writing the record makes the
+# counter odd, writes and makes it even again (a seqlock). A reader copies the whole record and keeps the copy only
+# if the counter was even and unchanged across it, otherwise it copies again, so it never sees half of one update
+# and half of the next the way reading an Array element by element can.
+#
+# A process that changes fields all through its loop can batch its writes instead: record[index] = value then only
+# stages the value and publish() writes everything staged as one update, once a loop.
+#
+# The seqlock needs one writer per record, the counter update isn't atomic: pt_tx is written by the PT, pt_rx and
+# ui_rx by the MC, ui_tx by the UI, and nothing else. A process never clears a field in another's record, it answers
+# in its own instead: the UI acknowledges a goal with goal_acknowledged in ui_tx, and the MC echoes the count of the
+# last diagnostic request it handled in ui_rx (diagnostic_request_handled) rather than setting the request to idle.
+
+import ctypes
+import multiprocessing.sharedctypes
+import time
+import numpy as np
+
+# a reader gives up waiting for a writer to finish after this long and takes the last complete copy it read
+# instead (s), so a writer that died half way through an update can't hang the others
+snapshot_timeout = 0.01
+
+##
+## SharedStruct(field_names)
+## One record of float64 fields named by field_names (an enumeration list from settings.json) in shared memory
+## Inherited by child processes like a multiprocessing.Array
+##
+class SharedStruct(object):
+	def __init__(self, field_names):
+		self.field_names = list(field_names)
+		self.dtype = np.dtype([(str(name), np.float64) for name in self.field_names])
+
+		# sequence counter followed by the record
+		self.raw = multiprocessing.sharedctypes.RawArray(ctypes.c_uint8, 8 + self.dtype.itemsize)
+		self.batch_writes = False
+		self.staged = {}
+		self.map_arrays()
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		for name in ('sequence', 'record', 'values'):
+			del state[name]
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.map_arrays()
+
+	##
+	## map_arrays()
+	## Create the numpy views onto the shared memory, the record both by field name and as a flat array
+	##
+	def map_arrays(self):
+		self.sequence = np.frombuffer(self.raw, dtype=np.int64, count=1, offset=0)
+		self.record = np.frombuffer(self.raw, dtype=self.dtype, count=1, offset=8)
+		self.values = self.record.view(np.float64)
+		self.last_snapshot = [0.0]*len(self.field_names)
+		self.reset_stats()
+
+	##
+	## reset_stats()
+	## Clear this process's read, write and snapshot counters
+	##
+	def reset_stats(self):
+		self.reads = 0				# single fields read
+		self.writes = 0				# updates written, one field or many
+		self.staged_writes = 0		# fields staged while batching writes
+		self.snapshots = 0
+		self.retries = 0			# copies taken again because a write was under way
+		self.timeouts = 0			# snapshots that gave up waiting for a writer and returned the last one, see snapshot_timeout
+
+	def __len__(self):
+		return len(self.field_names)
+
+	##
+	## set_batch_writes(batch_writes)
+	## WRITER: Whether record[index] = value in this process waits for publish() (True) or is written straight away
+	## Only affects this process's copy, so set it after the child processes have started
+	##
+	def set_batch_writes(self, batch_writes):
+		self.publish()
+		self.batch_writes = batch_writes
+
+	##
+	## begin_write() / end_write()
+	## WRITER: Bracket an update, readers retry any copy taken in between
+	##
+	def begin_write(self):
+		self.sequence[0] = int(self.sequence[0]) | 1
+
+	def end_write(self):
+		self.sequence[0] = (int(self.sequence[0]) | 1) + 1
+		self.writes += 1
+
+	##
+	## update(fields)
+	## WRITER: Write a dictionary of field index -> value as one update
+	##
+	def update(self, fields):
+		values = self.values
+		self.begin_write()
+		for (index, value) in fields.iteritems():
+			values[index] = value
+		self.end_write()
+
+	##
+	## record[index] = value
+	## WRITER: Write one field as its own update, or stage it for publish() when batching writes
+	## A staged value isn't read back by record[index] until it is published
+	##
+	def __setitem__(self, index, value):
+		if self.batch_writes:
+			self.staged[index] = value
+			self.staged_writes += 1
+			return
+		self.begin_write()
+		self.values[index] = value
+		self.end_write()
+
+	##
+	## publish()
+	## WRITER: Write every staged field as one update, nothing if none were staged
+	##
+	def publish(self):
+		if self.staged:
+			self.update(self.staged)
+			self.staged.clear()
+
+	##
+	## record[index]
+	## One field as a float, an aligned 8 byte read so the field itself is never torn, but two fields read this
+	## way can come from different updates; use snapshot() to read fields that belong together
+	##
+	def __getitem__(self, index):
+		self.reads += 1
+		return self.values.item(index)
+
+	##
+	## snapshot()
+	## READER: Copy of the whole record from a single update, as a list of floats indexed like the record
+	##
+	def snapshot(self):
+		sequence = self.sequence
+		values = self.values
+		self.snapshots += 1
+		give_up_time = None
+		while True:
+			start = sequence[0]
+			if not start & 1:
+				copy = values.tolist()
+				if sequence[0] == start:
+					self.last_snapshot = copy
+					return copy
+
+			# a write is under way, let the writer run and try again
+			self.retries += 1
+			now = time.time()
+			if give_up_time is None:
+				give_up_time = now + snapshot_timeout
+			elif now > give_up_time:
+				self.timeouts += 1
+				return list(self.last_snapshot)
+			time.sleep(0)
+
+	##
+	## snapshot_record()
+	## READER: Like snapshot(), but as a numpy record of the structured dtype with its fields by name
+	##
+	def snapshot_record(self):
+		return np.array(tuple(self.snapshot()), dtype=self.dtype)
+
+	##
+	## get_accesses()
+	## How many times this process has gone to the shared record: single field reads, updates and snapshots
+	## Each of these would have taken the lock at least once on a multiprocessing.Array, most took it once per field
+	##
+	def get_accesses(self):
+		return self.reads + self.writes + self.snapshots
+
+	##
+	## get_stats()
+	## This process's reads, writes, snapshots and how often a snapshot had to wait for a writer
+	##
+	def get_stats(self):
+		return {'reads': self.reads,
+				'writes': self.writes,
+				'staged_writes': self.staged_writes,
+				'snapshots': self.snapshots,
+				'retries': self.retries,
+				'timeouts': self.timeouts}
+
+## end of class
@@ -0,0 +1,89 @@
+# trajectory.py
+# Closed form puck trajectory prediction with bounces off the side walls
+#
+# Unfold the table: every bounce off a side wall mirrors the rest of the path, so a bouncing puck travels
+# the same straight line it would on a table made of mirrored copies laid side by side.
+# Follow the straight line to the intercept, then fold the x position back onto the real table with a modulo.
+# That costs the same for any number of bounces, so a shot that is nearly parallel to the goal can't
+# keep the loop bouncing for thousands of iterations.
+#
+# The puck centre moves between x_min and x_max, the walls less a puck radius.
+
+import math
+import numpy as np
+
+##
+## fold_position_x(x, x_min, x_max)
+## Fold an unfolded x position back between the walls
+##
+def fold_position_x(x, x_min, x_max):
+	width = x_max - x_min
+	x = (x - x_min) % (2*width)
+	if x > width:
+		x = 2*width - x
+	return x_min + x
+
+## end of function
+
+##
+## get_intercept_position_x(position_x, position_y, vector_x, vector_y, intercept_y, x_min, x_max)
+## x position where a puck at position, heading along vector, crosses the line y = intercept_y
+## Returns None if the puck never crosses it (vector_y is 0)
+##
+def get_intercept_position_x(position_x, position_y, vector_x, vector_y, intercept_y, x_min, x_max):
+	if vector_y == 0:
+		return None
+	unfolded_x = position_x + (intercept_y - position_y)*vector_x/vector_y
+	return fold_position_x(unfolded_x, x_min, x_max)
+
+## end of function
+
+##
+## get_trajectory_points(position_x, position_y, vector_x, vector_y, intercept_y, x_min, x_max, max_bounces)
+## Points along the predicted path: the puck, every bounce and the intercept, as a list of (x, y)
+## Only the first max_bounces bounces are listed, the intercept is always last
+## Returns an empty list if the puck never crosses intercept_y
+##
+def get_trajectory_points(position_x, position_y, vector_x, vector_y, intercept_y, x_min, x_max, max_bounces=10):
+	if vector_y == 0:
+		return []
+
+	points = [(position_x, position_y)]
+	width = x_max - x_min
+	unfolded_x = position_x + (intercept_y - position_y)*vector_x/vector_y
+
+	# walls the unfolded line crosses are at x_min + k*width, even k is the x_min wall and odd k the x_max wall
+	start = (position_x - x_min)/width
+	end = (unfolded_x - x_min)/width
+	if end > start:
+		walls = range(int(math.floor(start)) + 1, int(math.ceil(end)))
+	else:
+		walls = range(int(math.ceil(start)) - 1, int(math.floor(end)), -1)
+
+	for k in walls[:max_bounces]:
+		bounce_y = position_y + (x_min + k*width - position_x)*vector_y/vector_x
+		points.append((x_min if k % 2 == 0 else x_max, bounce_y))
+
+	points.append((fold_position_x(unfolded_x, x_min, x_max), intercept_y))
+	return points
+
+## end of function
+
+##
+## get_intercept_positions_x(positions_x, positions_y, vectors_x, vectors_y, intercepts_y, x_min, x_max)
+## Batched get_intercept_position_x(), every argument but x_min and x_max can be an array (or a scalar to share)
+## so many trajectories or many candidate intercept lines are evaluated at once
+## Returns an array of x positions, NaN where the puck never crosses its intercept line
+##
+def get_intercept_positions_x(positions_x, positions_y, vectors_x, vectors_y, intercepts_y, x_min, x_max):
+	positions_x = np.asarray(positions_x, dtype=np.float64)
+	vectors_y = np.asarray(vectors_y, dtype=np.float64)
+	width = x_max - x_min
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		unfolded_x = positions_x + (np.asarray(intercepts_y) - positions_y)*vectors_x/vectors_y
+		x = np.mod(unfolded_x - x_min, 2*width)
+		x = x_min + np.where(x > width, 2*width - x, x)
+	return np.where((vectors_y == 0) | ~np.isfinite(unfolded_x), np.nan, x)
+
+## end of function
@@ -5,7 +5,6 @@
 ##############################################################################################
 import cv2
 import json
-import Queue
 import sys
 from kivy.app import App
 from kivy.clock import Clock
@@ -90,8 +89,9 @@ class ManualScreen(BoxLayout, Screen):
     def on_enter(self):
         self.manager.ui_tx[ui_tx_enum.screen] = ui_screen_enum.manual
         self.get_scaling_factors()
-        self.manager.ui_tx[ui_tx_enum.paddle_position_x] = self.ids['playing_surface'].ids['paddle'].pos[0]*scaling_factor_x
-        self.manager.ui_tx[ui_tx_enum.paddle_position_y] = self.ids['playing_surface'].ids['paddle'].pos[1]*scaling_factor_y
+        paddle_position = self.ids['playing_surface'].ids['paddle'].pos
+        self.manager.ui_tx.update({ui_tx_enum.paddle_position_x: paddle_position[0]*scaling_factor_x,
+                                   ui_tx_enum.paddle_position_y: paddle_position[1]*scaling_factor_y})
         self.ids['game_control'].on_enter()
 
     def get_scaling_factors(self, *args):
@@ -111,13 +111,10 @@ class DiagnosticsScreen(BoxLayout, Screen):
     def clear_errors(self, *args):
         global ui_error
         ui_error = ui_error_enum.none
-        self.manager.ui_rx[ui_rx_enum.pt_error] = pt_error_enum.none
-        self.manager.ui_rx[ui_rx_enum.pc_error] = pc_error_enum.none
-        self.manager.ui_rx[ui_rx_enum.mc_error] = mc_error_enum.none
-        self.manager.ui_tx[ui_tx_enum.diagnostic_request] = ui_diagnostic_request_enum.clear_errors
+        self.manager.post_diagnostic_request(ui_diagnostic_request_enum.clear_errors)
 
     def calibrate_paddle_controller(self, *args):
-        self.manager.ui_tx[ui_tx_enum.diagnostic_request] = ui_diagnostic_request_enum.calibrate_paddle_controller
+        self.manager.post_diagnostic_request(ui_diagnostic_request_enum.calibrate_paddle_controller)
         
 class SettingsScreen(BoxLayout, Screen):
     def __init__(self, **kwargs):
@@ -304,6 +301,8 @@ class ScreenManagement(ScreenManager):
         self.ui_rx = ui_rx
         self.ui_tx = ui_tx
         self.visualization_data = visualization_data
+        self.goal_acknowledged = False
+        self.diagnostic_request_count = 0
 
         # screen management
         self.transition = FadeTransition()
@@ -320,43 +319,64 @@ class ScreenManagement(ScreenManager):
         # run the UI loop
         Clock.schedule_interval(self.process_data, 0.1)
 
+    def post_diagnostic_request(self, request):
+        """Make a one shot request of the master controller, it acts on each count once and echoes it in ui_rx"""
+        self.diagnostic_request_count += 1
+        self.ui_tx.update({ui_tx_enum.diagnostic_request: request,
+                           ui_tx_enum.diagnostic_request_count: self.diagnostic_request_count})
+
     def process_data(self, *args):
         global error_set
         global error_indcator
         global last_error_set
         
-        # update ui state
-        self.ui_tx[ui_tx_enum.state] = ui_state
+        # everything from the master controller this time round, read in one go
+        mc_data = self.ui_rx.snapshot()
 
         # update state and error labels
         self.get_screen('diagnostics').ids['ui_state_label'].text = ui_state_enum.reverse_mapping[ui_state]
         self.get_screen('diagnostics').ids['ui_error_label'].text = ui_error_enum.reverse_mapping[ui_error]
-        self.get_screen('diagnostics').ids['pt_state_label'].text = pt_state_enum.reverse_mapping[self.ui_rx[ui_rx_enum.pt_state]]
-        self.get_screen('diagnostics').ids['pt_error_label'].text = pt_error_enum.reverse_mapping[self.ui_rx[ui_rx_enum.pt_error]]
-        self.get_screen('diagnostics').ids['mc_state_label'].text = mc_state_enum.reverse_mapping[self.ui_rx[ui_rx_enum.mc_state]]
-        self.get_screen('diagnostics').ids['mc_error_label'].text = mc_error_enum.reverse_mapping[self.ui_rx[ui_rx_enum.mc_error]]
-        self.get_screen('diagnostics').ids['pc_state_label'].text = pc_state_enum.reverse_mapping[self.ui_rx[ui_rx_enum.pc_state]]
-        self.get_screen('diagnostics').ids['pc_error_label'].text = pc_error_enum.reverse_mapping[self.ui_rx[ui_rx_enum.pc_error]]
+        self.get_screen('diagnostics').ids['pt_state_label'].text = pt_state_enum.reverse_mapping[mc_data[ui_rx_enum.pt_state]]
+        self.get_screen('diagnostics').ids['pt_error_label'].text = pt_error_enum.reverse_mapping[mc_data[ui_rx_enum.pt_error]]
+        self.get_screen('diagnostics').ids['mc_state_label'].text = mc_state_enum.reverse_mapping[mc_data[ui_rx_enum.mc_state]]
+        self.get_screen('diagnostics').ids['mc_error_label'].text = mc_error_enum.reverse_mapping[mc_data[ui_rx_enum.mc_error]]
+        self.get_screen('diagnostics').ids['pc_state_label'].text = pc_state_enum.reverse_mapping[mc_data[ui_rx_enum.pc_state]]
+        self.get_screen('diagnostics').ids['pc_error_label'].text = pc_error_enum.reverse_mapping[mc_data[ui_rx_enum.pc_error]]
         
-        # update game settings for master controller
-        self.ui_tx[ui_tx_enum.game_mode] = game_mode
-        self.ui_tx[ui_tx_enum.game_speed_x] = game_speed_x
-        self.ui_tx[ui_tx_enum.game_speed_y] = game_speed_y
+        # keep track of score, the master controller clears the goal once we acknowledge it in ui_tx
+        goal_scored = int(mc_data[ui_rx_enum.goal_scored])
+        if goal_scored == ui_goal_scored_enum.none:
+            self.goal_acknowledged = False
+        elif not self.goal_acknowledged:
+            if self.current == 'visual':
+                self.get_screen('visual').ids['game_control'].add_goal(goal_scored)
+            elif self.current == 'manual':
+                self.get_screen('manual').ids['game_control'].add_goal(goal_scored)
+            self.goal_acknowledged = True
+
+        # update ui state and game settings for master controller, written as one update
+        ui_data = {ui_tx_enum.state: ui_state,
+                   ui_tx_enum.game_mode: game_mode,
+                   ui_tx_enum.game_speed_x: game_speed_x,
+                   ui_tx_enum.game_speed_y: game_speed_y,
+                   ui_tx_enum.goal_acknowledged: self.goal_acknowledged}
 
         # transmit hsv data when we're calibrating fiducials or puck
         if self.current == 'fiducial_calibration' or self.current == 'puck_calibration':
-            self.ui_tx[ui_tx_enum.lower_hue] = self.get_screen(self.current).ids['lower_hue'].value
-            self.ui_tx[ui_tx_enum.lower_sat] = self.get_screen(self.current).ids['lower_sat'].value
-            self.ui_tx[ui_tx_enum.lower_val] = self.get_screen(self.current).ids['lower_val'].value
-            self.ui_tx[ui_tx_enum.upper_hue] = self.get_screen(self.current).ids['upper_hue'].value
-            self.ui_tx[ui_tx_enum.upper_sat] = self.get_screen(self.current).ids['upper_sat'].value
-            self.ui_tx[ui_tx_enum.upper_val] = self.get_screen(self.current).ids['upper_val'].value
+            ids = self.get_screen(self.current).ids
+            ui_data.update({ui_tx_enum.lower_hue: ids['lower_hue'].value,
+                            ui_tx_enum.lower_sat: ids['lower_sat'].value,
+                            ui_tx_enum.lower_val: ids['lower_val'].value,
+                            ui_tx_enum.upper_hue: ids['upper_hue'].value,
+                            ui_tx_enum.upper_sat: ids['upper_sat'].value,
+                            ui_tx_enum.upper_val: ids['upper_val'].value})
+        self.ui_tx.update(ui_data)
         
         # error handling logic
         if (ui_error != ui_error_enum.none or
-            self.ui_rx[ui_rx_enum.pt_error] != pt_error_enum.none or
-            self.ui_rx[ui_rx_enum.pc_error] != pc_error_enum.none or
-            self.ui_rx[ui_rx_enum.mc_error] != mc_error_enum.none):
+            mc_data[ui_rx_enum.pt_error] != pt_error_enum.none or
+            mc_data[ui_rx_enum.pc_error] != pc_error_enum.none or
+            mc_data[ui_rx_enum.mc_error] != mc_error_enum.none):
             error_set = True
         else:
             error_set = False
@@ -371,16 +391,8 @@ class ScreenManagement(ScreenManager):
                 
         last_error_set = error_set
 
-        # keep track of score
-        if int(self.ui_rx[ui_rx_enum.goal_scored]) != ui_goal_scored_enum.none:
-            if self.current == 'visual':
-                self.get_screen('visual').ids['game_control'].add_goal(self.ui_rx[ui_rx_enum.goal_scored])
-            elif self.current == 'manual':
-                self.get_screen('manual').ids['game_control'].add_goal(self.ui_rx[ui_rx_enum.goal_scored])
-            self.ui_rx[ui_rx_enum.goal_scored] = ui_goal_scored_enum.none
-
         # only quit this app once everything else has shut down properly
-        if int(self.ui_rx[ui_rx_enum.state_cmd]) == ui_state_cmd_enum.quit:
+        if int(mc_data[ui_rx_enum.state_cmd]) == ui_state_cmd_enum.quit:
             self.get_screen('menu').okay_to_quit()
 
 ##############################################################################################
@@ -484,11 +496,8 @@ class CameraData(Image):
         Clock.unschedule(self.update_data)
 
     def update_data(self, *args):
-        try:
-            frame = app.root.visualization_data.get(False)
-        except Queue.Empty:
-            pass
-        else:
+        frame = app.root.visualization_data.read_latest()
+        if frame is not None:
             frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             frame_flipped = cv2.flip(frame_rgb, 0)
             frame_string = frame_flipped.tostring()
@@ -511,8 +520,8 @@ class ManualPaddle(Scatter):
             self.center = (self.center[0],(self.parent.size[1] - 50))
 
         # update paddle position
-        self.parent.parent.manager.ui_tx[ui_tx_enum.paddle_position_x] = self.pos[0]*scaling_factor_x
-        self.parent.parent.manager.ui_tx[ui_tx_enum.paddle_position_y] = self.pos[1]*scaling_factor_y
+        self.parent.parent.manager.ui_tx.update({ui_tx_enum.paddle_position_x: self.pos[0]*scaling_factor_x,
+                                                 ui_tx_enum.paddle_position_y: self.pos[1]*scaling_factor_y})
 
 class ManualPlayingSurface(Widget):
     pass
@@ -693,11 +702,14 @@ def ui_process(ui_rx, ui_tx, visualization_data):
 
     ui_state = ui_state_enum.idle
     ui_error = ui_error_enum.none
+    last_mc_cmd = ui_state_cmd_enum.idle
 
     while True:
-        # retrieve commands from master controller
+        # retrieve commands from master controller, acting on each once since only the master controller writes ui_rx
         mc_cmd = int(ui_rx[ui_rx_enum.state_cmd])
-        ui_rx[ui_rx_enum.state_cmd] = ui_state_cmd_enum.idle
+        if mc_cmd == last_mc_cmd:
+            continue
+        last_mc_cmd = mc_cmd
 
         # set desired state of the user interface to that commanded by mc    
         if mc_cmd == ui_state_cmd_enum.run: